@@ -0,0 +1,192 @@
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+from config import BACKUP_DIR, BACKUP_INTERVAL_MIN, BACKUP_KEEP, BACKUP_PAGES, BACKUP_SLEEP_MS
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = '.db.gz'
+# Первая копия после запуска, если прошлая устарела, - не раньше чем через
+# столько секунд, чтобы не копировать базу вместе с прогревом бота
+STARTUP_DELAY = 60
+# Уровень gzip: 9 медленнее в 4 раза при выигрыше в размере на несколько процентов
+COMPRESS_LEVEL = 6
+_CHUNK = 1024 * 1024
+
+def backup_name(path, moment=None):
+    """Имя копии: fitness_tracker.db -> fitness_tracker-20240301-120000.db.gz"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{stem}-{(moment or datetime.now()):%Y%m%d-%H%M%S}{SUFFIX}"
+
+def list_backups(path, directory=BACKUP_DIR):
+    """Копии базы path в directory, от старых к новым"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return sorted(glob.glob(os.path.join(glob.escape(directory), glob.escape(stem) + '-*' + SUFFIX)))
+
+def snapshot(path, directory=BACKUP_DIR, keep=BACKUP_KEEP, pages=BACKUP_PAGES,
+             pause=BACKUP_SLEEP_MS / 1000):
+    """Онлайн-копия базы в directory со сжатием и ротацией; возвращает (путь, байт, шагов).
+
+    Копирование идет через backup API шагами по pages страниц с паузой
+    pause между ними. Все шаги читают один снимок в открытой транзакции
+    чтения: в режиме WAL она не мешает записи, а запись между шагами
+    не заставляет начинать копирование заново. keep - сколько последних
+    копий оставить (0 - все).
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"нет базы {path}")
+    os.makedirs(directory, exist_ok=True)
+    target = os.path.join(directory, backup_name(path))
+    raw = target + '.tmp'
+    steps = 0
+
+    def progress(status, remaining, total):
+        # sleep у backup() срабатывает только при занятой базе, паузу между
+        # шагами, чтобы копирование не забирало весь диск, делаем сами
+        nonlocal steps
+        steps += 1
+        if remaining and pause:
+            time.sleep(pause)
+
+    source = sqlite3.connect(path)
+    destination = sqlite3.connect(raw)
+    try:
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(destination, pages=pages, progress=progress)
+        source.rollback()
+        check = destination.execute('PRAGMA quick_check').fetchone()[0]
+        if check != 'ok':
+            raise sqlite3.DatabaseError(f"копия не прошла проверку: {check}")
+    finally:
+        source.close()
+        destination.close()
+
+    try:
+        with open(raw, 'rb') as file, open(target + '.part', 'wb') as output:
+            with gzip.GzipFile(os.path.basename(target)[:-3], 'wb', COMPRESS_LEVEL, output) as archive:
+                shutil.copyfileobj(file, archive, _CHUNK)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(target + '.part', target)
+    finally:
+        for leftover in (raw, target + '.part'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    if keep > 0:
+        for old in list_backups(path, directory)[:-keep]:
+            os.remove(old)
+    return target, os.path.getsize(target), steps
+
+def restore(archive, path):
+    """Восстановление базы path из копии .db.gz (или несжатой .db).
+
+    Копия проверяется до записи и переносится через backup API, поэтому
+    WAL и разделяемая память целевой базы остаются согласованными.
+    Бот на время восстановления должен быть остановлен.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        raw = os.path.join(tmp, 'restore.db')
+        opener = gzip.open if archive.endswith('.gz') else open
+        with opener(archive, 'rb') as file, open(raw, 'wb') as output:
+            shutil.copyfileobj(file, output, _CHUNK)
+
+        source = sqlite3.connect(raw)
+        try:
+            check = source.execute('PRAGMA quick_check').fetchone()[0]
+            if check != 'ok':
+                raise sqlite3.DatabaseError(f"копия {archive} повреждена: {check}")
+            target = sqlite3.connect(path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+
+class BackupScheduler:
+    """Периодические копии базы SQLite бота в фоновом потоке.
+
+    Срок следующей копии считается от времени последней копии в каталоге,
+    поэтому перезапуски бота не сбивают расписание и не плодят копии.
+    """
+
+    def __init__(self, path, interval=BACKUP_INTERVAL_MIN * 60, directory=BACKUP_DIR,
+                 keep=BACKUP_KEEP):
+        self.path = path
+        self.interval = interval
+        self.directory = directory
+        self.keep = keep
+        self._lock = asyncio.Lock()
+        self._task = None
+
+        self.count = 0
+        self.failed = 0
+        self.last_seconds = 0.0
+        self.last_bytes = 0
+
+    def last_time(self):
+        """Время последней копии (unix time) или None"""
+        backups = list_backups(self.path, self.directory)
+        return os.path.getmtime(backups[-1]) if backups else None
+
+    async def backup_now(self):
+        """Копия сейчас; возвращает (путь, байт, секунд)"""
+        async with self._lock:
+            start = time.perf_counter()
+            try:
+                target, size, steps = await asyncio.to_thread(snapshot, self.path, self.directory,
+                                                              self.keep)
+            except Exception:
+                self.failed += 1
+                raise
+            self.count += 1
+            self.last_seconds = time.perf_counter() - start
+            self.last_bytes = size
+        logger.info("Резервная копия %s: %d байт, %d шагов, %.1fс",
+                    target, size, steps, self.last_seconds)
+        return target, size, self.last_seconds
+
+    async def run(self):
+        while True:
+            last = self.last_time()
+            delay = STARTUP_DELAY if last is None else last + self.interval - time.time()
+            if self.count == 0:
+                delay = max(delay, STARTUP_DELAY)
+            await asyncio.sleep(max(0, delay))
+            try:
+                await self.backup_now()
+            except Exception:
+                logger.exception("Ошибка резервного копирования")
+                await asyncio.sleep(STARTUP_DELAY)
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        """Счетчики копирования"""
+        last = self.last_time()
+        return {
+            'count': self.count,
+            'failed': self.failed,
+            'last_seconds': round(self.last_seconds, 3),
+            'last_bytes': self.last_bytes,
+            'age_seconds': round(time.time() - last) if last is not None else -1,
+        }
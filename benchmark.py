@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки производительности фитнес-бота
+
+Запуск:
+    python benchmark.py db --sizes 10000 100000 1000000
+    python benchmark.py writes --events 20000
+    python benchmark.py cache --users 1000
+    python benchmark.py food --catalog 100000
+    python benchmark.py catalog --catalog 500000
+    python benchmark.py parser --messages 100000
+    python benchmark.py report --years 5
+    python benchmark.py backup --rows 1000000
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from backup import snapshot
+from cache import UserCache
+from database import Database
+from food_catalog import FoodCatalog
+from food_database import FOOD_DATABASE
+from food_index import FoodIndex, normalize
+from storage import workout_key
+from text_parser import parse
+
+def measure(func, repeat=200):
+    """Медианное время вызова функции в миллисекундах"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def fill_database(db, rows, users, days):
+    """Заполнение базы синтетическими записями (rows строк в каждой таблице)"""
+    today = date.today()
+    rng = random.Random(rows)
+    batch = 50000
+
+    for offset in range(0, rows, batch):
+        count = min(batch, rows - offset)
+        keys = [(rng.randrange(users), today - timedelta(days=rng.randrange(days)))
+                for _ in range(count)]
+        workouts = [(user_id, day, workout_key()) for user_id, day in keys]
+        with db._write() as cursor:
+            cursor.executemany('''
+                INSERT INTO meals (user_id, meal_type, food_name, calories, protein, carbs, fat, meal_date)
+                VALUES (?, 'обед', 'гречка', 343, 13, 72, 3.4, ?)
+            ''', keys)
+            cursor.executemany('''
+                INSERT INTO water (user_id, amount, drink_date) VALUES (?, 250, ?)
+            ''', keys)
+            cursor.executemany('''
+                INSERT INTO workouts (user_id, workout_type, duration, workout_date, workout_key)
+                VALUES (?, 'кардио', 30, ?, ?)
+            ''', workouts)
+            cursor.executemany('''
+                INSERT INTO workout_exercises (user_id, workout_date, workout_type, exercise,
+                                               workout_key)
+                VALUES (?, ?, 'кардио', 'бег', ?)
+            ''', workouts)
+            cursor.executemany('''
+                INSERT INTO weight (user_id, weight, weight_date) VALUES (?, 75.5, ?)
+            ''', keys)
+
+def drop_indexes(db):
+    """Удаление индексов для сравнения с полным сканированием"""
+    with db._write() as cursor:
+        for name in ('idx_meals_user_date', 'idx_water_user_date', 'idx_workouts_user_date',
+                     'idx_workout_exercises_user_date', 'idx_weight_user_date'):
+            cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+def bench_db(args):
+    """Время выборок за день в зависимости от размера таблиц"""
+    print(f"{'строк':>10} {'индексы':>8} {'meals, мс':>10} {'water, мс':>10} {'weight, мс':>11} "
+          f"{'workouts, мс':>13}")
+
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, 'bench.db'))
+            # Замеряем саму базу, а не кэш чтений
+            db.cache = UserCache(max_users=0)
+            fill_database(db, size, args.users, args.days)
+            if args.no_index:
+                drop_indexes(db)
+
+            user_id = args.users // 2
+            meal_date = date.today()
+            results = [
+                measure(lambda: db.get_daily_meals(user_id, meal_date), args.repeat),
+                measure(lambda: db.get_daily_water(user_id, meal_date), args.repeat),
+                measure(lambda: db.get_weight_history(user_id, 7), args.repeat),
+                measure(lambda: db.get_workout_stats(user_id, 7), args.repeat),
+            ]
+            db.close()
+
+        print(f"{size:>10} {'нет' if args.no_index else 'да':>8} "
+              f"{results[0]:>10.3f} {results[1]:>10.3f} {results[2]:>11.3f} {results[3]:>13.3f}")
+
+def bench_report(args):
+    """Отчеты за период для пользователя с многолетней историей"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'), write_behind=False)
+        fill_database(db, args.rows, args.users, args.years * 365)
+        today = date.today()
+        history = [today - timedelta(days=day) for day in range(args.years * 365)]
+        db.import_rows('meals', [(0, 'обед', 'гречка', 343, 13, 72, 3.4, day, None)
+                                 for day in history for _ in range(3)])
+        db.import_rows('water', [(0, 250, day, None) for day in history for _ in range(6)])
+        db.import_rows('weight', [(0, 75.5, day, None) for day in history])
+
+        print(f"История: {args.years} лет, {args.rows} строк других пользователей")
+        for period in ('week', 'month', 'year'):
+            first = measure(lambda: db.get_report(0, period), args.repeat)
+            last = measure(lambda: db.get_report(0, period, page=5), args.repeat)
+            print(f"{period:>6}: первая страница {first:.3f}мс, шестая {last:.3f}мс")
+        db.close()
+
+def bench_writes(args):
+    """Пропускная способность записи воды: построчно и с отложенной записью"""
+    for write_behind in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Database(os.path.join(tmp, 'bench.db'), write_behind=write_behind)
+            with db._write() as cursor:
+                cursor.execute(f'PRAGMA synchronous={args.synchronous}')
+            per_thread = args.events // args.threads
+
+            def worker(offset):
+                for i in range(per_thread):
+                    db.add_water(offset + i % args.users, 250)
+
+            threads = [threading.Thread(target=worker, args=(n * args.users,))
+                       for n in range(args.threads)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            db.close()
+            elapsed = time.perf_counter() - start
+
+        mode = 'отложенная' if write_behind else 'построчная'
+        print(f"{mode:>11}: {per_thread * args.threads / elapsed:>10.0f} событий/с")
+
+def bench_cache(args):
+    """Повторное открытие меню воды: чтения из базы против кэша"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'bench.db'))
+        fill_database(db, args.rows, args.users, 30)
+        rng = random.Random(0)
+        user_ids = [rng.randrange(args.users) for _ in range(args.requests)]
+
+        def open_menu():
+            for user_id in user_ids:
+                db.get_user(user_id)
+                db.get_daily_water(user_id)
+
+        for max_users in (0, args.users):
+            db.cache = UserCache(max_users=max_users)
+            elapsed = measure(open_menu, args.repeat)
+            mode = 'кэш' if max_users else 'без кэша'
+            print(f"{mode:>9}: {elapsed * 1000 / len(user_ids):>8.1f} мкс/меню  {db.cache.stats()}")
+        db.close()
+
+def synthetic_catalog(size, seed=1):
+    """Синтетический каталог продуктов заданного размера"""
+    rng = random.Random(seed)
+    words = sorted({word for name in FOOD_DATABASE for word in name.split()})
+    modifiers = ['вареный', 'жареный', 'запеченный', 'сушеный', 'свежий', 'замороженный',
+                 'копченый', 'маринованный', 'домашний', 'фермерский']
+    syllables = ['ка', 'ро', 'ми', 'ла', 'ту', 'не', 'зо', 'ви', 'ся', 'пу']
+
+    catalog = dict(FOOD_DATABASE)
+    while len(catalog) < size:
+        brand = ''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+        name = f"{rng.choice(words)} {rng.choice(modifiers)} {brand}"
+        catalog[name] = [rng.randint(10, 900), rng.random() * 30, rng.random() * 30, rng.random() * 70]
+    return catalog
+
+def linear_lookup(catalog, food_name):
+    """Прежний поиск продукта перебором всего каталога"""
+    food_name_lower = food_name.lower().strip()
+    if food_name_lower in catalog:
+        return catalog[food_name_lower]
+    for food, nutrition in catalog.items():
+        if food_name_lower in food or food in food_name_lower:
+            return nutrition
+    return None
+
+def bench_food(args):
+    """Поиск продукта: перебор каталога против FoodIndex"""
+    catalog = synthetic_catalog(args.catalog)
+    names = list(catalog)
+
+    start = time.perf_counter()
+    index = FoodIndex(names)
+    print(f"Каталог: {len(names)} продуктов, построение индекса: "
+          f"{time.perf_counter() - start:.2f}с")
+
+    queries = {
+        'точное': [names[i] for i in range(0, len(names), max(1, len(names) // 50))],
+        'слово': ['овсянка', 'курица', 'творог', 'гречка', 'лосось'],
+        'префикс': ['овся', 'кур', 'твор', 'греч', 'брок'],
+        'опечатка': ['гречкa', 'авокодо', 'броколи', 'апельсинн', 'шпинатт'],
+        'нет в базе': ['пицца пепперони', 'суши', 'xyz'],
+    }
+    print(f"{'запрос':>12} {'перебор, мкс':>14} {'индекс, мкс':>13}")
+    for kind, items in queries.items():
+        items = [normalize(item) for item in items]
+        linear = measure(lambda: [linear_lookup(catalog, item) for item in items],
+                         args.repeat) * 1000 / len(items)
+        indexed = measure(lambda: [index.search(item) for item in items],
+                          args.repeat) * 1000 / len(items)
+        print(f"{kind:>12} {linear:>14.1f} {indexed:>13.1f}")
+
+def rss_mb():
+    """Текущий RSS процесса в мегабайтах (Linux)"""
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+def bench_catalog(args):
+    """Загрузка большого каталога: словарь из JSON против бинарного файла"""
+    with tempfile.TemporaryDirectory() as tmp:
+        foods = synthetic_catalog(args.catalog)
+        json_path = os.path.join(tmp, 'catalog.json')
+        bin_path = os.path.join(tmp, 'catalog.bin')
+        with open(json_path, 'w', encoding='utf-8') as file:
+            json.dump(foods, file, ensure_ascii=False)
+        FoodCatalog.from_dict(foods).save(bin_path)
+        names = list(foods)
+        del foods
+
+        before = rss_mb()
+        start = time.perf_counter()
+        if args.mode == 'json':
+            with open(json_path, encoding='utf-8') as file:
+                catalog = json.load(file)
+            lookup = lambda: catalog[names[len(names) // 2]]
+        else:
+            catalog = FoodCatalog.open(bin_path)
+            lookup = lambda: catalog.nutrition(len(catalog) // 2)
+        elapsed = time.perf_counter() - start
+        loaded = rss_mb()
+
+        print(f"{args.mode:>5}: {args.catalog} продуктов, загрузка {elapsed * 1000:.1f}мс, "
+              f"RSS +{loaded - before:.1f}МБ, чтение значений "
+              f"{measure(lookup, args.repeat) * 1000:.2f}мкс")
+
+        if args.index:
+            start = time.perf_counter()
+            index = FoodIndex(catalog.names() if args.mode == 'mmap' else list(catalog))
+            print(f"       поисковый индекс: {time.perf_counter() - start:.1f}с, "
+                  f"RSS +{rss_mb() - loaded:.1f}МБ")
+
+def message_corpus(size, seed=1):
+    """Синтетические сообщения пользователей: приемы пищи, вода, вес, тренировки"""
+    rng = random.Random(seed)
+    foods = list(FOOD_DATABASE)
+    meal_types = ['завтрак', 'обед', 'ужин', 'перекус']
+    templates = [
+        lambda: f"{rng.choice(meal_types)} " + " ".join(
+            f"{rng.choice(foods)} {rng.randint(50, 300)}{rng.choice(['', 'г', ' г', 'гр'])}"
+            for _ in range(rng.randint(1, 4))),
+        lambda: f"{rng.choice(meal_types).title()} {rng.choice(foods)} {rng.randint(100, 300)} мл",
+        lambda: f"вода {rng.choice([200, 250, 300, 500])}",
+        lambda: f"выпил {rng.choice([200, 300, 500])} мл",
+        lambda: f"{rng.choice(['0.5', '1', '1,5'])} л воды",
+        lambda: rng.choice(["стакан воды", "2 стакана воды"]),
+        lambda: f"{rng.randint(150, 500)}",
+        lambda: f"вес {rng.randint(55, 110)}.{rng.randint(0, 9)}",
+        lambda: f"{rng.randint(55, 110)},{rng.randint(0, 9)} кг",
+        lambda: f"кардио {rng.choice(['бег', 'ходьба', 'велотренажер'])} {rng.randint(15, 60)} мин",
+        lambda: f"молоко {rng.randint(100, 300)}мл",
+        lambda: rng.choice(["привет", "спасибо!", "что съесть на ужин?", "сколько калорий в банане"]),
+    ]
+    return [rng.choice(templates)() for _ in range(size)]
+
+_LEGACY_GRAMS_RE = re.compile(r'(\d+(?:[.,]\d+)?)(?:г|гр|грамм|граммов)?')
+
+def legacy_parse(text):
+    """Прежний разбор из handle_text: поиск подстрок, re.findall и split"""
+    text = text.lower()
+    if any(word in text for word in ['завтрак', 'обед', 'ужин', 'перекус']):
+        items, words = [], []
+        for token in text.partition(' ')[2].split():
+            match = _LEGACY_GRAMS_RE.fullmatch(token)
+            if match and words:
+                items.append((' '.join(words), float(match.group(1).replace(',', '.'))))
+                words = []
+            elif token not in {'г', 'гр', 'грамм', 'граммов'}:
+                words.append(token)
+        return 'meal', items
+    elif 'вода' in text or 'мл' in text:
+        numbers = re.findall(r'\d+', text)
+        return ('water', int(numbers[0])) if numbers else ('unknown', None)
+    elif 'вес' in text and any(char.isdigit() for char in text):
+        return 'weight', float(re.findall(r'\d+\.?\d*', text)[0])
+    return 'unknown', None
+
+def bench_parser(args):
+    """Разбор сообщений: прежние проверки подстрок против text_parser"""
+    corpus = message_corpus(args.messages)
+    for name, parse_text in (('прежний', legacy_parse), ('text_parser', parse)):
+        start = time.perf_counter()
+        kinds = [parse_text(text)[0] for text in corpus]
+        elapsed = time.perf_counter() - start
+        counts = {kind: kinds.count(kind) for kind in sorted(set(kinds))}
+        print(f"{name:>12}: {len(corpus) / elapsed:,.0f} сообщений/с, {counts}")
+
+    differences = {}
+    for text in corpus:
+        old, new = legacy_parse(text)[0], parse(text).kind
+        if old != new:
+            differences.setdefault((old, new), text)
+    print("Расхождения (прежний -> text_parser):")
+    for (old, new), example in sorted(differences.items()):
+        print(f"  {old} -> {new}: {example!r}")
+
+def bench_backup(args):
+    """Задержка записи во время онлайн-копирования базы"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        backups = os.path.join(tmp, 'backups')
+        db = Database(path, write_behind=False)
+        fill_database(db, args.rows, args.users, 365)
+        print(f"База {os.path.getsize(path) / 1024 / 1024:.0f} МБ, запись {args.rate} событий/с")
+
+        def run(name, action):
+            # Запись с постоянной частотой, как у бота, а не на пределе диска
+            latencies = []
+            stop = threading.Event()
+
+            def writer():
+                rng = random.Random(args.rate)
+                deadline = time.perf_counter()
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    db.add_water(rng.randrange(args.users), 250)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    deadline += 1 / args.rate
+                    time.sleep(max(0.0, deadline - time.perf_counter()))
+
+            thread = threading.Thread(target=writer)
+            thread.start()
+            start = time.perf_counter()
+            result = action()
+            elapsed = time.perf_counter() - start
+            stop.set()
+            thread.join()
+            latencies.sort()
+            p99 = latencies[int(len(latencies) * 0.99)]
+            steps = f", {result[2]} шагов, копия {result[1] / 1024 / 1024:.0f} МБ" if result else ""
+            print(f"{name:>22}: {elapsed:>5.1f}с, запись p50 {statistics.median(latencies):.2f}мс, "
+                  f"p99 {p99:.2f}мс, макс {latencies[-1]:.2f}мс{steps}")
+
+        run('без копирования', lambda: time.sleep(args.idle))
+        run(f'шагами по {args.pages} стр.',
+            lambda: snapshot(path, backups, pages=args.pages, pause=args.pause / 1000))
+        run('одним шагом', lambda: snapshot(path, backups, pages=-1, pause=0))
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки фитнес-бота')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    db_parser = subparsers.add_parser('db', help='выборки из базы данных')
+    db_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                           help='количество строк в каждой таблице')
+    db_parser.add_argument('--users', type=int, default=10000)
+    db_parser.add_argument('--days', type=int, default=365)
+    db_parser.add_argument('--repeat', type=int, default=200)
+    db_parser.add_argument('--no-index', action='store_true',
+                           help='удалить индексы перед замером')
+    db_parser.set_defaults(func=bench_db)
+
+    report_parser = subparsers.add_parser('report', help='отчеты за период')
+    report_parser.add_argument('--years', type=int, default=5)
+    report_parser.add_argument('--rows', type=int, default=100000)
+    report_parser.add_argument('--users', type=int, default=1000)
+    report_parser.add_argument('--repeat', type=int, default=100)
+    report_parser.set_defaults(func=bench_report)
+
+    writes_parser = subparsers.add_parser('writes', help='запись частых событий')
+    writes_parser.add_argument('--events', type=int, default=20000)
+    writes_parser.add_argument('--threads', type=int, default=8)
+    writes_parser.add_argument('--users', type=int, default=100)
+    writes_parser.add_argument('--synchronous', default='NORMAL', choices=['NORMAL', 'FULL'])
+    writes_parser.set_defaults(func=bench_writes)
+
+    cache_parser = subparsers.add_parser('cache', help='кэш горячих чтений')
+    cache_parser.add_argument('--rows', type=int, default=100000)
+    cache_parser.add_argument('--users', type=int, default=1000)
+    cache_parser.add_argument('--requests', type=int, default=5000)
+    cache_parser.add_argument('--repeat', type=int, default=5)
+    cache_parser.set_defaults(func=bench_cache)
+
+    food_parser = subparsers.add_parser('food', help='поиск продуктов в каталоге')
+    food_parser.add_argument('--catalog', type=int, default=100000,
+                             help='размер синтетического каталога')
+    food_parser.add_argument('--repeat', type=int, default=20)
+    food_parser.set_defaults(func=bench_food)
+
+    catalog_parser = subparsers.add_parser('catalog', help='загрузка каталога продуктов')
+    catalog_parser.add_argument('--catalog', type=int, default=500000)
+    catalog_parser.add_argument('--mode', choices=['json', 'mmap'], default='mmap')
+    catalog_parser.add_argument('--index', action='store_true',
+                                help='также построить поисковый индекс')
+    catalog_parser.add_argument('--repeat', type=int, default=1000)
+    catalog_parser.set_defaults(func=bench_catalog)
+
+    parser_parser = subparsers.add_parser('parser', help='разбор текстовых сообщений')
+    parser_parser.add_argument('--messages', type=int, default=100000)
+    parser_parser.set_defaults(func=bench_parser)
+
+    backup_parser = subparsers.add_parser('backup', help='задержка записи во время резервного копирования')
+    backup_parser.add_argument('--rows', type=int, default=1000000)
+    backup_parser.add_argument('--users', type=int, default=10000)
+    backup_parser.add_argument('--rate', type=int, default=200, help='записей в секунду')
+    backup_parser.add_argument('--pages', type=int, default=256, help='страниц за шаг')
+    backup_parser.add_argument('--pause', type=float, default=5, help='пауза между шагами, мс')
+    backup_parser.add_argument('--idle', type=float, default=5, help='замер без копирования, с')
+    backup_parser.set_defaults(func=bench_backup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
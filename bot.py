@@ -1,12 +1,29 @@
+import asyncio
+import io
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import os
+import signal
+import tempfile
+from datetime import date
+from http import HTTPStatus
+from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-from datetime import datetime, date
-import json
 
-from config import BOT_TOKEN, FOOD_CATEGORIES, EXERCISES
-from database import Database
-from food_database import get_food_info, calculate_meal_nutrition, get_food_recommendations, get_meal_suggestions
+import render
+import text_parser
+from backup import BackupScheduler
+from chart import ChartRenderer
+from config import (BOT_TOKEN, DEFAULT_WATER_GOAL, RUN_MODE, WEBHOOK_URL, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, PORT, ADMIN_IDS, PROFILE_AT_START)
+from storage import REPORT_PERIODS, create_storage
+from diary_io import MAX_DOWNLOAD_SIZE, DiaryWriter, format_of, read_records
+from food_database import calculate_meals_nutrition, get_food_index
+from metrics import Metrics
+from profiling import SamplingProfiler, SlowQueryCursor
+from reminders import DEFAULT_HOURS, DEFAULT_INTERVALS, ReminderScheduler
+from router import CallbackRouter
+from scheduler import UserOrderedProcessor, get_updates, is_update
+from web_server import create_server
 
 # Настройка логирования
 logging.basicConfig(
@@ -15,484 +32,614 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация базы данных
-db = Database()
-
 class FitnessBot:
-    def __init__(self):
-        self.application = Application.builder().token(BOT_TOKEN).build()
+    def __init__(self, mode=RUN_MODE, request=None):
+        self.mode = mode
+        # Хранилище открывается при создании бота, а не при импорте модуля:
+        # процессы отрисовки графиков (spawn) импортируют модуль запуска заново
+        # и не должны открывать базу (SQLite или PostgreSQL по DATABASE_URL)
+        self.db = create_storage()
+        # Метрики обработчиков и хранилища для /metrics и /stats
+        self.metrics = Metrics()
+        self.metrics.instrument_storage(self.db)
+        self.scheduler = UserOrderedProcessor()
+        self.router = CallbackRouter()
+        self.charts = ChartRenderer()
+        self.reminders = ReminderScheduler(self.db, self.send_reminder)
+        self.profiler = SamplingProfiler()
+        # Резервные копии - только для локального SQLite
+        self.backups = BackupScheduler(self.db.database.db_path) if hasattr(self.db, 'database') else None
+        self.metrics.collect('updates', self.scheduler.stats)
+        self.metrics.collect('reminders', self.reminders.stats)
+        self.metrics.collect('charts', lambda: {'rendered': self.charts.rendered, **self.charts.cache.stats()})
+        if hasattr(self.db, 'database'):
+            self.metrics.collect('cache', self.db.database.cache.stats)
+            self.metrics.collect('backup', self.backups.stats)
+        builder = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(self.scheduler)
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+        )
+        if request is not None:
+            # Свой транспорт запросов к Bot API (имитация в load_test.py)
+            builder.request(request)
+        # Обновления приходят через HTTP-сервер, от фронта шардов или из poll():
+        # Updater забирает их без оглядки на переполнение очереди обработки
+        builder.updater(None)
+        self.application = builder.build()
         self.setup_handlers()
     
+    async def post_init(self, application: Application):
+        """Подключение к хранилищу, запуск фоновых задач и построение поискового индекса продуктов"""
+        await self.db.connect()
+        self.metrics.start()
+        self.reminders.start()
+        if self.backups is not None:
+            self.backups.start()
+        if PROFILE_AT_START:
+            logger.info("Профиль запуска: %s", self.profiler.start(PROFILE_AT_START))
+        asyncio.get_running_loop().run_in_executor(None, get_food_index)
+    
+    async def post_shutdown(self, application: Application):
+        """Остановка напоминаний и копирования, закрытие базы данных и пула отрисовки графиков"""
+        await self.reminders.stop()
+        if self.backups is not None:
+            await self.backups.stop()
+        await self.metrics.stop()
+        if self.profiler.running:
+            await asyncio.to_thread(self.profiler.stop)
+        self.charts.close()
+        await self.db.close()
+    
     def setup_handlers(self):
-        """Настройка обработчиков команд"""
-        # Основные команды
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        self.application.add_handler(CommandHandler("menu", self.main_menu))
-        
-        # Питание
-        self.application.add_handler(CommandHandler("food", self.food_menu))
-        self.application.add_handler(CommandHandler("add_meal", self.add_meal_command))
-        self.application.add_handler(CommandHandler("daily_food", self.daily_food_command))
-        
-        # Вода
-        self.application.add_handler(CommandHandler("water", self.water_menu))
-        self.application.add_handler(CommandHandler("add_water", self.add_water_command))
-        
-        # Тренировки
-        self.application.add_handler(CommandHandler("workout", self.workout_menu))
-        self.application.add_handler(CommandHandler("add_workout", self.add_workout_command))
-        
-        # Прогресс
-        self.application.add_handler(CommandHandler("weight", self.weight_menu))
-        self.application.add_handler(CommandHandler("add_weight", self.add_weight_command))
-        self.application.add_handler(CommandHandler("progress", self.progress_command))
-        
-        # Рекомендации
-        self.application.add_handler(CommandHandler("tips", self.tips_command))
-        self.application.add_handler(CommandHandler("vitamins", self.vitamins_command))
-        
-        # Обработчики кнопок
-        self.application.add_handler(CallbackQueryHandler(self.button_handler))
+        """Настройка обработчиков команд и кнопок"""
+        # Экраны: команды и кнопки, открывающие один и тот же обработчик
+        screens = [
+            # Основные команды
+            (("start",), (), self.start_command),
+            (("help",), (), self.help_command),
+            (("menu",), ("main_menu",), self.main_menu),
+            # Питание
+            (("food",), ("food_menu",), self.food_menu),
+            (("add_meal",), ("add_meal",), self.add_meal_command),
+            (("daily_food",), ("daily_food",), self.daily_food_command),
+            # Вода
+            (("water",), ("water_menu",), self.water_menu),
+            (("add_water",), (), self.add_water_command),
+            # Тренировки
+            (("workout",), ("workout_menu",), self.workout_menu),
+            (("add_workout",), ("add_workout",), self.add_workout_command),
+            (("workout_stats",), ("workout_stats",), self.workout_stats),
+            # Прогресс
+            (("weight",), ("progress_menu",), self.weight_menu),
+            (("add_weight",), ("add_weight",), self.add_weight_command),
+            (("progress",), (), self.progress_command),
+            (("report",), (), self.report_command),
+            (("chart",), (), self.chart_command),
+            ((), ("weight_history",), self.weight_history),
+            # Рекомендации
+            (("tips",), ("tips_menu", "food_tips"), self.tips_command),
+            (("vitamins",), (), self.vitamins_command),
+            # Напоминания
+            (("remind",), (), self.remind_command),
+            # Выгрузка и загрузка дневника
+            (("export",), (), self.export_command),
+            (("import",), (), self.import_command),
+        ]
+        for commands, callbacks, handler in screens:
+            handler = self.metrics.track(handler)
+            for command in commands:
+                self.application.add_handler(CommandHandler(command, handler))
+            for key in callbacks:
+                self.router.exact(key, handler)
+        
+        # Диагностика: только для ADMIN_IDS, в справке не показывается
+        admins = filters.User(user_id=ADMIN_IDS)
+        for command, handler in (("profile", self.profile_command),
+                                 ("slow_queries", self.slow_queries_command),
+                                 ("backup", self.backup_command)):
+            self.application.add_handler(CommandHandler(command, self.metrics.track(handler), filters=admins))
+        
+        # Кнопки с параметрами
+        self.router.prefix(render.WATER_PREFIX, self.metrics.track(self.water_button), int)
+        self.router.prefix(render.REPORT_PREFIX, self.metrics.track(self.report_page), str, int)
+        self.router.prefix(render.CHART_PREFIX, self.metrics.track(self.send_chart), str)
+        self.application.add_handler(CallbackQueryHandler(self.router.dispatch))
         
         # Обработчик текстовых сообщений
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
+        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND,
+                                                    self.metrics.track(self.handle_text)))
+        # Файлы дневника для загрузки
+        self.application.add_handler(MessageHandler(filters.Document.ALL,
+                                                    self.metrics.track(self.import_document)))
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user = update.effective_user
-        db.add_user(user.id, user.username, user.first_name)
-        
-        welcome_text = f"""
-🎉 Привет, {user.first_name}! 
-
-Я твой персональный фитнес-ассистент для похудения! 
-
-Что я умею:
-✅ Вести дневник питания и считать калории
-✅ Напоминать пить воду
-✅ Планировать тренировки
-✅ Отслеживать прогресс
-✅ Давать рекомендации по питанию и витаминам
-
-Нажми /menu чтобы открыть главное меню!
-        """
-        
-        await update.message.reply_text(welcome_text)
+        await self.db.add_user(user.id, user.username, user.first_name)
+        await update.effective_message.reply_text(render.WELCOME_TEXT.format(first_name=user.first_name))
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
-        help_text = """
-📋 Доступные команды:
-
-🍽 Питание:
-/food - меню питания
-/add_meal - добавить прием пищи
-/daily_food - дневник питания за сегодня
-
-💧 Вода:
-/water - меню воды
-/add_water - добавить выпитую воду
-
-🏋️ Тренировки:
-/workout - меню тренировок
-/add_workout - добавить тренировку
-
-📊 Прогресс:
-/weight - меню веса
-/add_weight - добавить вес
-/progress - общий прогресс
-
-💡 Рекомендации:
-/tips - советы по питанию
-/vitamins - рекомендации по витаминам
-
-/menu - главное меню
-        """
-        await update.message.reply_text(help_text)
+        await update.effective_message.reply_text(render.HELP_TEXT)
     
     async def main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Главное меню"""
-        keyboard = [
-            [InlineKeyboardButton("🍽 Питание", callback_data="food_menu")],
-            [InlineKeyboardButton("💧 Вода", callback_data="water_menu")],
-            [InlineKeyboardButton("🏋️ Тренировки", callback_data="workout_menu")],
-            [InlineKeyboardButton("📊 Прогресс", callback_data="progress_menu")],
-            [InlineKeyboardButton("💡 Советы", callback_data="tips_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            "🎯 Главное меню\nВыберите раздел:",
-            reply_markup=reply_markup
-        )
+        await update.effective_message.reply_text(render.MAIN_MENU_TEXT, reply_markup=render.MAIN_MENU)
     
     async def food_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Меню питания"""
-        keyboard = [
-            [InlineKeyboardButton("➕ Добавить прием пищи", callback_data="add_meal")],
-            [InlineKeyboardButton("📋 Дневник питания", callback_data="daily_food")],
-            [InlineKeyboardButton("💡 Рекомендации", callback_data="food_tips")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            "🍽 Меню питания\nЧто хотите сделать?",
-            reply_markup=reply_markup
-        )
+        await update.effective_message.reply_text(render.FOOD_MENU_TEXT, reply_markup=render.FOOD_MENU)
     
     async def add_meal_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Добавление приема пищи"""
-        await update.message.reply_text(
-            "🍽 Добавление приема пищи\n\n"
-            "Напишите в формате:\n"
-            "тип_приема_пищи продукт граммы\n\n"
-            "Например:\n"
-            "завтрак овсянка 100\n"
-            "обед курица грудка 150\n"
-            "ужин творог 200\n\n"
-            "Типы приемов пищи: завтрак, обед, ужин, перекус"
-        )
+        await update.effective_message.reply_text(render.ADD_MEAL_TEXT)
     
     async def daily_food_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать дневник питания за сегодня"""
         user_id = update.effective_user.id
-        meals = db.get_daily_meals(user_id)
+        meals, totals = await asyncio.gather(
+            self.db.get_daily_meals(user_id),
+            self.db.get_daily_totals(user_id)
+        )
         
         if not meals:
-            await update.message.reply_text("📋 Сегодня еще нет записей о питании")
+            await update.effective_message.reply_text("📋 Сегодня еще нет записей о питании")
             return
-        
-        total_calories = 0
-        total_protein = 0
-        total_carbs = 0
-        total_fat = 0
-        
-        report = "📋 Дневник питания за сегодня:\n\n"
-        
-        for meal in meals:
-            meal_type, food_name, calories, protein, carbs, fat = meal[2], meal[3], meal[4], meal[5], meal[6], meal[7]
-            report += f"🍽 {meal_type.title()}: {food_name}\n"
-            report += f"   Калории: {calories}, Б: {protein}г, Ж: {fat}г, У: {carbs}г\n\n"
-            
-            total_calories += calories
-            total_protein += protein
-            total_carbs += carbs
-            total_fat += fat
-        
-        report += f"📊 Итого за день:\n"
-        report += f"Калории: {total_calories}\n"
-        report += f"Белки: {total_protein:.1f}г\n"
-        report += f"Жиры: {total_fat:.1f}г\n"
-        report += f"Углеводы: {total_carbs:.1f}г"
-        
-        await update.message.reply_text(report)
+        await update.effective_message.reply_text(render.daily_food_text(meals, totals))
     
     async def water_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Меню воды"""
         user_id = update.effective_user.id
-        daily_water = db.get_daily_water(user_id)
-        user = db.get_user(user_id)
-        water_goal = user[5] if user else 2000
-        
-        keyboard = [
-            [InlineKeyboardButton("💧 +200мл", callback_data="water_200")],
-            [InlineKeyboardButton("💧 +300мл", callback_data="water_300")],
-            [InlineKeyboardButton("💧 +500мл", callback_data="water_500")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        progress = (daily_water / water_goal) * 100
-        progress_bar = "█" * int(progress / 10) + "░" * (10 - int(progress / 10))
-        
-        text = f"💧 Трекер воды\n\n"
-        text += f"Выпито сегодня: {daily_water}мл / {water_goal}мл\n"
-        text += f"Прогресс: {progress_bar} {progress:.1f}%\n\n"
-        text += f"Выберите количество воды:"
-        
-        await update.message.reply_text(text, reply_markup=reply_markup)
+        daily_water, user = await asyncio.gather(
+            self.db.get_daily_water(user_id),
+            self.db.get_user(user_id)
+        )
+        water_goal = user[4] if user else DEFAULT_WATER_GOAL
+        await update.effective_message.reply_text(render.water_text(daily_water, water_goal),
+                                                  reply_markup=render.WATER_MENU)
     
     async def workout_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Меню тренировок"""
-        keyboard = [
-            [InlineKeyboardButton("➕ Добавить тренировку", callback_data="add_workout")],
-            [InlineKeyboardButton("💪 Кардио", callback_data="workout_cardio")],
-            [InlineKeyboardButton("🏋️ Силовые", callback_data="workout_strength")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            "🏋️ Меню тренировок\nВыберите тип тренировки:",
-            reply_markup=reply_markup
-        )
+        await update.effective_message.reply_text(render.WORKOUT_MENU_TEXT,
+                                                  reply_markup=render.WORKOUT_MENU)
     
     async def weight_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Меню веса"""
-        keyboard = [
-            [InlineKeyboardButton("⚖️ Добавить вес", callback_data="add_weight")],
-            [InlineKeyboardButton("📈 История веса", callback_data="weight_history")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await update.message.reply_text(
-            "⚖️ Меню веса\nВыберите действие:",
-            reply_markup=reply_markup
-        )
+        await update.effective_message.reply_text(render.WEIGHT_MENU_TEXT,
+                                                  reply_markup=render.WEIGHT_MENU)
     
     async def tips_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Советы по питанию"""
-        recommendations = get_food_recommendations()
-        meal_suggestions = get_meal_suggestions()
-        
-        text = "💡 Советы по питанию для похудения:\n\n"
-        
-        text += "✅ Рекомендуемые продукты:\n"
-        text += "🥩 Белки: " + ", ".join(recommendations['recommended']['proteins'][:3]) + "\n"
-        text += "🌾 Углеводы: " + ", ".join(recommendations['recommended']['carbs']) + "\n"
-        text += "🥬 Овощи: " + ", ".join(recommendations['recommended']['vegetables'][:3]) + "\n"
-        text += "🍎 Фрукты: " + ", ".join(recommendations['recommended']['fruits'][:3]) + "\n\n"
-        
-        text += "❌ Избегайте:\n"
-        text += ", ".join(recommendations['avoid']) + "\n\n"
-        
-        text += "🍽 Примеры приемов пищи:\n"
-        text += "🌅 Завтрак: " + meal_suggestions['breakfast'][0] + "\n"
-        text += "🌞 Обед: " + meal_suggestions['lunch'][0] + "\n"
-        text += "🌙 Ужин: " + meal_suggestions['dinner'][0] + "\n"
-        text += "🍎 Перекус: " + meal_suggestions['snacks'][0]
-        
-        await update.message.reply_text(text)
+        await update.effective_message.reply_text(render.TIPS_TEXT)
     
     async def vitamins_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Рекомендации по витаминам"""
-        text = "💊 Рекомендации по витаминам для похудения:\n\n"
-        
-        text += "🔬 Основные витамины:\n"
-        text += "• Витамин D - для обмена веществ\n"
-        text += "• Витамин B12 - для энергии\n"
-        text += "• Омега-3 - для жиросжигания\n"
-        text += "• Магний - для мышц\n\n"
-        
-        text += "💡 Рекомендуемые добавки:\n"
-        text += "• Рыбий жир (Омега-3)\n"
-        text += "• Витамин D3 (2000-4000 МЕ)\n"
-        text += "• Магний (200-400мг)\n"
-        text += "• Витамин B-комплекс\n\n"
-        
-        text += "⚠️ Важно: перед приемом витаминов проконсультируйтесь с врачом!"
-        
-        await update.message.reply_text(text)
+        await update.effective_message.reply_text(render.VITAMINS_TEXT)
     
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка текстовых сообщений"""
-        text = update.message.text.lower()
-        user_id = update.effective_user.id
+        # Подсказка /add_water или /add_weight действует на одно следующее сообщение
+        intent = text_parser.parse(update.message.text, context.user_data.pop('expect', None))
+        handlers = {
+            'meal': self.process_meal_input,
+            'water': self.process_water_input,
+            'weight': self.process_weight_input,
+            'workout': self.process_workout_input,
+        }
+        handler = handlers.get(intent.kind)
+        if handler is None:
+            await update.message.reply_text(render.UNKNOWN_TEXT)
+            return
+        await handler(update, intent)
+    
+    async def process_meal_input(self, update: Update, intent):
+        """Обработка ввода приема пищи (один или несколько продуктов)"""
+        if not intent.items:
+            await update.message.reply_text(
+                "❌ Неверный формат. Используйте: тип_приема_пищи продукт граммы\n"
+                "Можно несколько продуктов: обед курица грудка 150 гречка 100"
+            )
+            return
         
-        # Обработка добавления приема пищи
-        if any(word in text for word in ['завтрак', 'обед', 'ужин', 'перекус']):
-            await self.process_meal_input(update, text)
-        # Обработка добавления воды
-        elif 'вода' in text or 'мл' in text:
-            await self.process_water_input(update, text)
-        # Обработка добавления веса
-        elif 'вес' in text and any(char.isdigit() for char in text):
-            await self.process_weight_input(update, text)
-        else:
+        meal = calculate_meals_nutrition(intent.items)
+        if intent.leftover:
+            meal['missing'].append(f"{intent.leftover} (не указаны граммы)")
+        
+        if not meal['items']:
+            missing = ", ".join(meal['missing'])
             await update.message.reply_text(
-                "Не понимаю команду. Используйте /help для списка команд или /menu для главного меню."
+                f"❌ Продукт '{missing}' не найден в базе данных.\n"
+                f"Попробуйте другой продукт или добавьте его вручную."
             )
+            return
+        
+        user_id = update.effective_user.id
+        await self.db.add_meals(user_id, intent.subtype, [
+            (item['name'], item['calories'], item['protein'], item['carbs'], item['fat'])
+            for item in meal['items']
+        ])
+        await update.message.reply_text(render.meal_added_text(intent.subtype, meal))
     
-    async def process_meal_input(self, update: Update, text: str):
-        """Обработка ввода приема пищи"""
-        try:
-            parts = text.split()
-            if len(parts) >= 3:
-                meal_type = parts[0]
-                food_name = parts[1]
-                grams = int(parts[2])
-                
-                nutrition = calculate_meal_nutrition(food_name, grams)
-                if nutrition:
-                    user_id = update.effective_user.id
-                    db.add_meal(user_id, meal_type, food_name, 
-                               nutrition['calories'], nutrition['protein'], 
-                               nutrition['carbs'], nutrition['fat'])
-                    
-                    await update.message.reply_text(
-                        f"✅ Добавлен {meal_type}: {food_name} ({grams}г)\n"
-                        f"Калории: {nutrition['calories']}, "
-                        f"Б: {nutrition['protein']}г, "
-                        f"Ж: {nutrition['fat']}г, "
-                        f"У: {nutrition['carbs']}г"
-                    )
-                else:
-                    await update.message.reply_text(
-                        f"❌ Продукт '{food_name}' не найден в базе данных.\n"
-                        f"Попробуйте другой продукт или добавьте его вручную."
-                    )
-            else:
-                await update.message.reply_text(
-                    "❌ Неверный формат. Используйте: тип_приема_пищи продукт граммы"
-                )
-        except ValueError:
-            await update.message.reply_text("❌ Неверный формат. Укажите количество в граммах.")
-    
-    async def process_water_input(self, update: Update, text: str):
+    async def process_water_input(self, update: Update, intent):
         """Обработка ввода воды"""
-        try:
-            # Извлечение числа из текста
-            import re
-            numbers = re.findall(r'\d+', text)
-            if numbers:
-                amount = int(numbers[0])
-                user_id = update.effective_user.id
-                db.add_water(user_id, amount)
-                
-                daily_water = db.get_daily_water(user_id)
-                await update.message.reply_text(
-                    f"✅ Добавлено {amount}мл воды\n"
-                    f"Всего за день: {daily_water}мл"
-                )
-            else:
-                await update.message.reply_text("❌ Укажите количество воды в миллилитрах.")
-        except ValueError:
-            await update.message.reply_text("❌ Неверный формат. Укажите количество в миллилитрах.")
+        if not intent.amount:
+            await update.message.reply_text("❌ Укажите количество воды в миллилитрах.")
+            return
+        
+        user_id = update.effective_user.id
+        await self.db.add_water(user_id, intent.amount)
+        daily_water = await self.db.get_daily_water(user_id)
+        await update.message.reply_text(
+            f"✅ Добавлено {intent.amount}мл воды\n"
+            f"Всего за день: {daily_water}мл"
+        )
     
-    async def process_weight_input(self, update: Update, text: str):
+    async def process_weight_input(self, update: Update, intent):
         """Обработка ввода веса"""
-        try:
-            import re
-            numbers = re.findall(r'\d+\.?\d*', text)
-            if numbers:
-                weight = float(numbers[0])
-                user_id = update.effective_user.id
-                db.add_weight(user_id, weight)
-                
-                await update.message.reply_text(f"✅ Вес {weight}кг добавлен!")
-            else:
-                await update.message.reply_text("❌ Укажите вес в килограммах.")
-        except ValueError:
-            await update.message.reply_text("❌ Неверный формат. Укажите вес в килограммах.")
+        if not intent.amount:
+            await update.message.reply_text("❌ Укажите вес в килограммах.")
+            return
+        
+        await self.db.add_weight(update.effective_user.id, intent.amount)
+        await update.message.reply_text(f"✅ Вес {intent.amount}кг добавлен!")
+    
+    async def process_workout_input(self, update: Update, intent):
+        """Обработка ввода тренировки"""
+        if not intent.amount:
+            await update.message.reply_text(
+                "❌ Укажите длительность в минутах: тип_тренировки упражнения минуты\n"
+                "Например: кардио бег 30"
+            )
+            return
+        
+        user_id = update.effective_user.id
+        await self.db.add_workout(user_id, intent.subtype, intent.items, intent.amount)
+        stats = await self.db.get_workout_stats(user_id, 7)
+        await update.message.reply_text(
+            render.workout_added_text(intent.subtype, intent.items, intent.amount, stats))
     
     async def add_water_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Добавление выпитой воды"""
-        await update.message.reply_text(
-            "💧 Добавление воды\n\n"
-            "Напишите количество выпитой воды в миллилитрах\n"
-            "Например: 300"
-        )
+        context.user_data['expect'] = 'water'
+        await update.effective_message.reply_text(render.ADD_WATER_TEXT)
     
     async def add_workout_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Добавление тренировки"""
-        await update.message.reply_text(
-            "🏋️ Добавление тренировки\n\n"
-            "Напишите в формате:\n"
-            "тип_тренировки упражнения минуты\n\n"
-            "Например:\n"
-            "кардио бег 30\n"
-            "силовые приседания жим_лежа 45\n\n"
-            "Типы: кардио, силовые, растяжка"
-        )
+        await update.effective_message.reply_text(render.ADD_WORKOUT_TEXT)
     
     async def add_weight_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Добавление веса"""
-        await update.message.reply_text(
-            "⚖️ Добавление веса\n\n"
-            "Напишите ваш вес в килограммах\n"
-            "Например: 75.5"
-        )
+        context.user_data['expect'] = 'weight'
+        await update.effective_message.reply_text(render.ADD_WEIGHT_TEXT)
     
     async def progress_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Общий прогресс"""
         user_id = update.effective_user.id
         
         # Получаем данные за сегодня
-        meals = db.get_daily_meals(user_id)
-        daily_water = db.get_daily_water(user_id)
-        weight_history = db.get_weight_history(user_id, 1)
+        totals, weight_history = await asyncio.gather(
+            self.db.get_daily_totals(user_id),
+            self.db.get_weight_history(user_id, 1)
+        )
         
-        text = "📊 Ваш прогресс за сегодня:\n\n"
+        await update.effective_message.reply_text(render.progress_text(totals, weight_history))
+    
+    async def report_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отчет за период: /report week|month|year"""
+        period = await self._period_argument(update, context, "/report")
+        if period is not None:
+            await self.report_page(update, context, period, 0)
+    
+    async def _period_argument(self, update: Update, context: ContextTypes.DEFAULT_TYPE, command):
+        """Период из аргумента команды (по умолчанию неделя) или None с подсказкой"""
+        period = context.args[0].lower() if context.args else 'week'
+        if period not in REPORT_PERIODS:
+            await update.effective_message.reply_text(
+                f"❌ Укажите период: {command} week, {command} month или {command} year")
+            return None
+        return period
+    
+    async def report_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
+                          period: str, page: int):
+        """Страница отчета; кнопки листания заменяют текст того же сообщения"""
+        if period not in REPORT_PERIODS or page < 0:
+            return
+        rows, has_more = await self.db.get_report(update.effective_user.id, period, page,
+                                                  render.REPORT_PAGE_SIZE)
+        text = render.report_text(period, REPORT_PERIODS[period][1], rows, page)
+        markup = render.report_keyboard(period, page, has_more)
+        if update.callback_query is not None:
+            await update.callback_query.edit_message_text(text, reply_markup=markup)
+        else:
+            await update.effective_message.reply_text(text, reply_markup=markup)
+    
+    async def chart_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """График веса и калорий: /chart week|month|year"""
+        period = await self._period_argument(update, context, "/chart")
+        if period is not None:
+            await self.send_chart(update, context, period)
+    
+    async def send_chart(self, update: Update, context: ContextTypes.DEFAULT_TYPE, period: str):
+        """Отправка графика: из кэша по file_id или отрисовка в пуле процессов"""
+        if period not in REPORT_PERIODS:
+            return
+        user_id = update.effective_user.id
+        rows, _ = await self.db.get_report(user_id, period, 0, REPORT_PERIODS[period][0])
+        if not rows:
+            await update.effective_message.reply_text(render.report_text(period, None, rows, 0))
+            return
         
-        # Калории
-        total_calories = sum(meal[4] for meal in meals) if meals else 0
-        text += f"🍽 Калории: {total_calories}\n"
+        digest, image = await self.charts.render(user_id, period, rows)
+        message = await update.effective_message.reply_photo(
+            image, caption=render.chart_caption(period, rows))
+        if isinstance(image, bytes) and message.photo:
+            self.charts.remember(user_id, period, digest, message.photo[-1].file_id)
+    
+    async def remind_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Напоминания: /remind [water|meal [минуты] [с-до]] или /remind off [water|meal]"""
+        user_id = update.effective_user.id
+        args = [arg.lower() for arg in context.args or ()]
+        if not args:
+            await update.effective_message.reply_text(
+                render.reminders_text(await self.db.get_reminders(user_id)))
+            return
         
-        # Вода
-        text += f"💧 Вода: {daily_water}мл\n"
+        if args[0] == 'off':
+            kind = args[1] if len(args) > 1 else None
+            if kind not in (None, *DEFAULT_INTERVALS):
+                await update.effective_message.reply_text(render.REMIND_USAGE_TEXT)
+                return
+            await self.reminders.cancel(user_id, kind)
+            await update.effective_message.reply_text("🔕 Напоминания выключены")
+            return
         
-        # Вес
-        if weight_history:
-            current_weight = weight_history[0][0]
-            text += f"⚖️ Текущий вес: {current_weight}кг\n"
+        kind = args[0]
+        if kind not in DEFAULT_INTERVALS:
+            await update.effective_message.reply_text(render.REMIND_USAGE_TEXT)
+            return
+        try:
+            interval_min = int(args[1]) if len(args) > 1 else DEFAULT_INTERVALS[kind]
+            start_hour, end_hour = (map(int, args[2].split('-')) if len(args) > 2
+                                    else DEFAULT_HOURS)
+        except ValueError:
+            await update.effective_message.reply_text(render.REMIND_USAGE_TEXT)
+            return
+        if not 15 <= interval_min <= 720 or not 0 <= start_hour < end_hour <= 24:
+            await update.effective_message.reply_text(
+                "❌ Интервал - от 15 до 720 минут, часы - от 0 до 24, например 8-22")
+            return
         
-        text += "\n💡 Используйте /menu для полного управления"
+        await self.db.add_user(user_id, update.effective_user.username, update.effective_user.first_name)
+        start_min, end_min = start_hour * 60, end_hour * 60
+        next_due = await self.reminders.schedule(user_id, kind, interval_min, start_min, end_min)
+        await update.effective_message.reply_text(
+            render.reminder_set_text(kind, interval_min, start_min, end_min, next_due))
+    
+    async def export_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгрузка дневника файлом: /export [csv|jsonl]"""
+        fmt = context.args[0].lower() if context.args else 'csv'
+        if fmt not in ('csv', 'jsonl'):
+            await update.effective_message.reply_text("❌ Формат - csv или jsonl: /export jsonl")
+            return
         
-        await update.message.reply_text(text)
+        # Дневник пишется во временный файл пачками, не собираясь целиком в памяти
+        with tempfile.TemporaryFile() as file:
+            text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+            writer = DiaryWriter(text, fmt)
+            async for records in self.db.iter_diary(update.effective_user.id):
+                await asyncio.to_thread(writer.write, records)
+            text.flush()
+            text.detach()
+            if not writer.count:
+                await update.effective_message.reply_text("📋 В дневнике еще нет записей")
+                return
+            file.seek(0)
+            await update.effective_message.reply_document(
+                file, filename=f"diary-{date.today()}.{fmt}",
+                caption=f"💾 Дневник: {writer.count} записей\n/import - загрузить обратно")
+    
+    async def import_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Подсказка по загрузке дневника из файла"""
+        await update.effective_message.reply_text(render.IMPORT_TEXT)
     
-    async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработчик нажатий кнопок"""
-        query = update.callback_query
-        await query.answer()
+    async def import_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Загрузка дневника из присланного файла; подпись replace - заменить дневник"""
+        message = update.effective_message
+        document = message.document
+        fmt = format_of(document.file_name or '')
+        if fmt is None:
+            await message.reply_text("❌ Поддерживаются файлы .csv и .jsonl\n\n" + render.IMPORT_TEXT)
+            return
+        if document.file_size and document.file_size > MAX_DOWNLOAD_SIZE:
+            await message.reply_text("❌ Файл больше 20 МБ - разбейте его на части")
+            return
         
-        if query.data == "main_menu":
-            await self.main_menu(update, context)
-        elif query.data == "food_menu":
-            await self.food_menu(update, context)
-        elif query.data == "water_menu":
-            await self.water_menu(update, context)
-        elif query.data == "workout_menu":
-            await self.workout_menu(update, context)
-        elif query.data == "progress_menu":
-            await self.weight_menu(update, context)
-        elif query.data == "tips_menu":
-            await self.tips_command(update, context)
-        elif query.data.startswith("water_"):
-            amount = int(query.data.split("_")[1])
-            user_id = update.effective_user.id
-            db.add_water(user_id, amount)
-            await self.water_menu(update, context)
-        elif query.data == "daily_food":
-            await self.daily_food_command(update, context)
-        elif query.data == "food_tips":
-            await self.tips_command(update, context)
-        elif query.data == "add_meal":
-            await self.add_meal_command(update, context)
-        elif query.data == "add_workout":
-            await update.callback_query.message.reply_text(
-                "🏋️ Добавление тренировки\n\n"
-                "Напишите в формате:\n"
-                "тип_тренировки упражнения минуты\n\n"
-                "Например:\n"
-                "кардио бег 30\n"
-                "силовые приседания жим_лежа 45\n\n"
-                "Типы: кардио, силовые, растяжка"
-            )
-        elif query.data == "add_weight":
-            await update.callback_query.message.reply_text(
-                "⚖️ Добавление веса\n\n"
-                "Напишите ваш вес в килограммах\n"
-                "Например: 75.5"
-            )
-        elif query.data == "weight_history":
-            user_id = update.effective_user.id
-            history = db.get_weight_history(user_id, 7)
-            
-            if history:
-                text = "📈 История веса за последние 7 дней:\n\n"
-                for weight, weight_date in history:
-                    text += f"{weight_date}: {weight}кг\n"
-                await update.callback_query.message.reply_text(text)
+        user = update.effective_user
+        replace = 'replace' in (message.caption or '').lower().split()
+        await self.db.add_user(user.id, user.username, user.first_name)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f"diary.{fmt}")
+            telegram_file = await document.get_file()
+            await telegram_file.download_to_drive(path)
+            try:
+                # Файл читается построчно внутри транзакции импорта
+                counts = await self.db.import_diary(user.id, read_records(path, fmt), replace)
+            except ValueError as error:
+                await message.reply_text(f"❌ Ошибка в файле, {error}\nНичего не загружено")
+                return
+        await message.reply_text(render.import_done_text(counts, replace))
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выборочное профилирование процесса: /profile [секунд|stop]"""
+        argument = context.args[0].lower() if context.args else None
+        if argument == 'stop':
+            if self.profiler.running:
+                await asyncio.to_thread(self.profiler.stop)
+                text = f"⏹ Профиль записан: {self.profiler.path}"
             else:
-                await update.callback_query.message.reply_text("📈 История веса пуста")
+                text = "Профилирование не запущено"
+        elif self.profiler.running:
+            text = f"⏺ Идет запись профиля в {self.profiler.path}\n/profile stop - завершить досрочно"
+        else:
+            seconds = int(argument) if argument and argument.isdigit() else 30
+            if argument and not argument.isdigit() or not 1 <= seconds <= 600:
+                text = "❌ Длительность - от 1 до 600 секунд: /profile 60"
+            else:
+                path = self.profiler.start(seconds)
+                text = f"⏺ Профилирование {seconds}с, стеки будут записаны в {path}"
+        await update.effective_message.reply_text(text)
+    
+    async def slow_queries_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Журнал медленных запросов SQLite: /slow_queries [мс|off]"""
+        argument = context.args[0].lower() if context.args else None
+        if argument == 'off':
+            SlowQueryCursor.threshold = None
+        elif argument is not None:
+            try:
+                SlowQueryCursor.threshold = float(argument) / 1000
+            except ValueError:
+                await update.effective_message.reply_text("❌ Укажите порог в мс: /slow_queries 50")
+                return
+        threshold = SlowQueryCursor.threshold
+        await update.effective_message.reply_text(
+            "🐢 Журнал медленных запросов выключен" if threshold is None
+            else f"🐢 В журнал пишутся запросы дольше {threshold * 1000:g} мс")
+    
+    async def backup_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Резервная копия базы сейчас, без остановки записи"""
+        if self.backups is None:
+            await update.effective_message.reply_text("Резервные копии делаются только для SQLite")
+            return
+        await update.effective_message.reply_text("💾 Копирование базы...")
+        try:
+            path, size, seconds = await self.backups.backup_now()
+        except Exception as error:
+            logger.exception("Ошибка резервного копирования")
+            await update.effective_message.reply_text(f"❌ Копия не создана: {error}")
+            return
+        await update.effective_message.reply_text(
+            f"✅ Копия {path}: {size / 1024 / 1024:.1f} МБ за {seconds:.1f}с")
+    
+    async def send_reminder(self, user_id, kind, progress):
+        """Отправка напоминания планировщиком; ошибки Telegram обрабатывает планировщик"""
+        if kind == 'water':
+            await self.application.bot.send_message(
+                user_id, render.water_reminder_text(*progress), reply_markup=render.WATER_MENU)
+        else:
+            await self.application.bot.send_message(user_id, render.MEAL_REMINDER_TEXT)
+    
+    async def water_button(self, update: Update, context: ContextTypes.DEFAULT_TYPE, amount: int):
+        """Кнопка добавления воды"""
+        if amount > 0:
+            await self.db.add_water(update.effective_user.id, amount)
+        await self.water_menu(update, context)
+    
+    async def workout_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Тренировки за неделю"""
+        stats = await self.db.get_workout_stats(update.effective_user.id, 7)
+        await update.effective_message.reply_text(render.workout_stats_text(stats))
+    
+    async def weight_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """История веса"""
+        history = await self.db.get_weight_history(update.effective_user.id, 7)
+        await update.effective_message.reply_text(render.weight_history_text(history))
+    
+    async def webhook(self, request):
+        """Прием обновления от Telegram и передача в очередь Application"""
+        if WEBHOOK_SECRET and request.headers.get('x-telegram-bot-api-secret-token') != WEBHOOK_SECRET:
+            return HTTPStatus.FORBIDDEN, {"error": "forbidden"}
+        if not self.scheduler.admit():
+            # Telegram повторит доставку, когда очередь разгрузится
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "overloaded"}
+        update = None
+        try:
+            data = request.json()
+            # de_json возвращает None для пустого объекта и падает на полях не того типа
+            if is_update(data):
+                update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, AttributeError, KeyError):
+            pass
+        if not isinstance(update, Update):
+            return HTTPStatus.BAD_REQUEST, {"error": "invalid update"}
+        await self.application.update_queue.put(update)
+        return HTTPStatus.OK, {}
+    
+    async def poll(self):
+        """Получение обновлений через getUpdates для режима polling.
+        
+        Пока очередь обработки полна, новые обновления не запрашиваются и
+        не подтверждаются: они ждут у Telegram, как при 503 от webhook.
+        """
+        bot = self.application.bot
+        await bot.delete_webhook()
+        offset = None
+        while True:
+            room = await self.scheduler.wait_room()
+            for update in await get_updates(bot, offset, min(100, room)):
+                await self.application.update_queue.put(update)
+                offset = update.update_id + 1
+    
+    async def metrics_endpoint(self, request):
+        """Метрики в формате Prometheus"""
+        return HTTPStatus.OK, self.metrics.prometheus()
+    
+    async def stats_endpoint(self, request):
+        """Сводка метрик в JSON для отладки"""
+        return HTTPStatus.OK, self.metrics.stats()
+    
+    async def serve(self, web=True):
+        """Работа бота и HTTP-сервера в одном цикле событий до сигнала остановки"""
+        if self.mode == 'webhook' and not WEBHOOK_URL:
+            raise RuntimeError("Для режима webhook укажите WEBHOOK_URL")
+        
+        server = None
+        if web or self.mode == 'webhook':
+            server = create_server(port=PORT)
+        if self.mode == 'webhook':
+            server.route('POST', WEBHOOK_PATH, self.webhook)
+        if server is not None:
+            server.route('GET', '/metrics', self.metrics_endpoint)
+            server.route('GET', '/stats', self.stats_endpoint)
+        
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+        
+        async with self.application:
+            await self.post_init(self.application)
+            if self.mode == 'webhook':
+                await self.application.bot.set_webhook(
+                    WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+            await self.application.start()
+            poller = asyncio.create_task(self.poll()) if self.mode == 'polling' else None
+            if server is not None:
+                await server.start()
+            print("🤖 Бот запущен...")
+            
+            try:
+                await stop.wait()
+            finally:
+                if server is not None:
+                    await server.stop()
+                if poller is not None:
+                    poller.cancel()
+                    await asyncio.gather(poller, return_exceptions=True)
+                await self.application.stop()
+        await self.post_shutdown(self.application)
     
-    def run(self):
-        """Запуск бота"""
-        print("🤖 Бот запущен...")
-        self.application.run_polling()
+    def run(self, web=False):
+        """Запуск бота; web=True - также отвечать на проверки здоровья в режиме polling"""
+        asyncio.run(self.serve(web))
 
 if __name__ == '__main__':
     bot = FitnessBot()
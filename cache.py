@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+
+class UserCache:
+    """LRU-кэш горячих данных по пользователям.
+
+    Для каждого пользователя хранится небольшой словарь записей
+    (данные профиля, вода и еда за день, история веса) с временем жизни.
+    Вытесняются целиком самые давние пользователи. max_users=0 отключает кэш.
+    """
+
+    def __init__(self, max_users=10000, ttl=300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        # Меняется при любой записи: результат чтения, начатого до записи,
+        # не попадает в кэш
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_or_load(self, user_id, key, loader):
+        """Значение из кэша или результат loader() с сохранением в кэш"""
+        if not self.max_users:
+            return loader()
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is not None and key in entries:
+                expires, value = entries[key]
+                if expires > time.monotonic():
+                    self._users.move_to_end(user_id)
+                    self.hits += 1
+                    return value
+                del entries[key]
+                self.expirations += 1
+            self.misses += 1
+            generation = self._generation
+
+        value = loader()
+
+        with self._lock:
+            if generation == self._generation:
+                self._store(user_id, key, value)
+        return value
+
+    def get(self, user_id, key):
+        """Значение из кэша или None"""
+        if not self.max_users:
+            return None
+        with self._lock:
+            entries = self._users.get(user_id)
+            if entries is not None and key in entries:
+                expires, value = entries[key]
+                if expires > time.monotonic():
+                    self._users.move_to_end(user_id)
+                    self.hits += 1
+                    return value
+                del entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, user_id, key, value):
+        """Сохранение значения, полученного не через get_or_load"""
+        if not self.max_users:
+            return
+        with self._lock:
+            self._store(user_id, key, value)
+
+    def _store(self, user_id, key, value):
+        """Сохранение записи с вытеснением давних пользователей"""
+        entries = self._users.get(user_id)
+        if entries is None:
+            entries = self._users[user_id] = {}
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._users.move_to_end(user_id)
+        entries[key] = (time.monotonic() + self.ttl, value)
+
+    def update(self, user_id, key, func):
+        """Обновление закэшированного значения на месте после записи в базу"""
+        with self._lock:
+            self._generation += 1
+            entries = self._users.get(user_id)
+            if entries is not None and key in entries:
+                expires, value = entries[key]
+                entries[key] = (expires, func(value))
+
+    def invalidate(self, user_id, kind=None):
+        """Удаление записей пользователя (всех или одного вида, key[0] == kind)"""
+        with self._lock:
+            self._generation += 1
+            entries = self._users.get(user_id)
+            if entries is None:
+                return
+            if kind is None:
+                del self._users[user_id]
+            else:
+                for key in [key for key in entries if key[0] == kind]:
+                    del entries[key]
+
+    def clear(self):
+        """Полная очистка кэша"""
+        with self._lock:
+            self._generation += 1
+            self._users.clear()
+
+    def stats(self):
+        """Счетчики попаданий, промахов и вытеснений"""
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
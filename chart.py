@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import multiprocessing
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from cache import UserCache
+from config import CHART_WORKERS, CHART_CACHE_TTL, CACHE_MAX_USERS
+
+# Графики рисуются без внешних библиотек: палитровый PNG из zlib и struct,
+# подписи осей - встроенным пиксельным шрифтом
+
+WIDTH, HEIGHT = 800, 500
+
+PALETTE = [
+    (255, 255, 255),  # фон
+    (228, 228, 228),  # сетка
+    (90, 90, 90),     # оси и подписи
+    (52, 120, 246),   # тренд веса
+    (20, 60, 160),    # замеры веса
+    (255, 150, 40),   # калории
+]
+BACKGROUND, GRID, TEXT, TREND, POINT, BAR = range(len(PALETTE))
+
+# Шрифт 3x5 для чисел на осях
+_FONT = {
+    '0': ('111', '101', '101', '101', '111'),
+    '1': ('010', '110', '010', '010', '111'),
+    '2': ('111', '001', '111', '100', '111'),
+    '3': ('111', '001', '111', '001', '111'),
+    '4': ('101', '101', '111', '001', '001'),
+    '5': ('111', '100', '111', '001', '111'),
+    '6': ('111', '100', '111', '101', '111'),
+    '7': ('111', '001', '010', '010', '010'),
+    '8': ('111', '101', '111', '101', '111'),
+    '9': ('111', '101', '111', '001', '111'),
+    '.': ('000', '000', '000', '000', '010'),
+    '-': ('000', '000', '111', '000', '000'),
+    ' ': ('000', '000', '000', '000', '000'),
+}
+
+class Canvas:
+    """Изображение с палитрой: по байту (номеру цвета) на пиксель"""
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.pixels = bytearray(width * height)
+
+    def rect(self, x0, y0, x1, y1, color):
+        """Закрашенный прямоугольник [x0, x1) x [y0, y1), обрезанный по краям"""
+        x0, x1 = max(0, int(x0)), min(self.width, int(x1))
+        y0, y1 = max(0, int(y0)), min(self.height, int(y1))
+        if x0 >= x1:
+            return
+        fill = bytes([color]) * (x1 - x0)
+        for y in range(y0, y1):
+            start = y * self.width + x0
+            self.pixels[start:start + len(fill)] = fill
+
+    def line(self, x0, y0, x1, y1, color, thickness=2):
+        """Отрезок квадратной кистью (алгоритм Брезенхэма)"""
+        x0, y0, x1, y1 = int(x0), int(y0), int(x1), int(y1)
+        dx, dy = abs(x1 - x0), -abs(y1 - y0)
+        step_x, step_y = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+        error = dx + dy
+        while True:
+            self.rect(x0, y0, x0 + thickness, y0 + thickness, color)
+            if x0 == x1 and y0 == y1:
+                return
+            double = 2 * error
+            if double >= dy:
+                error += dy
+                x0 += step_x
+            if double <= dx:
+                error += dx
+                y0 += step_y
+
+    def text(self, x, y, string, color, scale=2):
+        """Строка шрифтом 3x5; символы вне шрифта пропускаются"""
+        for char in string:
+            for row, bits in enumerate(_FONT.get(char, _FONT[' '])):
+                for column, bit in enumerate(bits):
+                    if bit == '1':
+                        self.rect(x + column * scale, y + row * scale,
+                                  x + (column + 1) * scale, y + (row + 1) * scale, color)
+            x += 4 * scale
+
+    def png(self):
+        """PNG с палитрой PALETTE"""
+        raw = b''.join(b'\x00' + self.pixels[y * self.width:(y + 1) * self.width]
+                       for y in range(self.height))
+
+        def chunk(kind, data):
+            return (struct.pack('>I', len(data)) + kind + data
+                    + struct.pack('>I', zlib.crc32(kind + data)))
+
+        return b''.join([
+            b'\x89PNG\r\n\x1a\n',
+            chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 3, 0, 0, 0)),
+            chunk(b'PLTE', bytes(channel for color in PALETTE for channel in color)),
+            chunk(b'IDAT', zlib.compress(raw, 6)),
+            chunk(b'IEND', b''),
+        ])
+
+def _panel(canvas, top, bottom, low, high, label_format):
+    """Сетка панели и подписи границ; возвращает функцию значение -> y"""
+    for step in range(5):
+        y = top + (bottom - top) * step // 4
+        canvas.rect(60, y, WIDTH - 20, y + 1, GRID)
+    canvas.rect(60, top, 61, bottom + 1, TEXT)
+    canvas.text(4, top - 4, label_format.format(high), TEXT)
+    canvas.text(4, bottom - 6, label_format.format(low), TEXT)
+    span = (high - low) or 1
+    return lambda value: bottom - (value - low) / span * (bottom - top)
+
+def render_chart(rows):
+    """PNG с весом (замеры и тренд) и калориями по строкам отчета get_report.
+
+    Строки - в хронологическом порядке. Выполняется в процессе-воркере.
+    """
+    canvas = Canvas(WIDTH, HEIGHT)
+    days = [date.fromisoformat(str(row[0])) for row in rows]
+    first, last = days[0], days[-1]
+    period = (last - first).days or 1
+    left, right = 70, WIDTH - 30
+
+    def x_of(day):
+        return left + (day - first).days / period * (right - left)
+
+    weights = [(day, row[8], row[9]) for day, row in zip(days, rows) if row[9] is not None]
+    if weights:
+        values = [value for _, weight, trend in weights for value in (weight, trend)
+                  if value is not None]
+        low, high = min(values) - 0.5, max(values) + 0.5
+        y_of = _panel(canvas, 20, 230, low, high, '{:.1f}')
+        points = [(x_of(day), y_of(trend)) for day, _, trend in weights]
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            canvas.line(x0, y0, x1, y1, TREND, 3)
+        for day, weight, _ in weights:
+            if weight is not None:
+                x, y = x_of(day), y_of(weight)
+                canvas.rect(x - 3, y - 3, x + 4, y + 4, POINT)
+
+    calories = [(day, row[2]) for day, row in zip(days, rows) if row[1]]
+    if calories:
+        high = max(value for _, value in calories) or 1
+        y_of = _panel(canvas, 280, 480, 0, high, '{:.0f}')
+        bar = max(2, (right - left) / max(len(rows), 1) * 0.6)
+        for day, value in calories:
+            x = x_of(day)
+            canvas.rect(x - bar / 2, y_of(value), x + bar / 2, 481, BAR)
+    return canvas.png()
+
+def data_digest(rows):
+    """Версия данных графика: меняется при любом изменении строк отчета"""
+    return hashlib.blake2b(repr(rows).encode(), digest_size=8).hexdigest()
+
+class ChartRenderer:
+    """Отрисовка графиков в пуле процессов с кэшем готовых изображений.
+
+    Кэш хранит для (пользователь, период) версию данных и изображение:
+    сначала байты PNG, после первой отправки - file_id Telegram, так что
+    повторный запрос без новых данных не рисует и не загружает график
+    заново. Одновременные запросы одного графика ждут одну отрисовку.
+    """
+
+    def __init__(self, workers=CHART_WORKERS, max_users=CACHE_MAX_USERS, ttl=CHART_CACHE_TTL):
+        self.workers = workers
+        self.cache = UserCache(max_users, ttl)
+        self._executor = None
+        self._rendering = {}
+        self.rendered = 0
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn: воркеру не передаются потоки и соединения бота
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def render(self, user_id, period, rows):
+        """(версия данных, file_id или байты PNG) для строк отчета"""
+        digest = data_digest(rows)
+        cached = self.cache.get(user_id, ('chart', period))
+        if cached is not None and cached[0] == digest:
+            return cached
+
+        key = (user_id, period, digest)
+        future = self._rendering.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._pool(), render_chart, rows[::-1])
+            self._rendering[key] = future
+            future.add_done_callback(lambda _: self._rendering.pop(key, None))
+            self.rendered += 1
+        image = await asyncio.shield(future)
+        self.cache.put(user_id, ('chart', period), (digest, image))
+        return digest, image
+
+    def remember(self, user_id, period, digest, file_id):
+        """Запоминание file_id отправленного графика вместо байтов"""
+        cached = self.cache.get(user_id, ('chart', period))
+        if cached is not None and cached[0] == digest:
+            self.cache.put(user_id, ('chart', period), (digest, file_id))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -1,18 +1,279 @@
 import sqlite3
-import json
-from datetime import datetime, date
-from config import DATABASE_PATH
+import queue
+import asyncio
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from functools import partial
+from itertools import islice
+from cache import UserCache
+from profiling import cursor_class
+from storage import (Storage, TABLES, DIARY_TABLES, REPORT_PERIODS, REPORT_WEIGHT_WINDOW,
+                     diary_rows, workout_key)
+from datetime import datetime, date, timedelta, timezone
+from config import (DATABASE_PATH, DB_READERS, DB_MMAP_SIZE, DB_CACHE_SIZE_KB,
+                    DB_STATEMENT_CACHE, DB_BUSY_TIMEOUT_MS, DB_WRITE_BEHIND,
+                    DB_FLUSH_INTERVAL_MS, DB_FLUSH_MAX_ROWS, CACHE_MAX_USERS, CACHE_TTL)
+
+logger = logging.getLogger(__name__)
+
+# Начало корзины отчета для даты: сам день или понедельник недели
+_REPORT_BUCKETS = {
+    'day': 'date({0})',
+    'week': "date({0}, 'weekday 0', '-6 days')",
+}
+
+# Выборки дневника пользователя в колонках DIARY_FIELDS; каждая идет по индексу (user_id, дата)
+_DIARY_EXPORT = (
+    '''SELECT 'meal', meal_date, created_at, meal_type, food_name, NULL,
+              calories, protein, carbs, fat
+       FROM meals WHERE user_id = ? ORDER BY meal_date''',
+    '''SELECT 'water', drink_date, created_at, NULL, NULL, amount, NULL, NULL, NULL, NULL
+       FROM water WHERE user_id = ? ORDER BY drink_date''',
+    '''SELECT 'weight', weight_date, created_at, NULL, NULL, weight, NULL, NULL, NULL, NULL
+       FROM weight WHERE user_id = ? ORDER BY weight_date''',
+    '''SELECT 'workout', w.workout_date, w.created_at, w.workout_type,
+              (SELECT group_concat(e.exercise, ', ') FROM workout_exercises AS e
+               WHERE e.workout_key = w.workout_key),
+              w.duration, NULL, NULL, NULL, NULL
+       FROM workouts AS w WHERE w.user_id = ? ORDER BY w.workout_date''',
+)
+
+def _timestamp():
+    """Текущее время в формате CURRENT_TIMESTAMP (UTC)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+# Ошибки в данных строки: записать ее не получится ни сейчас, ни при повторе
+_ROW_ERRORS = (OverflowError, ValueError, TypeError, sqlite3.InterfaceError,
+               sqlite3.IntegrityError)
+
+def _checked(rows):
+    """Строки для записи; ValueError, если SQLite не сможет их сохранить.
+
+    Проверка идет до постановки в очередь отложенной записи, чтобы
+    ошибка вернулась вызывающему, а не повторялась при каждом сбросе.
+    """
+    for row in rows:
+        for value in row:
+            if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+                raise ValueError(f"число {value} не помещается в 64 бита")
+            if isinstance(value, float) and value != value:
+                raise ValueError("значение NaN")
+    return rows
 
 class Database:
-    def __init__(self):
-        self.db_path = DATABASE_PATH
+    def __init__(self, db_path=None, write_behind=None):
+        self.db_path = db_path or DATABASE_PATH
+        
+        # Одно соединение на запись (SQLite допускает только одного писателя)
+        # и небольшой пул соединений на чтение: в режиме WAL читатели
+        # не блокируются писателем
+        self._write_lock = threading.Lock()
+        self._writer = self._connect()
+        self._writer.execute('PRAGMA journal_mode=WAL')
         self.init_database()
+        
+        self._readers = queue.LifoQueue()
+        for _ in range(max(1, DB_READERS)):
+            self._readers.put(self._connect(readonly=True))
+        
+        # Отложенная запись: частые вставки (вода, еда) копятся в памяти
+        # и сбрасываются одной транзакцией раз в DB_FLUSH_INTERVAL_MS
+        # или при накоплении DB_FLUSH_MAX_ROWS строк
+        self.write_behind = DB_WRITE_BEHIND if write_behind is None else write_behind
+        self._pending_lock = threading.Lock()
+        self._pending = {'meals': [], 'water': []}
+        self._flushing = {'meals': [], 'water': []}
+        self._flush_generation = 0
+        self._flush_mutex = threading.Lock()
+        self._flush_wakeup = threading.Event()
+        self._closing = threading.Event()
+        
+        # Кэш горячих чтений; записи обновляют или сбрасывают его сами
+        self.cache = UserCache(CACHE_MAX_USERS, CACHE_TTL)
+        if self.write_behind:
+            self._flush_thread = threading.Thread(target=self._flush_loop,
+                                                  name='db-write-behind', daemon=True)
+            self._flush_thread.start()
     
-    def init_database(self):
-        """Инициализация базы данных"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _connect(self, readonly=False):
+        """Открытие долгоживущего соединения с настройками производительности"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=DB_STATEMENT_CACHE)
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        if readonly:
+            conn.execute('PRAGMA query_only=ON')
+        return conn
+    
+    @contextmanager
+    def _write(self):
+        """Курсор соединения на запись; коммит при успехе, откат при ошибке"""
+        with self._write_lock:
+            cursor = self._writer.cursor(cursor_class())
+            try:
+                yield cursor
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+            finally:
+                cursor.close()
+    
+    @contextmanager
+    def _read(self):
+        """Курсор свободного соединения на чтение из пула"""
+        conn = self._readers.get()
+        cursor = conn.cursor(cursor_class())
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+            self._readers.put(conn)
+    
+    def _enqueue(self, kind, rows):
+        """Постановка строк в очередь отложенной записи"""
+        with self._pending_lock:
+            self._pending[kind].extend(rows)
+            size = sum(len(rows) for rows in self._pending.values())
+        if size >= DB_FLUSH_MAX_ROWS:
+            self._flush_wakeup.set()
+    
+    def _flush_loop(self):
+        """Фоновый поток периодического сброса очереди"""
+        while not self._closing.is_set():
+            self._flush_wakeup.wait(DB_FLUSH_INTERVAL_MS / 1000)
+            self._flush_wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Ошибка отложенной записи в базу данных")
+    
+    def flush(self):
+        """Сброс накопленных записей на диск одной транзакцией"""
+        with self._flush_mutex:
+            with self._pending_lock:
+                if not any(self._pending.values()):
+                    return 0
+                self._flushing, self._pending = self._pending, {'meals': [], 'water': []}
+            
+            with self._write_lock:
+                cursor = self._writer.cursor(cursor_class())
+                try:
+                    self._insert_meals(cursor, self._flushing['meals'])
+                    self._insert_water(cursor, self._flushing['water'])
+                    # Коммит и очистка буфера происходят атомарно для читателей,
+                    # поэтому строка никогда не учитывается дважды
+                    with self._pending_lock:
+                        self._writer.commit()
+                        count = sum(len(rows) for rows in self._flushing.values())
+                        self._flushing = {'meals': [], 'water': []}
+                        self._flush_generation += 1
+                    return count
+                except _ROW_ERRORS:
+                    # Плохая строка не должна держать в очереди всю пачку
+                    self._writer.rollback()
+                    try:
+                        return self._flush_rows(cursor)
+                    except BaseException:
+                        self._requeue()
+                        raise
+                except BaseException:
+                    self._requeue()
+                    raise
+                finally:
+                    cursor.close()
+    
+    def _requeue(self):
+        """Возврат несброшенного буфера в начало очереди после ошибки записи"""
+        self._writer.rollback()
+        with self._pending_lock:
+            for kind, rows in self._flushing.items():
+                self._pending[kind][:0] = rows
+            self._flushing = {'meals': [], 'water': []}
+    
+    def _flush_rows(self, cursor):
+        """Сброс пачки по одной строке: строки с ошибкой в данных пропускаются.
+        
+        Каждая строка убирается из буфера в момент своего коммита, поэтому
+        читатели не учитывают ее дважды.
+        """
+        inserts = {'meals': self._insert_meals, 'water': self._insert_water}
+        count = 0
+        for kind in ('meals', 'water'):
+            while True:
+                with self._pending_lock:
+                    rows = self._flushing[kind]
+                if not rows:
+                    break
+                try:
+                    inserts[kind](cursor, rows[:1])
+                except _ROW_ERRORS as error:
+                    self._writer.rollback()
+                    logger.error("Строка %s не записана и отброшена: %r (%s)", kind, rows[0], error)
+                    # В кэше строка уже учтена
+                    self.cache.invalidate(rows[0][0])
+                else:
+                    count += 1
+                with self._pending_lock:
+                    self._writer.commit()
+                    self._flushing = {**self._flushing, kind: rows[1:]}
+                    self._flush_generation += 1
+        return count
+    
+    def _read_your_writes(self, user_id, day, read):
+        """Чтение из базы вместе с еще не сброшенными записями пользователя за день"""
+        if not self.write_behind:
+            return read(), [], []
         
+        day = str(day)
+        while True:
+            with self._pending_lock:
+                generation = self._flush_generation
+                meals, water = (
+                    [row for row in self._flushing[kind] + self._pending[kind]
+                     if row[0] == user_id and str(row[-2]) == day]
+                    for kind in ('meals', 'water')
+                )
+            result = read()
+            # Если между снимком очереди и чтением прошел сброс, читаем заново
+            with self._pending_lock:
+                if generation == self._flush_generation:
+                    return result, meals, water
+    
+    def close(self):
+        """Сброс очереди записи и закрытие всех соединений пула"""
+        if self.write_behind:
+            self._closing.set()
+            self._flush_wakeup.set()
+            self._flush_thread.join()
+            self.flush()
+        with self._write_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+    
+    def init_database(self):
+        """Инициализация базы данных и применение миграций схемы"""
+        with self._write() as cursor:
+            cursor.execute('PRAGMA user_version')
+            version = cursor.fetchone()[0]
+            
+            # Каждая миграция выполняется в своей транзакции вместе
+            # с обновлением номера версии схемы
+            for number, migration in enumerate(self.MIGRATIONS[version:], start=version + 1):
+                cursor.execute('BEGIN')
+                migration(self, cursor)
+                cursor.execute(f'PRAGMA user_version={number}')
+                self._writer.commit()
+    
+    def _create_tables(self, cursor):
+        """Миграция 1: создание таблиц"""
         # Таблица пользователей
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -82,134 +343,719 @@ class Database:
                 FOREIGN KEY (user_id) REFERENCES users (user_id)
             )
         ''')
+    
+    def _create_indexes(self, cursor):
+        """Миграция 2: индексы для выборок пользователя за день"""
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_meals_user_date
+            ON meals (user_id, meal_date, created_at)
+        ''')
+        # amount и weight в конце индекса делают его покрывающим:
+        # SUM по воде и история веса читаются без обращения к таблице
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_water_user_date
+            ON water (user_id, drink_date, created_at, amount)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_workouts_user_date
+            ON workouts (user_id, workout_date, created_at)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_weight_user_date
+            ON weight (user_id, weight_date, created_at, weight)
+        ''')
+    
+    def _create_daily_totals(self, cursor):
+        """Миграция 3: материализованные итоги за день"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_totals (
+                user_id INTEGER,
+                day DATE,
+                calories INTEGER DEFAULT 0,
+                protein REAL DEFAULT 0,
+                carbs REAL DEFAULT 0,
+                fat REAL DEFAULT 0,
+                water_ml INTEGER DEFAULT 0,
+                workouts_min INTEGER DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            ) WITHOUT ROWID
+        ''')
+        self._rebuild_daily_totals(cursor)
+    
+    def _create_workout_exercises(self, cursor):
+        """Миграция 4: упражнения тренировок отдельными строками вместо JSON"""
+        # Упражнение связано с тренировкой через (user_id, created_at), с
+        # миграции 6 - через workout_key: без суррогатных id строки
+        # переносятся между шардами и хранилищами как есть
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS workout_exercises (
+                user_id INTEGER,
+                workout_date DATE,
+                workout_type TEXT,
+                exercise TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_workout_exercises_user_date
+            ON workout_exercises (user_id, workout_date, exercise)
+        ''')
+        # Тип и длительность в индексе: недельные итоги по типам читаются
+        # из индекса без обращения к таблице
+        cursor.execute('DROP INDEX IF EXISTS idx_workouts_user_date')
+        cursor.execute('''
+            CREATE INDEX idx_workouts_user_date
+            ON workouts (user_id, workout_date, created_at, workout_type, duration)
+        ''')
+        # Перенос упражнений из JSON прежних записей
+        cursor.execute('''
+            INSERT INTO workout_exercises (user_id, workout_date, workout_type, exercise, created_at)
+            SELECT w.user_id, w.workout_date, w.workout_type, e.value, w.created_at
+            FROM workouts AS w, json_each(w.exercises) AS e
+            WHERE json_valid(w.exercises) AND json_type(w.exercises) = 'array'
+        ''')
+        cursor.execute('''
+            UPDATE workouts SET exercises = NULL
+            WHERE json_valid(exercises) AND json_type(exercises) = 'array'
+        ''')
+    
+    def _create_reminders(self, cursor):
+        """Миграция 5: напоминания с индексом по сроку"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS reminders (
+                user_id INTEGER,
+                kind TEXT,
+                interval_min INTEGER,
+                start_min INTEGER,
+                end_min INTEGER,
+                next_due INTEGER,
+                PRIMARY KEY (user_id, kind)
+            ) WITHOUT ROWID
+        ''')
+        # Планировщик читает только ближайшие сроки, не перебирая всех пользователей
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_reminders_next_due ON reminders (next_due)
+        ''')
+    
+    def _add_workout_keys(self, cursor):
+        """Миграция 6: ключ тренировки у упражнений вместо совпадения по времени
         
-        conn.commit()
-        conn.close()
+        created_at хранится с точностью до секунды, и тренировки, записанные
+        в одну секунду, делили упражнения. Ключ - случайная строка, а не
+        суррогатный id, поэтому переносится между шардами и хранилищами.
+        """
+        for table in ('workouts', 'workout_exercises'):
+            cursor.execute(f'PRAGMA table_info({table})')
+            if 'workout_key' not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN workout_key TEXT')
+        cursor.execute('''
+            UPDATE workouts SET workout_key = lower(hex(randomblob(16)))
+            WHERE workout_key IS NULL
+        ''')
+        # Прежние упражнения: та же секунда и тот же тип тренировки
+        cursor.execute('''
+            UPDATE workout_exercises SET workout_key = (
+                SELECT w.workout_key FROM workouts AS w
+                WHERE w.user_id = workout_exercises.user_id
+                  AND w.workout_date = workout_exercises.workout_date
+                  AND w.created_at = workout_exercises.created_at
+                  AND w.workout_type = workout_exercises.workout_type
+                ORDER BY w.rowid LIMIT 1
+            )
+            WHERE workout_key IS NULL
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_workout_exercises_workout
+            ON workout_exercises (workout_key)
+        ''')
     
-    def add_user(self, user_id, username, first_name):
-        """Добавление нового пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    # Версионированные миграции схемы: номер версии (PRAGMA user_version)
+    # равен количеству примененных миграций
+    MIGRATIONS = [
+        _create_tables,
+        _create_indexes,
+        _create_daily_totals,
+        _create_workout_exercises,
+        _create_reminders,
+        _add_workout_keys,
+    ]
+    
+    def _rebuild_daily_totals(self, cursor, user_id=None):
+        """Пересчет daily_totals из исходных таблиц"""
+        where, params = '', ()
+        if user_id is not None:
+            where, params = 'WHERE user_id = ?', (user_id,)
         
+        cursor.execute(f'DELETE FROM daily_totals {where}', params)
+        cursor.execute(f'''
+            INSERT INTO daily_totals (user_id, day, calories, protein, carbs, fat, water_ml, workouts_min)
+            SELECT user_id, day, SUM(calories), SUM(protein), SUM(carbs), SUM(fat),
+                   SUM(water_ml), SUM(workouts_min)
+            FROM (
+                SELECT user_id, meal_date AS day, calories, protein, carbs, fat,
+                       0 AS water_ml, 0 AS workouts_min
+                FROM meals {where}
+                UNION ALL
+                SELECT user_id, drink_date, 0, 0, 0, 0, amount, 0 FROM water {where}
+                UNION ALL
+                SELECT user_id, workout_date, 0, 0, 0, 0, 0, duration FROM workouts {where}
+            )
+            GROUP BY user_id, day
+        ''', params * 3)
+    
+    def rebuild_daily_totals(self, user_id=None):
+        """Пересчет итогов за день (для всех пользователей или одного)"""
+        with self._write() as cursor:
+            self._rebuild_daily_totals(cursor, user_id)
+        if user_id is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate(user_id)
+    
+    def _add_to_daily_totals(self, cursor, user_id, day, calories=0, protein=0, carbs=0, fat=0,
+                             water_ml=0, workouts_min=0):
+        """Инкрементальное обновление итогов за день в текущей транзакции"""
         cursor.execute('''
-            INSERT OR IGNORE INTO users (user_id, username, first_name)
-            VALUES (?, ?, ?)
-        ''', (user_id, username, first_name))
+            INSERT INTO daily_totals (user_id, day, calories, protein, carbs, fat, water_ml, workouts_min)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, day) DO UPDATE SET
+                calories = calories + excluded.calories,
+                protein = protein + excluded.protein,
+                carbs = carbs + excluded.carbs,
+                fat = fat + excluded.fat,
+                water_ml = water_ml + excluded.water_ml,
+                workouts_min = workouts_min + excluded.workouts_min
+        ''', (user_id, day, calories, protein, carbs, fat, water_ml, workouts_min))
+    
+    def get_daily_totals(self, user_id, day=None):
+        """Итоги за день: калории, БЖУ, вода и минуты тренировок"""
+        if day is None:
+            day = date.today()
+        
+        def read():
+            with self._read() as cursor:
+                cursor.execute('''
+                    SELECT calories, protein, carbs, fat, water_ml, workouts_min
+                    FROM daily_totals
+                    WHERE user_id = ? AND day = ?
+                ''', (user_id, day))
+                return cursor.fetchone()
+        
+        def load():
+            row, pending_meals, pending_water = self._read_your_writes(user_id, day, read)
+            keys = ('calories', 'protein', 'carbs', 'fat', 'water_ml', 'workouts_min')
+            totals = dict(zip(keys, row or (0,) * len(keys)))
+            for _, _, _, calories, protein, carbs, fat, _, _ in pending_meals:
+                totals['calories'] += calories
+                totals['protein'] += protein
+                totals['carbs'] += carbs
+                totals['fat'] += fat
+            totals['water_ml'] += sum(row[1] for row in pending_water)
+            return totals
         
-        conn.commit()
-        conn.close()
+        return self.cache.get_or_load(user_id, ('totals', str(day)), load)
+    
+    def _cache_add_totals(self, user_id, day, **amounts):
+        """Обновление закэшированных итогов за день после записи"""
+        def add(totals):
+            totals = dict(totals)
+            for key, amount in amounts.items():
+                totals[key] += amount
+            return totals
+        self.cache.update(user_id, ('totals', str(day)), add)
+    
+    def add_user(self, user_id, username, first_name):
+        """Добавление нового пользователя"""
+        with self._write() as cursor:
+            cursor.execute('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name)
+                VALUES (?, ?, ?)
+            ''', (user_id, username, first_name))
+        self.cache.invalidate(user_id, 'user')
     
     def get_user(self, user_id):
         """Получение данных пользователя"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
+        def read():
+            with self._read() as cursor:
+                cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+                return cursor.fetchone()
         
-        conn.close()
-        return user
+        return self.cache.get_or_load(user_id, ('user',), read)
     
     def add_meal(self, user_id, meal_type, food_name, calories, protein, carbs, fat):
         """Добавление приема пищи"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.add_meals(user_id, meal_type, [(food_name, calories, protein, carbs, fat)])
+    
+    def add_meals(self, user_id, meal_type, meals):
+        """Добавление нескольких продуктов одного приема пищи одной транзакцией
         
-        cursor.execute('''
-            INSERT INTO meals (user_id, meal_type, food_name, calories, protein, carbs, fat, meal_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, meal_type, food_name, calories, protein, carbs, fat, date.today()))
+        meals - список (food_name, calories, protein, carbs, fat)
+        """
+        today, created_at = date.today(), _timestamp()
+        rows = _checked([(user_id, meal_type, food_name, calories, protein, carbs, fat, today,
+                          created_at) for food_name, calories, protein, carbs, fat in meals])
+        if self.write_behind:
+            self._enqueue('meals', rows)
+        else:
+            with self._write() as cursor:
+                self._insert_meals(cursor, rows)
         
-        conn.commit()
-        conn.close()
+        self.cache.invalidate(user_id, 'meals')
+        self._cache_add_totals(user_id, today,
+                               calories=sum(row[3] for row in rows),
+                               protein=sum(row[4] for row in rows),
+                               carbs=sum(row[5] for row in rows),
+                               fat=sum(row[6] for row in rows))
+    
+    def _insert_meals(self, cursor, rows):
+        """Вставка приемов пищи с обновлением итогов за день"""
+        cursor.executemany('''
+            INSERT INTO meals (user_id, meal_type, food_name, calories, protein, carbs, fat,
+                               meal_date, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        for user_id, _, _, calories, protein, carbs, fat, day, _ in rows:
+            self._add_to_daily_totals(cursor, user_id, day, calories=calories,
+                                      protein=protein, carbs=carbs, fat=fat)
     
     def get_daily_meals(self, user_id, meal_date=None):
         """Получение приемов пищи за день"""
         if meal_date is None:
             meal_date = date.today()
-            
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT * FROM meals 
-            WHERE user_id = ? AND meal_date = ?
-            ORDER BY created_at
-        ''', (user_id, meal_date))
+        def read():
+            with self._read() as cursor:
+                cursor.execute('''
+                    SELECT * FROM meals 
+                    WHERE user_id = ? AND meal_date = ?
+                    ORDER BY created_at
+                ''', (user_id, meal_date))
+                return cursor.fetchall()
+        
+        def load():
+            meals, pending, _ = self._read_your_writes(user_id, meal_date, read)
+            # Еще не записанные строки получают id = None
+            return meals + [(None,) + row for row in pending]
         
-        meals = cursor.fetchall()
-        conn.close()
-        return meals
+        return self.cache.get_or_load(user_id, ('meals', str(meal_date)), load)
     
     def add_water(self, user_id, amount):
         """Добавление выпитой воды"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO water (user_id, amount, drink_date)
-            VALUES (?, ?, ?)
-        ''', (user_id, amount, date.today()))
+        today = date.today()
+        row, = _checked([(user_id, amount, today, _timestamp())])
+        if self.write_behind:
+            self._enqueue('water', [row])
+        else:
+            with self._write() as cursor:
+                self._insert_water(cursor, [row])
         
-        conn.commit()
-        conn.close()
+        self.cache.update(user_id, ('water', str(today)), lambda total: total + amount)
+        self._cache_add_totals(user_id, today, water_ml=amount)
+    
+    def _insert_water(self, cursor, rows):
+        """Вставка записей о воде с обновлением итогов за день"""
+        cursor.executemany('''
+            INSERT INTO water (user_id, amount, drink_date, created_at)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        for user_id, amount, day, _ in rows:
+            self._add_to_daily_totals(cursor, user_id, day, water_ml=amount)
     
     def get_daily_water(self, user_id, drink_date=None):
         """Получение выпитой воды за день"""
         if drink_date is None:
             drink_date = date.today()
-            
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT SUM(amount) FROM water 
-            WHERE user_id = ? AND drink_date = ?
-        ''', (user_id, drink_date))
+        def read():
+            with self._read() as cursor:
+                cursor.execute('''
+                    SELECT water_ml FROM daily_totals
+                    WHERE user_id = ? AND day = ?
+                ''', (user_id, drink_date))
+                return cursor.fetchone()
         
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result[0] else 0
+        def load():
+            result, _, pending = self._read_your_writes(user_id, drink_date, read)
+            return (result[0] if result else 0) + sum(row[1] for row in pending)
+        
+        return self.cache.get_or_load(user_id, ('water', str(drink_date)), load)
     
     def add_workout(self, user_id, workout_type, exercises, duration):
-        """Добавление тренировки"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Добавление тренировки с упражнениями"""
+        today, created_at, key = date.today(), _timestamp(), workout_key()
+        with self._write() as cursor:
+            cursor.execute('''
+                INSERT INTO workouts (user_id, workout_type, duration, workout_date, created_at,
+                                      workout_key)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, workout_type, duration, today, created_at, key))
+            cursor.executemany('''
+                INSERT INTO workout_exercises (user_id, workout_date, workout_type, exercise,
+                                               created_at, workout_key)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [(user_id, today, workout_type, exercise, created_at, key) for exercise in exercises])
+            self._add_to_daily_totals(cursor, user_id, today, workouts_min=duration)
+        self.cache.invalidate(user_id, 'workouts')
+        self._cache_add_totals(user_id, today, workouts_min=duration)
+    
+    def get_workout_stats(self, user_id, days=7):
+        """Тренировки за последние days дней, посчитанные в SQL
         
-        exercises_json = json.dumps(exercises)
-        cursor.execute('''
-            INSERT INTO workouts (user_id, workout_type, exercises, duration, workout_date)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, workout_type, exercises_json, duration, date.today()))
+        types - [(тип, тренировок, минут)], exercises - [(упражнение, раз)]
+        по убыванию, active_days - дней с тренировками.
+        """
+        today = date.today()
+        since = today - timedelta(days=days - 1)
+        
+        def read():
+            with self._read() as cursor:
+                cursor.execute('''
+                    SELECT workout_type, COUNT(*), SUM(duration) FROM workouts
+                    WHERE user_id = ? AND workout_date >= ?
+                    GROUP BY workout_type
+                    ORDER BY SUM(duration) DESC
+                ''', (user_id, since))
+                types = cursor.fetchall()
+                cursor.execute('''
+                    SELECT exercise, COUNT(*) FROM workout_exercises
+                    WHERE user_id = ? AND workout_date >= ?
+                    GROUP BY exercise
+                    ORDER BY COUNT(*) DESC, exercise
+                ''', (user_id, since))
+                exercises = cursor.fetchall()
+                cursor.execute('''
+                    SELECT COUNT(DISTINCT workout_date) FROM workouts
+                    WHERE user_id = ? AND workout_date >= ?
+                ''', (user_id, since))
+                return {'types': types, 'exercises': exercises,
+                        'active_days': cursor.fetchone()[0]}
         
-        conn.commit()
-        conn.close()
+        # День в ключе: после полуночи окно сдвигается, прежний результат устарел
+        return self.cache.get_or_load(user_id, ('workouts', days, str(today)), read)
     
     def add_weight(self, user_id, weight):
         """Добавление веса"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO weight (user_id, weight, weight_date)
-            VALUES (?, ?, ?)
-        ''', (user_id, weight, date.today()))
-        
-        conn.commit()
-        conn.close()
+        with self._write() as cursor:
+            cursor.execute('''
+                INSERT INTO weight (user_id, weight, weight_date)
+                VALUES (?, ?, ?)
+            ''', (user_id, weight, date.today()))
+        self.cache.invalidate(user_id, 'weight')
     
     def get_weight_history(self, user_id, days=7):
         """Получение истории веса"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        def read():
+            with self._read() as cursor:
+                cursor.execute('''
+                    SELECT weight, weight_date FROM weight 
+                    WHERE user_id = ? 
+                    ORDER BY weight_date DESC 
+                    LIMIT ?
+                ''', (user_id, days))
+                return cursor.fetchall()
         
-        cursor.execute('''
-            SELECT weight, weight_date FROM weight 
-            WHERE user_id = ? 
-            ORDER BY weight_date DESC 
-            LIMIT ?
-        ''', (user_id, days))
+        return self.cache.get_or_load(user_id, ('weight', days), read)
+    
+    def iter_report(self, user_id, period, offset=0, batch=100):
+        """Строки отчета за период, новые корзины первыми (см. Storage.get_report)
+        
+        Итоги по дням берутся из daily_totals, группировка по корзинам и
+        скользящее среднее веса (оконная функция по календарному окну)
+        считаются в SQLite. Строки читаются пачками fetchmany, поэтому
+        история любой длины не собирается в память.
+        """
+        days, bucket = REPORT_PERIODS[period]
+        window = REPORT_WEIGHT_WINDOW[bucket]
+        since = date.today() - timedelta(days=days - 1)
+        bucket_of = _REPORT_BUCKETS[bucket].format
+        if self.write_behind:
+            # Отчет должен включать последние записи из очереди
+            self.flush()
         
-        history = cursor.fetchall()
-        conn.close()
-        return history
+        with self._read() as cursor:
+            cursor.execute(f'''
+                WITH totals AS (
+                    SELECT {bucket_of('day')} AS bucket, COUNT(*) AS days,
+                           AVG(calories) AS calories, AVG(protein) AS protein,
+                           AVG(carbs) AS carbs, AVG(fat) AS fat,
+                           AVG(water_ml) AS water_ml, SUM(workouts_min) AS workouts_min
+                    FROM daily_totals
+                    WHERE user_id = :user_id AND day >= :since
+                    GROUP BY bucket
+                ),
+                weights AS (
+                    SELECT {bucket_of('weight_date')} AS bucket, AVG(weight) AS weight
+                    FROM weight
+                    WHERE user_id = :user_id AND weight_date >= :weights_since
+                    GROUP BY bucket
+                ),
+                report AS (
+                    SELECT bucket, days, calories, protein, carbs, fat, water_ml, workouts_min,
+                           weight,
+                           AVG(weight) OVER (ORDER BY julianday(bucket)
+                                             RANGE BETWEEN {window - 1} PRECEDING AND CURRENT ROW)
+                               AS weight_avg
+                    FROM (SELECT bucket FROM totals UNION SELECT bucket FROM weights)
+                    LEFT JOIN totals USING (bucket)
+                    LEFT JOIN weights USING (bucket)
+                )
+                SELECT * FROM report
+                WHERE bucket >= {bucket_of(':since')}
+                ORDER BY bucket DESC
+                LIMIT -1 OFFSET :offset
+            ''', {'user_id': user_id, 'since': since, 'offset': offset,
+                  'weights_since': since - timedelta(days=window)})
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+                yield from rows
+    
+    def get_report(self, user_id, period, page=0, page_size=10):
+        """Страница отчета и признак следующей страницы"""
+        with closing(self.iter_report(user_id, period, page * page_size, page_size + 1)) as rows:
+            rows = list(islice(rows, page_size + 1))
+        return rows[:page_size], len(rows) > page_size
+    
+    def set_reminder(self, user_id, kind, interval_min, start_min, end_min, next_due):
+        """Создание или замена напоминания"""
+        with self._write() as cursor:
+            cursor.execute('''
+                INSERT INTO reminders (user_id, kind, interval_min, start_min, end_min, next_due)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id, kind) DO UPDATE SET
+                    interval_min = excluded.interval_min,
+                    start_min = excluded.start_min,
+                    end_min = excluded.end_min,
+                    next_due = excluded.next_due
+            ''', (user_id, kind, interval_min, start_min, end_min, next_due))
+    
+    def delete_reminders(self, user_id, kind=None):
+        """Удаление напоминаний пользователя"""
+        with self._write() as cursor:
+            if kind is None:
+                cursor.execute('DELETE FROM reminders WHERE user_id = ?', (user_id,))
+            else:
+                cursor.execute('DELETE FROM reminders WHERE user_id = ? AND kind = ?',
+                               (user_id, kind))
+    
+    def get_reminders(self, user_id):
+        """Напоминания пользователя"""
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT kind, interval_min, start_min, end_min, next_due FROM reminders
+                WHERE user_id = ? ORDER BY kind
+            ''', (user_id,))
+            return cursor.fetchall()
+    
+    def get_due_reminders(self, until, limit=1000):
+        """Ближайшие напоминания со сроком не позже until по индексу next_due"""
+        with self._read() as cursor:
+            cursor.execute('''
+                SELECT user_id, kind, interval_min, start_min, end_min, next_due FROM reminders
+                WHERE next_due <= ? ORDER BY next_due LIMIT ?
+            ''', (until, limit))
+            return cursor.fetchall()
+    
+    def reschedule_reminders(self, rows):
+        """Новые сроки напоминаний одной транзакцией"""
+        with self._write() as cursor:
+            cursor.executemany('''
+                UPDATE reminders SET next_due = ? WHERE user_id = ? AND kind = ? AND next_due = ?
+            ''', rows)
+    
+    def get_water_progress(self, user_ids, day=None):
+        """Вода за день и цель для пачки пользователей одним запросом"""
+        if day is None:
+            day = date.today()
+        if self.write_behind:
+            self.flush()
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        with self._read() as cursor:
+            cursor.execute(f'''
+                SELECT u.user_id, COALESCE(t.water_ml, 0), u.water_goal
+                FROM users AS u
+                LEFT JOIN daily_totals AS t ON t.user_id = u.user_id AND t.day = ?
+                WHERE u.user_id IN ({', '.join('?' * len(user_ids))})
+            ''', (day, *user_ids))
+            return {user_id: (water_ml, water_goal) for user_id, water_ml, water_goal in cursor}
+    
+    def _insert_rows(self, cursor, table, rows):
+        """Вставка строк с колонками TABLES[table] в текущей транзакции"""
+        columns = TABLES[table]
+        cursor.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' * len(columns))})", rows)
+    
+    def import_rows(self, table, rows):
+        """Массовая загрузка строк с колонками TABLES[table] одной транзакцией"""
+        with self._write() as cursor:
+            self._insert_rows(cursor, table, rows)
+            if table in ('meals', 'water', 'workouts'):
+                self._rebuild_daily_totals(cursor)
+        self.cache.clear()
+    
+    def iter_rows(self, table, batch=1000):
+        """Все строки таблицы с колонками TABLES[table] пачками по batch"""
+        with self._read() as cursor:
+            cursor.execute(f"SELECT {', '.join(TABLES[table])} FROM {table}")
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    break
+                yield rows
+    
+    def iter_diary(self, user_id, batch=1000):
+        """Дневник пользователя пачками по batch записей DIARY_FIELDS.
+        
+        Выгрузка читает через собственное соединение, а не из пула: генератор
+        держит его между пачками, и несколько долгих выгрузок не должны
+        оставлять обработчики без читателей.
+        """
+        self.flush()
+        with closing(self._connect(readonly=True)) as conn:
+            cursor = conn.cursor(cursor_class())
+            try:
+                for sql in _DIARY_EXPORT:
+                    cursor.execute(sql, (user_id,))
+                    while True:
+                        rows = cursor.fetchmany(batch)
+                        if not rows:
+                            break
+                        yield rows
+            finally:
+                cursor.close()
+    
+    def import_diary(self, user_id, records, replace=False, batch=5000):
+        """Загрузка дневника одной транзакцией; итоги за день пересчитываются один раз в конце"""
+        counts = Counter()
+        self.flush()
+        with self._write() as cursor:
+            if replace:
+                for table in DIARY_TABLES:
+                    cursor.execute(f'DELETE FROM {table} WHERE user_id = ?', (user_id,))
+            for rows in diary_rows(user_id, records, counts, batch):
+                for table, table_rows in rows.items():
+                    if table_rows:
+                        self._insert_rows(cursor, table, table_rows)
+            self._rebuild_daily_totals(cursor, user_id)
+        self.cache.invalidate(user_id)
+        return dict(counts)
+
+
+class AsyncDatabase(Storage):
+    """Асинхронный фасад над Database для обработчиков бота.
+    
+    Блокирующие вызовы SQLite выполняются в выделенном пуле потоков,
+    чтобы запись на диск не останавливала цикл событий бота.
+    """
+    
+    def __init__(self, database=None):
+        self.database = database or Database()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, DB_READERS) + 1,
+                                            thread_name_prefix='db')
+    
+    async def _run(self, func, *args, **kwargs):
+        """Выполнение синхронного метода базы в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+    
+    async def add_user(self, user_id, username, first_name):
+        return await self._run(self.database.add_user, user_id, username, first_name)
+    
+    async def get_user(self, user_id):
+        return await self._run(self.database.get_user, user_id)
+    
+    async def add_meal(self, user_id, meal_type, food_name, calories, protein, carbs, fat):
+        return await self._run(self.database.add_meal, user_id, meal_type, food_name,
+                               calories, protein, carbs, fat)
+    
+    async def add_meals(self, user_id, meal_type, meals):
+        return await self._run(self.database.add_meals, user_id, meal_type, meals)
+    
+    async def get_daily_meals(self, user_id, meal_date=None):
+        return await self._run(self.database.get_daily_meals, user_id, meal_date)
+    
+    async def add_water(self, user_id, amount):
+        return await self._run(self.database.add_water, user_id, amount)
+    
+    async def get_daily_water(self, user_id, drink_date=None):
+        return await self._run(self.database.get_daily_water, user_id, drink_date)
+    
+    async def get_daily_totals(self, user_id, day=None):
+        return await self._run(self.database.get_daily_totals, user_id, day)
+    
+    async def rebuild_daily_totals(self, user_id=None):
+        return await self._run(self.database.rebuild_daily_totals, user_id)
+    
+    async def add_workout(self, user_id, workout_type, exercises, duration):
+        return await self._run(self.database.add_workout, user_id, workout_type,
+                               exercises, duration)
+    
+    async def get_workout_stats(self, user_id, days=7):
+        return await self._run(self.database.get_workout_stats, user_id, days)
+    
+    async def add_weight(self, user_id, weight):
+        return await self._run(self.database.add_weight, user_id, weight)
+    
+    async def get_weight_history(self, user_id, days=7):
+        return await self._run(self.database.get_weight_history, user_id, days)
+    
+    async def get_report(self, user_id, period, page=0, page_size=10):
+        return await self._run(self.database.get_report, user_id, period, page, page_size)
+    
+    async def set_reminder(self, user_id, kind, interval_min, start_min, end_min, next_due):
+        return await self._run(self.database.set_reminder, user_id, kind, interval_min,
+                               start_min, end_min, next_due)
+    
+    async def delete_reminders(self, user_id, kind=None):
+        return await self._run(self.database.delete_reminders, user_id, kind)
+    
+    async def get_reminders(self, user_id):
+        return await self._run(self.database.get_reminders, user_id)
+    
+    async def get_due_reminders(self, until, limit=1000):
+        return await self._run(self.database.get_due_reminders, until, limit)
+    
+    async def reschedule_reminders(self, rows):
+        return await self._run(self.database.reschedule_reminders, rows)
+    
+    async def get_water_progress(self, user_ids, day=None):
+        return await self._run(self.database.get_water_progress, user_ids, day)
+    
+    async def import_rows(self, table, rows):
+        return await self._run(self.database.import_rows, table, rows)
+    
+    async def iter_diary(self, user_id, batch=1000):
+        # Пачки читаются в общем пуле asyncio, а не в пуле базы: выгрузка между
+        # пачками ждет отправки файла и не должна занимать потоки обработчиков
+        batches = self.database.iter_diary(user_id, batch)
+        try:
+            while True:
+                rows = await asyncio.to_thread(next, batches, None)
+                if rows is None:
+                    break
+                yield rows
+        finally:
+            try:
+                batches.close()
+            except ValueError:
+                # Отмена во время чтения пачки: генератор еще выполняется в потоке,
+                # соединение закроется при его сборке
+                pass
+    
+    async def import_diary(self, user_id, records, replace=False, batch=5000):
+        # Разбор файла (итератор records) тоже идет в потоке записи, не в цикле событий
+        return await self._run(self.database.import_diary, user_id, records, replace, batch)
+    
+    def cache_stats(self):
+        """Счетчики кэша чтений"""
+        return self.database.cache.stats()
+    
+    async def close(self):
+        """Завершение фоновых задач и закрытие соединений"""
+        await self._run(self.database.close)
+        self._executor.shutdown(wait=True)
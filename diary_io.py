@@ -0,0 +1,133 @@
+import csv
+import json
+import os
+from datetime import date, datetime, timedelta, timezone
+
+from storage import DIARY_FIELDS
+
+# Форматы файлов дневника по расширению
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+# Ограничение Bot API на скачивание файлов ботом
+MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024
+# Время записей без created_at: полдень дня, дальше по секунде на запись,
+# чтобы записи одного дня сохранили порядок файла
+_DEFAULT_TIME = timedelta(hours=12)
+_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def format_of(path):
+    """Формат файла дневника по расширению или None"""
+    return FORMATS.get(os.path.splitext(path)[1].lower())
+
+class DiaryWriter:
+    """Потоковая запись дневника в CSV или JSONL пачками записей DIARY_FIELDS"""
+
+    def __init__(self, file, fmt):
+        self.file = file
+        self.fmt = fmt
+        self.count = 0
+        if fmt == 'csv':
+            self._csv = csv.writer(file)
+            self._csv.writerow(DIARY_FIELDS)
+        elif fmt != 'jsonl':
+            raise ValueError(f"Неизвестный формат дневника: {fmt}")
+
+    def write(self, records):
+        if self.fmt == 'csv':
+            self._csv.writerows(records)
+        else:
+            self.file.writelines(
+                json.dumps({field: value for field, value in zip(DIARY_FIELDS, record)
+                            if value is not None}, ensure_ascii=False) + '\n'
+                for record in records)
+        self.count += len(records)
+
+def read_records(path, fmt=None):
+    """Чтение записей DIARY_FIELDS из CSV или JSONL по одной строке файла.
+
+    Ошибка в записи - ValueError с номером строки; уже прочитанное
+    при этом не загружается, потому что импорт идет одной транзакцией.
+    """
+    fmt = fmt or format_of(path)
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f"Неизвестный формат дневника: {path}")
+    # Число записей без времени по дням - для различимого created_at
+    untimed = {}
+    # utf-8-sig: CSV из Excel начинается с BOM
+    with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8-sig') as file:
+        if fmt == 'csv':
+            rows = enumerate(csv.DictReader(file), start=2)
+        else:
+            rows = ((number, _json_object(line)) for number, line in enumerate(file, start=1)
+                    if line.strip())
+        for number, row in rows:
+            try:
+                yield _record(row, untimed)
+            except (KeyError, TypeError, ValueError) as error:
+                raise ValueError(f"строка {number}: {error}") from None
+
+def _json_object(line):
+    try:
+        row = json.loads(line)
+    except json.JSONDecodeError as error:
+        raise ValueError(f"некорректный JSON: {error.msg}") from None
+    if not isinstance(row, dict):
+        raise ValueError("ожидается объект JSON")
+    return row
+
+def _value(row, field):
+    """Значение поля: пустая строка CSV и отсутствующий ключ - None"""
+    value = row.get(field)
+    return None if value is None or value == '' else value
+
+def _number(row, field, convert=float, required=True):
+    value = _value(row, field)
+    if value is None:
+        if required:
+            raise ValueError(f"не указано поле {field}")
+        return 0
+    number = convert(float(value))
+    if number < 0:
+        raise ValueError(f"отрицательное значение {field}")
+    return number
+
+def _record(row, untimed):
+    """Проверенная запись дневника из словаря полей"""
+    kind = _value(row, 'type')
+    day = _value(row, 'date')
+    if day is None:
+        raise ValueError("не указана дата (date)")
+    day = date.fromisoformat(str(day)).isoformat()
+    created_at = _value(row, 'created_at')
+    if created_at is None:
+        index = untimed.get(day, 0)
+        untimed[day] = index + 1
+        moment = datetime.fromisoformat(day) + _DEFAULT_TIME + timedelta(seconds=index)
+    else:
+        moment = datetime.fromisoformat(str(created_at))
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    created_at = moment.strftime(_TIMESTAMP_FORMAT)
+
+    if kind == 'meal':
+        name = _value(row, 'name')
+        if name is None:
+            raise ValueError("не указано блюдо (name)")
+        return (kind, day, created_at, _value(row, 'kind') or 'перекус', str(name), None,
+                _number(row, 'calories', round, False), _number(row, 'protein', required=False),
+                _number(row, 'carbs', required=False), _number(row, 'fat', required=False))
+    if kind == 'water':
+        return (kind, day, created_at, None, None, _number(row, 'amount', round),
+                None, None, None, None)
+    if kind == 'weight':
+        return (kind, day, created_at, None, None, _number(row, 'amount'),
+                None, None, None, None)
+    if kind == 'workout':
+        workout_type = _value(row, 'kind')
+        if workout_type is None:
+            raise ValueError("не указан тип тренировки (kind)")
+        name = _value(row, 'name')
+        if isinstance(name, list):
+            name = ', '.join(map(str, name))
+        return (kind, day, created_at, str(workout_type), name and str(name),
+                _number(row, 'amount', round), None, None, None, None)
+    raise ValueError(f"неизвестный тип записи {kind!r}")
@@ -0,0 +1,160 @@
+import csv
+import json
+import mmap
+import os
+import struct
+from array import array
+
+# Бинарный колоночный формат каталога:
+#   заголовок: сигнатура и количество продуктов
+#   4 колонки float32 (калории, белки, жиры, углеводы) по count значений
+#   count + 1 смещений uint32 в блоке названий
+#   названия в UTF-8 подряд
+# Числа записываются в порядке байт little-endian (x86, ARM)
+MAGIC = b'FTC1'
+HEADER = struct.Struct('<4sI')
+
+FIELDS = ('calories', 'protein', 'fat', 'carbs')
+
+class FoodCatalog:
+    """Каталог продуктов с пищевой ценностью в компактных колонках.
+
+    Значения на 100г хранятся в array('f') (или в отображенном в память
+    файле) по id продукта, а не списками Python-чисел.
+    """
+
+    def __init__(self, names, columns, source=None):
+        self._names = names
+        self.columns = columns
+        self.source = source
+        self._mmap = None
+        self._view = None
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def name(self, food_id):
+        """Название продукта по id"""
+        return self._names[food_id]
+
+    def names(self):
+        """Последовательность названий в порядке id"""
+        return self._names
+
+    def nutrition(self, food_id):
+        """[калории, белки, жиры, углеводы] на 100г"""
+        # float32 хранит 6.9 как 6.900000095..., округляем обратно
+        return [round(column[food_id], 2) for column in self.columns]
+
+    def close(self):
+        """Освобождение отображенного в память файла"""
+        if self._mmap is not None:
+            self._names.release()
+            for column in self.columns:
+                column.release()
+            self._view.release()
+            self._mmap.close()
+            self._mmap = None
+
+    @classmethod
+    def from_items(cls, items, source=None):
+        """Каталог из пар (название, [калории, белки, жиры, углеводы])"""
+        names = []
+        columns = tuple(array('f') for _ in FIELDS)
+        for name, values in items:
+            names.append(name.strip().lower())
+            for column, value in zip(columns, values):
+                column.append(float(value))
+        return cls(names, columns, source)
+
+    @classmethod
+    def from_dict(cls, foods):
+        """Каталог из словаря в формате FOOD_DATABASE"""
+        return cls.from_items(foods.items(), source='builtin')
+
+    @classmethod
+    def load(cls, path):
+        """Загрузка каталога из .bin, .csv или .json"""
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.bin':
+            return cls.open(path)
+        if extension == '.csv':
+            return cls.from_items(read_csv(path), source=path)
+        if extension == '.json':
+            return cls.from_items(read_json(path), source=path)
+        raise ValueError(f"Неизвестный формат каталога: {path}")
+
+    @classmethod
+    def open(cls, path):
+        """Открытие бинарного каталога через mmap без чтения в память"""
+        with open(path, 'rb') as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = HEADER.unpack_from(mapped)
+        if magic != MAGIC:
+            mapped.close()
+            raise ValueError(f"Файл {path} не является каталогом продуктов")
+
+        view = memoryview(mapped)
+        offset = HEADER.size
+        columns = []
+        for _ in FIELDS:
+            columns.append(view[offset:offset + 4 * count].cast('f'))
+            offset += 4 * count
+
+        offsets = view[offset:offset + 4 * (count + 1)].cast('I')
+        offset += 4 * (count + 1)
+
+        catalog = cls(_MappedNames(view[offset:], offsets), tuple(columns), source=path)
+        catalog._mmap = mapped
+        catalog._view = view
+        return catalog
+
+    def save(self, path):
+        """Сохранение каталога в бинарный колоночный формат"""
+        blob = bytearray()
+        offsets = array('I', [0])
+        for name in self.names():
+            blob += name.encode('utf-8')
+            offsets.append(len(blob))
+
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, len(self)))
+            for column in self.columns:
+                file.write(array('f', column).tobytes())
+            file.write(offsets.tobytes())
+            file.write(blob)
+
+class _MappedNames:
+    """Ленивый доступ к названиям в отображенном файле"""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, food_id):
+        start, end = self._offsets[food_id], self._offsets[food_id + 1]
+        return bytes(self._blob[start:end]).decode('utf-8')
+
+    def release(self):
+        self._offsets.release()
+        self._blob.release()
+
+def read_csv(path):
+    """Чтение продуктов из CSV с колонками name, calories, protein, fat, carbs"""
+    with open(path, newline='', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            yield row['name'], [row[field] or 0 for field in FIELDS]
+
+def read_json(path):
+    """Чтение продуктов из JSON: словарь как FOOD_DATABASE или список объектов"""
+    with open(path, encoding='utf-8') as file:
+        data = json.load(file)
+    if isinstance(data, dict):
+        yield from data.items()
+    else:
+        for item in data:
+            yield item['name'], [item.get(field) or 0 for field in FIELDS]
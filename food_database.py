@@ -1,4 +1,11 @@
-# База данных продуктов с калориями и макронутриентами
+import threading
+
+from config import FOOD_CATALOG_PATH
+from food_catalog import FIELDS, FoodCatalog
+from food_index import FoodIndex
+
+# Встроенная база продуктов с калориями и макронутриентами, используется,
+# если не задан внешний каталог FOOD_CATALOG_PATH (.csv, .json или .bin)
 # Формат: {продукт: [калории, белки, жиры, углеводы] на 100г}
 
 FOOD_DATABASE = {
@@ -49,20 +56,43 @@ FOOD_DATABASE = {
     'вода': [0, 0, 0, 0],
 }
 
+_catalog = None
+_index = None
+_lock = threading.Lock()
+
+def get_catalog():
+    """Каталог продуктов: из FOOD_CATALOG_PATH или встроенный FOOD_DATABASE"""
+    global _catalog
+    if _catalog is None:
+        with _lock:
+            if _catalog is None:
+                if FOOD_CATALOG_PATH:
+                    _catalog = FoodCatalog.load(FOOD_CATALOG_PATH)
+                else:
+                    _catalog = FoodCatalog.from_dict(FOOD_DATABASE)
+    return _catalog
+
+def get_food_index():
+    """Поисковый индекс каталога, строится один раз при первом обращении"""
+    global _index
+    if _index is None:
+        catalog = get_catalog()
+        with _lock:
+            if _index is None:
+                _index = FoodIndex(catalog.names())
+    return _index
+
+def search_foods(food_name, limit=5):
+    """Ранжированный список подходящих продуктов"""
+    catalog = get_catalog()
+    return [catalog.name(food_id) for food_id, _ in get_food_index().search(food_name, limit)]
+
 def get_food_info(food_name):
     """Получение информации о продукте"""
-    food_name_lower = food_name.lower().strip()
-    
-    # Поиск точного совпадения
-    if food_name_lower in FOOD_DATABASE:
-        return FOOD_DATABASE[food_name_lower]
-    
-    # Поиск частичного совпадения
-    for food, nutrition in FOOD_DATABASE.items():
-        if food_name_lower in food or food in food_name_lower:
-            return nutrition
-    
-    return None
+    food_id = get_food_index().best(food_name)
+    if food_id is None:
+        return None
+    return get_catalog().nutrition(food_id)
 
 def calculate_meal_nutrition(food_name, grams=100):
     """Подсчет калорий и макронутриентов для порции"""
@@ -77,6 +107,43 @@ def calculate_meal_nutrition(food_name, grams=100):
         }
     return None
 
+def calculate_meals_nutrition(items):
+    """Подсчет калорий и макронутриентов для нескольких порций сразу
+    
+    items - список пар (продукт, граммы). Возвращает словарь с позициями
+    (название из каталога, граммы, калории, БЖУ), итогами и списком
+    не найденных продуктов.
+    """
+    catalog = get_catalog()
+    index = get_food_index()
+    
+    # Сначала все продукты сопоставляются с каталогом за один проход
+    food_ids, portions, missing = [], [], []
+    for food_name, grams in items:
+        food_id = index.best(food_name)
+        if food_id is None:
+            missing.append(food_name)
+        else:
+            food_ids.append(food_id)
+            portions.append(grams)
+    
+    # Затем каждая колонка каталога (калории, белки, жиры, углеводы)
+    # умножается на вектор порций целиком
+    columns = {}
+    for field, column in zip(FIELDS, catalog.columns):
+        values = [column[food_id] * grams / 100 for food_id, grams in zip(food_ids, portions)]
+        columns[field] = ([int(value) for value in values] if field == 'calories'
+                          else [round(value, 1) for value in values])
+    
+    meal_items = [
+        {'name': catalog.name(food_id), 'grams': grams,
+         **{field: columns[field][position] for field in FIELDS}}
+        for position, (food_id, grams) in enumerate(zip(food_ids, portions))
+    ]
+    totals = {'calories': sum(columns['calories'])}
+    totals.update({field: round(sum(columns[field]), 1) for field in FIELDS[1:]})
+    return {'items': meal_items, 'totals': totals, 'missing': missing}
+
 def get_food_recommendations():
     """Получение рекомендаций по питанию"""
     return {
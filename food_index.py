@@ -0,0 +1,212 @@
+import heapq
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import combinations
+
+# Сколько слов словаря разворачивает один префикс запроса
+PREFIX_EXPANSION = 64
+# Сколько слов запроса учитывается при поиске
+MAX_QUERY_TOKENS = 5
+# Более короткие слова (предлоги, союзы) ищутся только целиком
+MIN_PREFIX_LENGTH = 3
+# Минимальное сходство слов по триграммам для исправления опечатки
+TRIGRAM_THRESHOLD = 0.35
+# Сколько похожих слов словаря подставляется вместо слова с опечаткой
+FUZZY_WORDS = 3
+
+_TOKEN_RE = re.compile(r'\w+')
+
+def normalize(text):
+    """Приведение названия к виду для поиска"""
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+def tokenize(text):
+    """Разбиение нормализованного названия на слова"""
+    return _TOKEN_RE.findall(text)
+
+def trigrams(text):
+    """Множество триграмм строки с граничными пробелами"""
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _contains(posting, rank):
+    """Проверка наличия ранга в отсортированном списке"""
+    position = bisect_left(posting, rank)
+    return position < len(posting) and posting[position] == rank
+
+class FoodIndex:
+    """Поисковый индекс по названиям продуктов.
+
+    Строится один раз и отвечает на запросы без перебора каталога:
+    точное совпадение по хэшу, слова и их префиксы по обратному индексу,
+    опечатки через триграммный индекс по словарю слов. Названия внутри
+    индекса не хранятся, только компактные массивы id.
+
+    Продукты внутри индекса пронумерованы «рангами» в порядке предпочтения
+    (меньше слов, короче название), поэтому лучшие кандидаты среди
+    найденных - просто наименьшие ранги.
+    """
+
+    def __init__(self, names):
+        """names - последовательность названий, id продукта = позиция"""
+        # Первый проход: ключ сортировки (число слов, длина) без хранения названий
+        keys = array('Q')
+        for food_id, name in enumerate(names):
+            name = normalize(name)
+            keys.append(len(set(tokenize(name))) << 48 | len(name) << 32 | food_id)
+        order = array('I', (key & 0xFFFFFFFF for key in sorted(keys)))
+        del keys
+
+        self._ids = order
+        # Точное совпадение по 64-битному хэшу названия: отсортированные хэши
+        # и ранги вместо словаря строк
+        hashes = []
+        tokens = defaultdict(lambda: array('I'))
+
+        for rank, food_id in enumerate(order):
+            name = normalize(names[food_id])
+            hashes.append((hash(name) & 0xFFFFFFFFFFFFFFFF, rank))
+            for token in set(tokenize(name)):
+                tokens[token].append(rank)
+
+        hashes.sort()
+        self._hashes = array('Q', (value for value, _ in hashes))
+        self._hash_ranks = array('I', (rank for _, rank in hashes))
+        del hashes
+
+        self._tokens = dict(tokens)
+        # Отсортированный словарь для поиска слов по префиксу
+        self._vocabulary = sorted(self._tokens)
+
+        # Триграммы слов словаря для исправления опечаток
+        word_trigrams = defaultdict(lambda: array('I'))
+        self._word_trigram_counts = array('B')
+        for word_id, word in enumerate(self._vocabulary):
+            grams = trigrams(word)
+            self._word_trigram_counts.append(min(len(grams), 255))
+            for trigram in grams:
+                word_trigrams[trigram].append(word_id)
+        self._word_trigrams = dict(word_trigrams)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _exact_rank(self, query):
+        """Ранг продукта с точно таким названием или None"""
+        value = hash(query) & 0xFFFFFFFFFFFFFFFF
+        position = bisect_left(self._hashes, value)
+        if position < len(self._hashes) and self._hashes[position] == value:
+            return self._hash_ranks[position]
+        return None
+
+    def _prefix_postings(self, token):
+        """Списки продуктов для всех слов словаря с данным префиксом"""
+        start = bisect_left(self._vocabulary, token)
+        postings = []
+        for word in self._vocabulary[start:start + PREFIX_EXPANSION]:
+            if not word.startswith(token):
+                break
+            postings.append(self._tokens[word])
+        return postings
+
+    def _similar_postings(self, token):
+        """Списки продуктов для слов словаря, похожих на токен (опечатки)"""
+        query_trigrams = trigrams(token)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._word_trigrams.get(trigram, ()))
+
+        similar = []
+        for word_id, count in shared.items():
+            similarity = count / (len(query_trigrams) + self._word_trigram_counts[word_id] - count)
+            if similarity >= TRIGRAM_THRESHOLD:
+                similar.append((similarity, word_id))
+        similar = heapq.nlargest(FUZZY_WORDS, similar)
+        if not similar:
+            return [], 0
+        return [self._tokens[self._vocabulary[word_id]] for _, word_id in similar], similar[0][0]
+
+    def _match_token(self, token):
+        """Лучший доступный способ сопоставления токена: (списки продуктов, вес)"""
+        if token in self._tokens:
+            return [self._tokens[token]], 1.0
+        if len(token) < MIN_PREFIX_LENGTH:
+            return [], 0
+        postings = self._prefix_postings(token)
+        if postings:
+            return postings, 0.8
+        postings, similarity = self._similar_postings(token)
+        return postings, 0.7 * similarity
+
+    def _intersect(self, groups, limit):
+        """Первые limit рангов, входящих в каждую группу списков.
+
+        Списки отсортированы по рангу, поэтому достаточно пройти самую
+        короткую группу по порядку и проверить остальные бинарным поиском.
+        """
+        groups = sorted(groups, key=lambda group: sum(map(len, group)))
+        driver, others = groups[0], groups[1:]
+        found = []
+        for rank in heapq.merge(*driver):
+            if found and found[-1] == rank:
+                continue
+            if all(any(_contains(posting, rank) for posting in group) for group in others):
+                found.append(rank)
+                if len(found) == limit:
+                    break
+        return found
+
+    def _search_tokens(self, tokens, limit):
+        """Поиск по словам: сначала названия, покрывающие больше слов запроса"""
+        matches = [match for match in map(self._match_token, tokens) if match[0]]
+
+        for size in range(len(matches), 0, -1):
+            found = {}
+            for subset in combinations(matches, size):
+                score = sum(weight for _, weight in subset) / len(tokens)
+                for rank in self._intersect([postings for postings, _ in subset], limit):
+                    if score > found.get(rank, 0):
+                        found[rank] = score
+            if found:
+                return found
+        return {}
+
+    def search(self, query, limit=5):
+        """Ранжированный список (id продукта, оценка) для запроса"""
+        query = normalize(query)
+        if not query:
+            return []
+
+        rank = self._exact_rank(query)
+        if rank is not None:
+            return [(self._ids[rank], 1.0)]
+
+        tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+        scores = self._search_tokens(tokens, limit)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(self._ids[rank], score) for rank, score in ranked]
+
+    def best(self, query):
+        """Id продукта, в названии которого есть каждое слово запроса, или None.
+
+        Слово может совпасть целиком, префиксом или с опечаткой. Совпадения
+        части слов («хлеб белый» -> «рис белый») годятся для подсказок
+        search(), но не для записи еды по чужому продукту.
+        """
+        query = normalize(query)
+        if not query:
+            return None
+
+        rank = self._exact_rank(query)
+        if rank is not None:
+            return self._ids[rank]
+
+        tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+        groups = [postings for postings, _ in map(self._match_token, tokens)]
+        if not all(groups):
+            return None
+        found = self._intersect(groups, 1)
+        return self._ids[found[0]] if found else None
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест фитнес-бота: синтетические обновления Telegram проходят
+через FitnessBot целиком (очередь по пользователям, обработчики, база),
+а вызовы Bot API отвечает имитация в памяти без сети
+
+Запуск:
+    python load_test.py --users 5000 --updates 50000
+    python load_test.py --mix meal=4,water=3,menu=2,progress=1 --concurrency 500
+    python load_test.py --history 1000000 --api-latency 30
+    python load_test.py --output after.json --compare before.json
+"""
+
+import argparse
+import asyncio
+import inspect
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+# Модули проекта импортируются в main() после выбора файла базы:
+# config читает DATABASE_PATH, а bot открывает базу при импорте
+
+MEALS = [
+    "завтрак овсянка 60 банан 120 молоко 200",
+    "обед курица 150 гречка 100 огурец 100",
+    "ужин рыба 200 брокколи 150",
+    "перекус яблоко 150 творог 5% 100",
+]
+MENUS = ["main_menu", "food_menu", "water_menu", "workout_menu", "progress_menu"]
+
+DEFAULT_MIX = "meal=3,water=3,menu=3,progress=1"
+
+# Первый id синтетических пользователей
+FIRST_USER_ID = 1
+
+class FakeBotAPI(BaseRequest):
+    """Bot API в памяти: отвечает на вызовы бота без сети и считает их"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        name = url.rsplit('/', 1)[-1]
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data is not None else {}
+        if name == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'load_test_bot'}
+        elif name in ('sendMessage', 'editMessageText', 'sendPhoto', 'sendDocument'):
+            result = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 1)), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+            if name == 'sendPhoto':
+                result['photo'] = [{'file_id': f"photo{result['message_id']}",
+                                    'file_unique_id': str(result['message_id']),
+                                    'width': 800, 'height': 500}]
+        else:
+            result = True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+def build_workloads():
+    """Виды нагрузки: имя -> (тип обновления, генератор текста или callback_data)"""
+    import render
+    from router import encode
+    return {
+        'meal': ('text', lambda rng: rng.choice(MEALS)),
+        'water': ('callback', lambda rng: encode(render.WATER_PREFIX, rng.choice((200, 250, 500)))),
+        'menu': ('callback', lambda rng: rng.choice(MENUS)),
+        'progress': ('text', lambda rng: "/progress"),
+        'report': ('text', lambda rng: "/report week"),
+        'weight': ('text', lambda rng: f"вес {rng.uniform(60, 100):.1f}"),
+    }
+
+def make_update(update_id, user_id, kind, payload):
+    """JSON обновления Telegram: сообщение или нажатие кнопки"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"}
+    chat = {'id': user_id, 'type': 'private'}
+    now = int(time.time())
+    if kind == 'callback':
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'chat_instance': str(user_id), 'data': payload, 'from': user,
+            'message': {'message_id': 1, 'date': now, 'chat': chat, 'text': "меню"},
+        }}
+    message = {'message_id': update_id, 'date': now, 'chat': chat, 'from': user, 'text': payload}
+    if payload.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0,
+                                'length': len(payload.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+def parse_mix(text):
+    """Доли видов нагрузки из строки meal=3,water=3,..."""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        try:
+            mix[name.strip()] = float(weight or 1)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"неверная доля нагрузки: {part!r}")
+    return mix
+
+def instrument_storage(storage):
+    """Замер времени async-методов хранилища: {метод: [вызовов, секунд]}"""
+    timings = {}
+
+    def timed(name, method):
+        entry = timings.setdefault(name, [0, 0.0])
+
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                entry[0] += 1
+                entry[1] += time.perf_counter() - start
+        return wrapper
+
+    for name in dir(storage):
+        if name.startswith('_') or name in ('connect', 'close'):
+            continue
+        method = getattr(storage, name)
+        if inspect.iscoroutinefunction(method):
+            setattr(storage, name, timed(name, method))
+    return timings
+
+def percentile(values, share):
+    """Перцентиль по отсортированному списку (ближайший ранг)"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(share * len(values)) - 1))]
+
+def peak_rss_mb():
+    """Пиковый RSS процесса в мегабайтах"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS - байты
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+async def replay(bot, args, workloads, rng, count, update_ids):
+    """Отправка count обновлений; не больше args.concurrency одновременно в обработке.
+
+    Задержка - от передачи обновления боту до конца обработки, включая
+    ожидание в очереди пользователя; время обработчика - только выполнение.
+    """
+    application = bot.application
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    in_flight = asyncio.Semaphore(args.concurrency)
+    latencies, handler_times, tasks = [], [], set()
+
+    async def handle(update):
+        start = time.perf_counter()
+        await application.process_update(update)
+        handler_times.append(time.perf_counter() - start)
+
+    async def submit(update):
+        start = time.perf_counter()
+        try:
+            await bot.scheduler.process_update(update, handle(update))
+            latencies.append(time.perf_counter() - start)
+        finally:
+            in_flight.release()
+
+    started = time.perf_counter()
+    for _ in range(count):
+        await in_flight.acquire()
+        name = rng.choices(names, weights)[0]
+        kind, payload = workloads[name]
+        user_id = FIRST_USER_ID + rng.randrange(args.users)
+        data = make_update(next(update_ids), user_id, kind, payload(rng))
+        task = asyncio.create_task(submit(Update.de_json(data, application.bot)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started, latencies, handler_times
+
+async def run(bot, api, args, workloads):
+    """Прогрев и замер; возвращает словарь результатов"""
+    from config import (DEFAULT_CALORIES_GOAL, DEFAULT_WATER_GOAL, DEFAULT_PROTEIN_GOAL,
+                        DEFAULT_CARBS_GOAL, DEFAULT_FAT_GOAL)
+    storage = bot.db
+    application = bot.application
+    errors = Counter()
+
+    async def on_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    application.add_error_handler(on_error)
+    rng = random.Random(args.seed)
+    update_ids = itertools.count(1)
+
+    try:
+        async with application:
+            await bot.post_init(application)
+            await storage.import_rows('users', [
+                (user_id, f"user{user_id}", f"User{user_id}", DEFAULT_CALORIES_GOAL,
+                 DEFAULT_WATER_GOAL, DEFAULT_PROTEIN_GOAL, DEFAULT_CARBS_GOAL,
+                 DEFAULT_FAT_GOAL, None)
+                for user_id in range(FIRST_USER_ID, FIRST_USER_ID + args.users)
+            ])
+            if args.history:
+                from benchmark import fill_database
+                database = storage.database
+                fill_database(database, args.history, FIRST_USER_ID + args.users, 365)
+                database.rebuild_daily_totals()
+
+            await replay(bot, args, workloads, rng, args.warmup, update_ids)
+            timings = instrument_storage(storage)
+            api.calls.clear()
+            errors.clear()
+            elapsed, latencies, handler_times = await replay(
+                bot, args, workloads, rng, args.updates, update_ids)
+    finally:
+        await bot.post_shutdown(application)
+
+    latencies.sort()
+    db_time = sum(seconds for _, seconds in timings.values())
+    handler_time = sum(handler_times)
+    return {
+        'updates': len(latencies),
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(len(latencies) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99': round(percentile(latencies, 0.99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3),
+        },
+        'handler_ms': {
+            'mean': round(statistics.fmean(handler_times) * 1000, 3),
+            'p99': round(percentile(sorted(handler_times), 0.99) * 1000, 3),
+        },
+        # Доля времени обработчиков в ожидании хранилища (вызовы перекрываются
+        # между обновлениями, но внутри одного обработчика идут последовательно)
+        'db_time_share': round(db_time / handler_time, 3) if handler_time else None,
+        'db_calls': {name: {'calls': calls, 'ms': round(seconds * 1000, 1)}
+                     for name, (calls, seconds) in sorted(timings.items()) if calls},
+        'api_calls': dict(api.calls),
+        'errors': dict(errors),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+def print_results(results):
+    latency = results['latency_ms']
+    print(f"Обновлений: {results['updates']} за {results['seconds']}с "
+          f"({results['updates_per_sec']:,.0f}/с)")
+    print(f"Задержка: p50 {latency['p50']:.2f}мс, p95 {latency['p95']:.2f}мс, "
+          f"p99 {latency['p99']:.2f}мс, max {latency['max']:.2f}мс")
+    print(f"Обработчик: в среднем {results['handler_ms']['mean']:.2f}мс, "
+          f"доля базы {results['db_time_share']:.0%}")
+    print(f"Пиковый RSS: {results['peak_rss_mb']:.0f}МБ")
+    if results['errors']:
+        print(f"Ошибки: {results['errors']}")
+    slowest = sorted(results['db_calls'].items(), key=lambda item: -item[1]['ms'])[:5]
+    for name, entry in slowest:
+        print(f"  {name:>22}: {entry['calls']} вызовов, {entry['ms'] / entry['calls']:.3f}мс")
+
+def compare(baseline, results):
+    """Изменение основных показателей относительно сохраненного прогона"""
+    pairs = [
+        ("обновлений/с", baseline['updates_per_sec'], results['updates_per_sec']),
+        ("p50, мс", baseline['latency_ms']['p50'], results['latency_ms']['p50']),
+        ("p95, мс", baseline['latency_ms']['p95'], results['latency_ms']['p95']),
+        ("p99, мс", baseline['latency_ms']['p99'], results['latency_ms']['p99']),
+        ("доля базы", baseline['db_time_share'], results['db_time_share']),
+        ("пиковый RSS, МБ", baseline['peak_rss_mb'], results['peak_rss_mb']),
+    ]
+    print("Сравнение с прошлым прогоном:")
+    for name, old, new in pairs:
+        change = f"{(new - old) / old:+.1%}" if old else "-"
+        print(f"  {name:>16}: {old} -> {new} ({change})")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест фитнес-бота')
+    parser.add_argument('--users', type=int, default=2000, help='синтетических пользователей')
+    parser.add_argument('--updates', type=int, default=20000, help='обновлений в замере')
+    parser.add_argument('--warmup', type=int, default=1000, help='обновлений прогрева')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help='доли нагрузки meal, water, menu, progress, report, weight '
+                             f'(по умолчанию {DEFAULT_MIX})')
+    parser.add_argument('--concurrency', type=int, default=500,
+                        help='обновлений, переданных боту и еще не обработанных')
+    parser.add_argument('--api-latency', type=float, default=0.0,
+                        help='задержка ответа имитации Bot API, мс')
+    parser.add_argument('--history', type=int, default=0,
+                        help='строк истории в каждой таблице до замера (только SQLite)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', help='файл базы (по умолчанию временный)')
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_PATH'] = args.database or os.path.join(tmp, 'load_test.db')
+        # Фоновые резервные копии не входят в замер
+        os.environ['BACKUP_INTERVAL_MIN'] = '0'
+        from bot import FitnessBot
+        logging.getLogger().setLevel(logging.WARNING)
+
+        workloads = build_workloads()
+        unknown = set(args.mix) - set(workloads)
+        if unknown:
+            parser.error(f"неизвестная нагрузка: {', '.join(sorted(unknown))}")
+
+        api = FakeBotAPI(args.api_latency / 1000)
+        bot = FitnessBot(mode='load', request=api)
+        results = asyncio.run(run(bot, api, args, workloads))
+
+    report = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'config': {
+            'users': args.users, 'updates': args.updates, 'warmup': args.warmup,
+            'mix': args.mix, 'concurrency': args.concurrency,
+            'api_latency_ms': args.api_latency, 'history': args.history, 'seed': args.seed,
+        },
+        'results': results,
+    }
+    print_results(results)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            compare(json.load(file)['results'], results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    return report
+
+if __name__ == '__main__':
+    main()
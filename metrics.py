@@ -0,0 +1,252 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import threading
+import time
+
+from config import METRICS_ENABLED
+
+# Верхние границы корзин гистограмм задержки, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Период замера задержки цикла событий, секунды
+LOOP_LAG_INTERVAL = 0.5
+
+# Семейства гистограмм: имя -> (метрика Prometheus, метка, описание)
+FAMILIES = {
+    'handler': ('fitness_handler_seconds', 'handler', "Время обработчиков бота"),
+    'storage': ('fitness_storage_seconds', 'method',
+                "Время вызовов хранилища из обработчиков, с ожиданием в пуле потоков"),
+    'db': ('fitness_db_seconds', 'method', "Время выполнения методов Database"),
+    'loop_lag': ('fitness_event_loop_lag_seconds', None, "Задержка цикла событий"),
+}
+
+class Histogram:
+    """Число вызовов, суммарное и максимальное время, корзины задержки, ошибки и строки"""
+
+    __slots__ = ('count', 'total', 'max', 'buckets', 'errors', 'rows', '_lock')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.errors = 0
+        self.rows = 0
+        # Методы Database вызываются из нескольких потоков
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, rows=0, error=False):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+            self.buckets[index] += 1
+            self.rows += rows
+            self.errors += error
+
+    def snapshot(self):
+        with self._lock:
+            return self.count, self.total, self.max, list(self.buckets), self.errors, self.rows
+
+def _quantile(count, maximum, buckets, share):
+    """Оценка квантиля сверху: граница корзины, в которую он попадает"""
+    rank = share * count
+    seen = 0
+    for bound, bucket in zip(BUCKETS, buckets):
+        seen += bucket
+        if seen >= rank:
+            return min(bound, maximum)
+    return maximum
+
+def _row_count(result):
+    """Число строк в результате метода базы: список или (список, есть_еще)"""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return 0
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Metrics:
+    """Метрики процесса бота для /metrics (формат Prometheus) и /stats (JSON).
+
+    Обработчики и методы хранилища оборачиваются один раз при настройке;
+    замер - два вызова perf_counter и инкременты под коротким
+    блокированием, поэтому метрики можно не выключать под нагрузкой.
+    Счетчики компонентов (очередь обновлений, кэш, напоминания) читаются
+    из их stats() только при запросе метрик.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        # семейство -> {значение метки: Histogram}
+        self._histograms = {family: {} for family in FAMILIES}
+        self._collectors = {}
+        self._loop_task = None
+        self.loop_lag = 0.0
+
+    def histogram(self, family, label=None):
+        histograms = self._histograms[family]
+        histogram = histograms.get(label)
+        if histogram is None:
+            histogram = histograms.setdefault(label, Histogram())
+        return histogram
+
+    def track(self, handler, name=None):
+        """Обработчик бота с замером времени и ошибок"""
+        if not self.enabled:
+            return handler
+        histogram = self.histogram('handler', name or handler.__name__)
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await handler(*args, **kwargs)
+            except Exception:
+                histogram.observe(time.perf_counter() - start, error=True)
+                raise
+            histogram.observe(time.perf_counter() - start)
+            return result
+        return wrapper
+
+    def _wrap(self, method, histogram):
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await method(*args, **kwargs)
+                except Exception:
+                    histogram.observe(time.perf_counter() - start, error=True)
+                    raise
+                histogram.observe(time.perf_counter() - start, _row_count(result))
+                return result
+        else:
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = method(*args, **kwargs)
+                except Exception:
+                    histogram.observe(time.perf_counter() - start, error=True)
+                    raise
+                histogram.observe(time.perf_counter() - start, _row_count(result))
+                return result
+        return wrapper
+
+    def instrument_storage(self, storage):
+        """Замер публичных методов хранилища и, для SQLite, методов Database под ним"""
+        if not self.enabled:
+            return
+        targets = [('storage', storage)]
+        database = getattr(storage, 'database', None)
+        if database is not None:
+            targets.append(('db', database))
+        for family, target in targets:
+            for name in dir(target):
+                if name.startswith('_') or name in ('connect', 'close'):
+                    continue
+                method = getattr(target, name)
+                if inspect.ismethod(method):
+                    setattr(target, name, self._wrap(method, self.histogram(family, name)))
+
+    def collect(self, group, stats):
+        """Счетчики компонента: stats() -> {имя: число}, метрики fitness_<group>_<имя>"""
+        self._collectors[group] = stats
+
+    async def _watch_loop(self):
+        histogram = self.histogram('loop_lag')
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lag = max(0.0, time.perf_counter() - start - LOOP_LAG_INTERVAL)
+            histogram.observe(self.loop_lag)
+
+    def start(self):
+        """Запуск замера задержки цикла событий"""
+        if self.enabled and self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._watch_loop())
+
+    async def stop(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+
+    def _collected(self):
+        values = {}
+        for group, stats in self._collectors.items():
+            for name, value in stats().items():
+                if isinstance(value, (int, float)):
+                    values[f"fitness_{group}_{name}"] = value
+        return values
+
+    def prometheus(self):
+        """Текстовый формат Prometheus 0.0.4"""
+        lines = []
+        for family, (metric, label, description) in FAMILIES.items():
+            # Методы без вызовов не выводятся
+            snapshots = [(value, histogram.snapshot()) for value, histogram
+                         in sorted(self._histograms[family].items(), key=lambda item: str(item[0]))]
+            snapshots = [(value, snapshot) for value, snapshot in snapshots if snapshot[0]]
+            if not snapshots:
+                continue
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} histogram"]
+            counters = []
+            for value, (count, total, _, buckets, errors, rows) in snapshots:
+                labels = f'{label}="{_escape(value)}"' if label else ''
+                prefix = labels + ',' if labels else ''
+                cumulative = 0
+                for bound, bucket in zip(BUCKETS, buckets):
+                    cumulative += bucket
+                    lines.append(f'{metric}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{prefix}le="+Inf"}} {count}')
+                suffix = f'{{{labels}}}' if labels else ''
+                lines.append(f'{metric}_sum{suffix} {total}')
+                lines.append(f'{metric}_count{suffix} {count}')
+                counters.append((suffix, errors, rows))
+            base = metric[:-len('_seconds')]
+            if label:
+                lines += [f"# HELP {base}_errors_total Вызовы, завершившиеся исключением",
+                          f"# TYPE {base}_errors_total counter"]
+                lines += [f"{base}_errors_total{suffix} {errors}" for suffix, errors, _ in counters]
+            if family == 'db':
+                lines += [f"# HELP {base}_rows_total Строк возвращено выборками",
+                          f"# TYPE {base}_rows_total counter"]
+                lines += [f"{base}_rows_total{suffix} {rows}" for suffix, _, rows in counters]
+
+        for name, value in self._collected().items():
+            lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def stats(self):
+        """Сводка для отладки: вызовы, среднее и квантили в миллисекундах"""
+        result = {}
+        for family in FAMILIES:
+            summary = {}
+            for value, histogram in self._histograms[family].items():
+                count, total, maximum, buckets, errors, rows = histogram.snapshot()
+                if not count:
+                    continue
+                entry = {
+                    'count': count,
+                    'mean_ms': round(total / count * 1000, 3),
+                    'p50_ms': round(_quantile(count, maximum, buckets, 0.5) * 1000, 3),
+                    'p99_ms': round(_quantile(count, maximum, buckets, 0.99) * 1000, 3),
+                    'max_ms': round(maximum * 1000, 3),
+                    'errors': errors,
+                }
+                if family == 'db':
+                    entry['rows'] = rows
+                summary[value if value is not None else 'all'] = entry
+            result[family] = summary
+        result['loop_lag_ms'] = round(self.loop_lag * 1000, 3)
+        for group, stats in self._collectors.items():
+            result[group] = stats()
+        return result
@@ -0,0 +1,173 @@
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from config import DB_SLOW_QUERY_MS, PROFILE_DIR, PROFILE_INTERVAL_MS
+
+slow_logger = logging.getLogger('slow_queries')
+
+# Инструкции, для которых строится EXPLAIN QUERY PLAN
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+# Ограничение длины параметров запроса в журнале
+_MAX_PARAMETERS_REPR = 200
+
+class SlowQueryCursor(sqlite3.Cursor):
+    """Курсор SQLite, записывающий в журнал медленные запросы с их планом.
+
+    Время запроса - execute() и выборки fetch*() до следующего запроса
+    или закрытия курсора. Порог общий для всех соединений и меняется
+    без перезапуска (SlowQueryCursor.threshold, секунды; None - выключено).
+    """
+
+    threshold = DB_SLOW_QUERY_MS / 1000 if DB_SLOW_QUERY_MS else None
+
+    _statement = None
+    _parameters = None
+    _rows = None
+    _elapsed = 0.0
+
+    def execute(self, sql, parameters=()):
+        self._report()
+        self._statement, self._parameters, self._rows = sql, parameters, None
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed = time.perf_counter() - start
+
+    def executemany(self, sql, seq_of_parameters):
+        self._report()
+        rows = seq_of_parameters if isinstance(seq_of_parameters, list) else list(seq_of_parameters)
+        # План пакетной записи не строится: параметры у каждой строки свои
+        self._statement, self._parameters, self._rows = sql, None, len(rows)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, rows)
+        finally:
+            self._elapsed = time.perf_counter() - start
+
+    def _fetch(self, fetch, *args):
+        if self._statement is None:
+            return fetch(*args)
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def close(self):
+        self._report()
+        super().close()
+
+    def _report(self):
+        """Запись предыдущего запроса курсора, если он дольше порога"""
+        statement, self._statement = self._statement, None
+        if statement is None or self.threshold is None or self._elapsed < self.threshold:
+            return
+        plan = ""
+        if self._parameters is not None and statement.lstrip().upper().startswith(_EXPLAINABLE):
+            try:
+                rows = self.connection.execute('EXPLAIN QUERY PLAN ' + statement,
+                                               self._parameters).fetchall()
+                plan = "\n".join(f"  {'  ' * _depth(rows, row)}{row[-1]}" for row in rows)
+            except sqlite3.Error as error:
+                plan = f"  план недоступен: {error}"
+        parameters = (f"{self._rows} строк" if self._parameters is None
+                      else repr(self._parameters)[:_MAX_PARAMETERS_REPR])
+        slow_logger.warning("Медленный запрос %.1f мс (%s):\n%s\n%s",
+                            self._elapsed * 1000, parameters, " ".join(statement.split()), plan)
+
+def cursor_class():
+    """Класс курсора для нового запроса: при выключенном журнале - обычный, без накладных расходов"""
+    return sqlite3.Cursor if SlowQueryCursor.threshold is None else SlowQueryCursor
+
+def _depth(rows, row):
+    """Уровень вложенности строки плана по ссылкам на родителя"""
+    parents = {node: parent for node, parent, *_ in rows}
+    depth, parent = 0, row[1]
+    while parent in parents:
+        depth, parent = depth + 1, parents[parent]
+    return depth
+
+class SamplingProfiler:
+    """Выборочный профилировщик процесса бота.
+
+    Фоновый поток раз в interval секунд снимает стеки всех потоков
+    (цикл событий и пул потоков базы) и считает одинаковые. Через duration
+    секунд результат записывается в каталог в свернутом формате
+    (поток;функция;...;функция число) - его читают flamegraph.pl и speedscope.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000, directory=PROFILE_DIR):
+        self.interval = interval
+        self.directory = directory
+        self.samples = Counter()
+        self.path = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration):
+        """Запуск записи на duration секунд; возвращает путь будущего файла"""
+        if self.running:
+            raise RuntimeError("профилирование уже идет")
+        self.samples = Counter()
+        self.path = os.path.join(
+            self.directory, f"profile-{datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}.folded")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(duration,),
+                                        name='profiler', daemon=True)
+        self._thread.start()
+        return self.path
+
+    def stop(self):
+        """Досрочное завершение с записью собранного"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, duration):
+        own = threading.get_ident()
+        deadline = time.monotonic() + duration
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            self.sample(exclude=own)
+        self.write()
+
+    def sample(self, exclude=None):
+        """Один снимок стеков всех потоков, кроме exclude"""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == exclude:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def write(self):
+        """Запись свернутых стеков в файл self.path"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        return self.path
@@ -1,23 +1,32 @@
 #!/usr/bin/env python3
 """
-Альтернативный запуск только бота для Railway
+Запуск бота для Railway
 """
 
+import asyncio
 import os
 import sys
-from bot import FitnessBot
+from config import SHARDS
+from sharding import ShardFront
 
 def main():
-    """Запуск только Telegram бота"""
+    """Запуск Telegram бота"""
     try:
         print("🚀 Запуск фитнес-бота...")
         print(f"🤖 Токен: {'Установлен' if os.getenv('BOT_TOKEN') else 'Не найден'}")
         
+        if SHARDS > 1:
+            # Фронт распределяет обновления по процессам шардов
+            asyncio.run(ShardFront().serve())
+            return
+        
+        # Импорт здесь: при импорте bot открывает базу, фронту шардов она не нужна
+        from bot import FitnessBot
         bot = FitnessBot()
-        print("✅ Бот инициализирован")
-        print("🤖 Бот запущен...")
+        print(f"✅ Бот инициализирован, режим: {bot.mode}")
         
-        bot.run()
+        # Веб-сервер нужен Railway для проверки здоровья и в режиме polling
+        bot.run(web=True)
         
     except Exception as e:
         print(f"❌ Ошибка запуска бота: {e}")
@@ -0,0 +1,246 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+from config import (DEFAULT_WATER_GOAL, REMINDER_RATE, REMINDER_BATCH, REMINDER_WINDOW,
+                    REMINDER_LOAD_LIMIT, REMINDER_TIMEZONE, SHARDS)
+
+logger = logging.getLogger(__name__)
+
+# Интервал по умолчанию (минуты) и активные часы напоминаний
+DEFAULT_INTERVALS = {'water': 120, 'meal': 240}
+DEFAULT_HOURS = (9, 21)
+# Активные часы считаются в этом поясе, а не в местном времени сервера
+REMINDER_ZONE = ZoneInfo(REMINDER_TIMEZONE)
+
+def next_due(after, interval_min, start_min, end_min):
+    """Ближайший срок напоминания (unix time) через interval_min после after.
+
+    Сроки вне активных часов [start_min, end_min) (минуты от полуночи
+    в поясе REMINDER_ZONE) переносятся на начало активных часов.
+    """
+    moment = (datetime.fromtimestamp(after, REMINDER_ZONE).replace(microsecond=0)
+              + timedelta(minutes=interval_min))
+    minutes = moment.hour * 60 + moment.minute
+    if minutes >= end_min:
+        moment += timedelta(days=1)
+    if minutes < start_min or minutes >= end_min:
+        moment = moment.replace(hour=start_min // 60, minute=start_min % 60, second=0)
+    return int(moment.timestamp())
+
+class RateLimiter:
+    """Ограничение частоты отправок (token bucket): rate в секунду, всплеск до burst"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Ожидание права на одну отправку"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Пауза всех отправок после RetryAfter от Telegram"""
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+class ReminderScheduler:
+    """Планировщик напоминаний поверх таблицы reminders.
+
+    Таблица с индексом по next_due - постоянная очередь сроков. В памяти
+    хранится только куча ближайших REMINDER_WINDOW секунд; она дозагружается
+    из индекса по мере продвижения окна, поэтому ни запуск, ни работа
+    не требуют перебора всех пользователей. Подошедшие напоминания
+    обрабатываются пачками: одна выборка прогресса воды, отправка через
+    общий ограничитель частоты, один UPDATE новых сроков. Напоминание
+    о воде пропускается, если цель на сегодня уже выполнена.
+    """
+
+    def __init__(self, storage, send, rate=REMINDER_RATE / SHARDS, batch=REMINDER_BATCH,
+                 window=REMINDER_WINDOW, load_limit=REMINDER_LOAD_LIMIT, clock=time.time):
+        self.storage = storage
+        # send(user_id, kind, progress): progress - (water_ml, water_goal) для воды
+        self.send = send
+        # Каждый шард отправляет сам, поэтому по умолчанию общий лимит делится между ними
+        self.limiter = RateLimiter(rate)
+        self.batch = batch
+        self.window = window
+        self.load_limit = load_limit
+        self.clock = clock
+
+        self._heap = []
+        # (user_id, kind) -> строка напоминания из кучи; устаревшие записи кучи
+        # (после изменения или удаления) не совпадают со строкой и пропускаются
+        self._queued = {}
+        self._loaded_until = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+        self.sent = 0
+        self.skipped = 0
+        self.missed = 0
+        self.failed = 0
+
+    def _push(self, row):
+        user_id, kind, _, _, _, due = row
+        self._queued[user_id, kind] = row
+        heapq.heappush(self._heap, (due, user_id, kind))
+
+    def _track(self, row):
+        """Учет нового или измененного напоминания в куче"""
+        user_id, kind, _, _, _, due = row
+        if due <= self._loaded_until:
+            self._push(row)
+            self._wakeup.set()
+        else:
+            # Будет загружено из базы, когда окно дойдет до срока
+            self._queued.pop((user_id, kind), None)
+
+    async def schedule(self, user_id, kind, interval_min, start_min, end_min):
+        """Создание или изменение напоминания; возвращает первый срок"""
+        if kind not in DEFAULT_INTERVALS:
+            raise ValueError(f"неизвестный вид напоминания: {kind}")
+        due = next_due(self.clock(), interval_min, start_min, end_min)
+        await self.storage.set_reminder(user_id, kind, interval_min, start_min, end_min, due)
+        self._track((user_id, kind, interval_min, start_min, end_min, due))
+        return due
+
+    async def cancel(self, user_id, kind=None):
+        """Удаление напоминаний пользователя"""
+        await self.storage.delete_reminders(user_id, kind)
+        for key in [key for key in self._queued if key[0] == user_id and kind in (None, key[1])]:
+            del self._queued[key]
+
+    async def load(self, now):
+        """Загрузка сроков ближайшего окна из индекса"""
+        until = now + self.window
+        rows = await self.storage.get_due_reminders(until, self.load_limit)
+        for row in rows:
+            if (row[0], row[1]) not in self._queued:
+                self._push(row)
+        # Если загрузка уперлась в лимит, окно считается загруженным до последнего срока
+        self._loaded_until = until if len(rows) < self.load_limit else rows[-1][5]
+
+    def _pop_due(self, now):
+        """Подошедшие напоминания, не больше batch"""
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self.batch:
+            due, user_id, kind = heapq.heappop(self._heap)
+            row = self._queued.get((user_id, kind))
+            if row is None or row[5] != due:
+                continue
+            del self._queued[user_id, kind]
+            batch.append(row)
+        return batch
+
+    async def process(self, batch, now):
+        """Отправка пачки подошедших напоминаний и перенос их сроков"""
+        water_users = [row[0] for row in batch if row[1] == 'water']
+        progress = await self.storage.get_water_progress(water_users) if water_users else {}
+
+        deliveries, updates = [], []
+        for row in batch:
+            user_id, kind, interval_min, start_min, end_min, due = row
+            following = next_due(due, interval_min, start_min, end_min)
+            if following <= now:
+                following = next_due(now, interval_min, start_min, end_min)
+            updates.append((following, user_id, kind, due))
+
+            if now - due > interval_min * 60:
+                # Пропущено, пока бот не работал: не присылаем устаревшее
+                self.missed += 1
+            elif kind == 'water':
+                water_ml, water_goal = progress.get(user_id, (0, DEFAULT_WATER_GOAL))
+                if water_ml >= water_goal:
+                    self.skipped += 1
+                else:
+                    deliveries.append(self._deliver(user_id, kind, (water_ml, water_goal)))
+            else:
+                deliveries.append(self._deliver(user_id, kind, None))
+
+        await asyncio.gather(*deliveries)
+        await self.storage.reschedule_reminders(updates)
+        for following, user_id, kind, _ in updates:
+            if (user_id, kind) not in self._queued and following <= self._loaded_until:
+                # Строка не менялась во время отправки (иначе ее учел schedule)
+                row = next(row for row in batch if row[:2] == (user_id, kind))
+                self._push(row[:5] + (following,))
+
+    async def _deliver(self, user_id, kind, progress):
+        for attempt in range(2):
+            await self.limiter.acquire()
+            try:
+                await self.send(user_id, kind, progress)
+                self.sent += 1
+                return
+            except RetryAfter as error:
+                retry_after = error.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.limiter.pause(retry_after)
+            except Forbidden:
+                # Пользователь заблокировал бота
+                await self.cancel(user_id)
+                return
+            except TelegramError as error:
+                logger.warning("Напоминание %s для %s не отправлено: %s", kind, user_id, error)
+                break
+        self.failed += 1
+
+    async def run(self):
+        """Основной цикл: загрузка окна, отправка подошедших, ожидание следующего срока"""
+        while True:
+            now = self.clock()
+            if now + self.window / 2 >= self._loaded_until:
+                await self.load(now)
+            batch = self._pop_due(now)
+            if batch:
+                try:
+                    await self.process(batch, now)
+                except Exception:
+                    logger.exception("Ошибка отправки напоминаний")
+                continue
+
+            timeout = self._loaded_until - self.window / 2 - now
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - now)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.05, min(timeout, self.window / 2)))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self):
+        """Счетчики планировщика"""
+        return {
+            'queued': len(self._queued),
+            'sent': self.sent,
+            'skipped': self.skipped,
+            'missed': self.missed,
+            'failed': self.failed,
+        }
@@ -0,0 +1,389 @@
+from datetime import date, datetime, timedelta
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from food_database import get_food_recommendations, get_meal_suggestions
+from reminders import REMINDER_ZONE
+from router import encode
+
+# Статические меню и тексты строятся один раз при импорте;
+# обработчики только подставляют их в ответ
+
+def _keyboard(*rows):
+    """Клавиатура из пар (текст, callback_data), по кнопке в ряду"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton(text, callback_data=data)]
+                                 for text, data in rows])
+
+MAIN_MENU = _keyboard(
+    ("🍽 Питание", "food_menu"),
+    ("💧 Вода", "water_menu"),
+    ("🏋️ Тренировки", "workout_menu"),
+    ("📊 Прогресс", "progress_menu"),
+    ("💡 Советы", "tips_menu"),
+)
+MAIN_MENU_TEXT = "🎯 Главное меню\nВыберите раздел:"
+
+FOOD_MENU = _keyboard(
+    ("➕ Добавить прием пищи", "add_meal"),
+    ("📋 Дневник питания", "daily_food"),
+    ("💡 Рекомендации", "food_tips"),
+    ("🔙 Назад", "main_menu"),
+)
+FOOD_MENU_TEXT = "🍽 Меню питания\nЧто хотите сделать?"
+
+# Кнопки воды: water_<мл>
+WATER_PREFIX = "water_"
+WATER_MENU = _keyboard(
+    *((f"💧 +{amount}мл", encode(WATER_PREFIX, amount)) for amount in (200, 300, 500)),
+    ("🔙 Назад", "main_menu"),
+)
+
+# Страницы отчета: report_<период>:<страница>
+REPORT_PREFIX = "report_"
+REPORT_PAGE_SIZE = 10
+REPORT_TITLES = {'week': "неделю", 'month': "месяц", 'year': "год"}
+# Графики: chart_<период>
+CHART_PREFIX = "chart_"
+
+WORKOUT_MENU = _keyboard(
+    ("➕ Добавить тренировку", "add_workout"),
+    ("💪 Кардио", "workout_cardio"),
+    ("🏋️ Силовые", "workout_strength"),
+    ("📊 За неделю", "workout_stats"),
+    ("🔙 Назад", "main_menu"),
+)
+WORKOUT_MENU_TEXT = "🏋️ Меню тренировок\nВыберите тип тренировки:"
+
+WEIGHT_MENU = _keyboard(
+    ("⚖️ Добавить вес", "add_weight"),
+    ("📈 История веса", "weight_history"),
+    ("📊 Отчет за неделю", encode(REPORT_PREFIX, 'week', 0)),
+    ("📉 График за месяц", encode(CHART_PREFIX, 'month')),
+    ("🔙 Назад", "main_menu"),
+)
+WEIGHT_MENU_TEXT = "⚖️ Меню веса\nВыберите действие:"
+
+WELCOME_TEXT = """
+🎉 Привет, {first_name}!
+
+Я твой персональный фитнес-ассистент для похудения!
+
+Что я умею:
+✅ Вести дневник питания и считать калории
+✅ Напоминать пить воду
+✅ Планировать тренировки
+✅ Отслеживать прогресс
+✅ Давать рекомендации по питанию и витаминам
+
+Нажми /menu чтобы открыть главное меню!
+"""
+
+HELP_TEXT = """
+📋 Доступные команды:
+
+🍽 Питание:
+/food - меню питания
+/add_meal - добавить прием пищи
+/daily_food - дневник питания за сегодня
+
+💧 Вода:
+/water - меню воды
+/add_water - добавить выпитую воду
+
+🏋️ Тренировки:
+/workout - меню тренировок
+/add_workout - добавить тренировку
+/workout_stats - тренировки за неделю
+
+📊 Прогресс:
+/weight - меню веса
+/add_weight - добавить вес
+/progress - общий прогресс
+/report week|month|year - отчет за период
+/chart week|month|year - график веса и калорий
+
+⏰ Напоминания:
+/remind - настроить напоминания о воде и еде
+
+💾 Данные:
+/export csv|jsonl - выгрузить дневник файлом
+/import - загрузить дневник из файла
+
+💡 Рекомендации:
+/tips - советы по питанию
+/vitamins - рекомендации по витаминам
+
+/menu - главное меню
+"""
+
+ADD_MEAL_TEXT = (
+    "🍽 Добавление приема пищи\n\n"
+    "Напишите в формате:\n"
+    "тип_приема_пищи продукт граммы\n\n"
+    "Например:\n"
+    "завтрак овсянка 100\n"
+    "обед курица грудка 150 гречка 100\n"
+    "ужин творог 200\n\n"
+    "В одном сообщении можно указать несколько продуктов.\n"
+    "Типы приемов пищи: завтрак, обед, ужин, перекус"
+)
+
+ADD_WATER_TEXT = (
+    "💧 Добавление воды\n\n"
+    "Напишите количество выпитой воды в миллилитрах\n"
+    "Например: 300"
+)
+
+ADD_WORKOUT_TEXT = (
+    "🏋️ Добавление тренировки\n\n"
+    "Напишите в формате:\n"
+    "тип_тренировки упражнения минуты\n\n"
+    "Например:\n"
+    "кардио бег 30\n"
+    "силовые приседания жим_лежа 45\n\n"
+    "Типы: кардио, силовые, растяжка"
+)
+
+ADD_WEIGHT_TEXT = (
+    "⚖️ Добавление веса\n\n"
+    "Напишите ваш вес в килограммах\n"
+    "Например: 75.5"
+)
+
+VITAMINS_TEXT = (
+    "💊 Рекомендации по витаминам для похудения:\n\n"
+    "🔬 Основные витамины:\n"
+    "• Витамин D - для обмена веществ\n"
+    "• Витамин B12 - для энергии\n"
+    "• Омега-3 - для жиросжигания\n"
+    "• Магний - для мышц\n\n"
+    "💡 Рекомендуемые добавки:\n"
+    "• Рыбий жир (Омега-3)\n"
+    "• Витамин D3 (2000-4000 МЕ)\n"
+    "• Магний (200-400мг)\n"
+    "• Витамин B-комплекс\n\n"
+    "⚠️ Важно: перед приемом витаминов проконсультируйтесь с врачом!"
+)
+
+REMIND_USAGE_TEXT = (
+    "⏰ Напоминания\n\n"
+    "/remind water 90 8-22 - о воде каждые 90 минут с 8 до 22\n"
+    "/remind meal 240 - о еде каждые 4 часа\n"
+    "/remind off - выключить все (или off water, off meal)\n\n"
+    f"Часы указываются по времени {REMINDER_ZONE.key}\n"
+    "Напоминание о воде не приходит, если дневная цель уже выполнена"
+)
+
+REMINDER_TITLES = {'water': "💧 Вода", 'meal': "🍽 Еда"}
+
+MEAL_REMINDER_TEXT = "🍽 Пора поесть! Запишите прием пищи, например: обед курица 150 рис 100"
+
+IMPORT_TEXT = (
+    "📥 Загрузка дневника\n\n"
+    "Пришлите файл .csv или .jsonl - например, выгруженный через /export.\n"
+    "Колонки: type (meal, water, weight, workout), date (ГГГГ-ММ-ДД), created_at, "
+    "kind (прием пищи или тип тренировки), name (блюдо или упражнения через запятую), "
+    "amount (мл воды, кг веса, минуты тренировки), calories, protein, carbs, fat\n\n"
+    "Записи добавляются к дневнику. Чтобы заменить весь дневник содержимым файла, "
+    "отправьте файл с подписью replace"
+)
+
+DIARY_KIND_TITLES = {'meal': "🍽 продуктов", 'water': "💧 записей воды",
+                     'weight': "⚖️ взвешиваний", 'workout': "🏋️ тренировок"}
+
+UNKNOWN_TEXT = "Не понимаю команду. Используйте /help для списка команд или /menu для главного меню."
+
+def _tips_text():
+    """Советы по питанию из неизменяемых рекомендаций"""
+    recommended = get_food_recommendations()
+    suggestions = get_meal_suggestions()
+    return "\n".join([
+        "💡 Советы по питанию для похудения:",
+        "",
+        "✅ Рекомендуемые продукты:",
+        "🥩 Белки: " + ", ".join(recommended['recommended']['proteins'][:3]),
+        "🌾 Углеводы: " + ", ".join(recommended['recommended']['carbs']),
+        "🥬 Овощи: " + ", ".join(recommended['recommended']['vegetables'][:3]),
+        "🍎 Фрукты: " + ", ".join(recommended['recommended']['fruits'][:3]),
+        "",
+        "❌ Избегайте:",
+        ", ".join(recommended['avoid']),
+        "",
+        "🍽 Примеры приемов пищи:",
+        "🌅 Завтрак: " + suggestions['breakfast'][0],
+        "🌞 Обед: " + suggestions['lunch'][0],
+        "🌙 Ужин: " + suggestions['dinner'][0],
+        "🍎 Перекус: " + suggestions['snacks'][0],
+    ])
+
+TIPS_TEXT = _tips_text()
+
+# Динамические экраны: дешевые шаблоны поверх данных из базы
+
+_PROGRESS_BARS = ["█" * filled + "░" * (10 - filled) for filled in range(11)]
+
+def water_text(daily_water, water_goal):
+    """Трекер воды с полосой прогресса"""
+    progress = daily_water / water_goal * 100 if water_goal else 0
+    bar = _PROGRESS_BARS[min(int(progress / 10), 10)]
+    return (f"💧 Трекер воды\n\n"
+            f"Выпито сегодня: {daily_water}мл / {water_goal}мл\n"
+            f"Прогресс: {bar} {progress:.1f}%\n\n"
+            f"Выберите количество воды:")
+
+def daily_food_text(meals, totals):
+    """Дневник питания за день"""
+    lines = ["📋 Дневник питания за сегодня:\n"]
+    for meal in meals:
+        meal_type, food_name, calories, protein, carbs, fat = meal[2:8]
+        lines.append(f"🍽 {meal_type.title()}: {food_name}\n"
+                     f"   Калории: {calories}, Б: {protein}г, Ж: {fat}г, У: {carbs}г\n")
+    lines.append(f"📊 Итого за день:\n"
+                 f"Калории: {totals['calories']}\n"
+                 f"Белки: {totals['protein']:.1f}г\n"
+                 f"Жиры: {totals['fat']:.1f}г\n"
+                 f"Углеводы: {totals['carbs']:.1f}г")
+    return "\n".join(lines)
+
+def _nutrition(values):
+    return (f"Калории: {values['calories']}, Б: {values['protein']}г, "
+            f"Ж: {values['fat']}г, У: {values['carbs']}г")
+
+def meal_added_text(meal_type, meal):
+    """Подтверждение добавления приема пищи из calculate_meals_nutrition"""
+    items = meal['items']
+    if len(items) == 1:
+        item = items[0]
+        lines = [f"✅ Добавлен {meal_type}: {item['name']} ({item['grams']}г)", _nutrition(item)]
+    else:
+        lines = [f"✅ Добавлен {meal_type}:"]
+        lines += [f"• {item['name']} ({item['grams']}г): {_nutrition(item)}" for item in items]
+        lines += ["", f"Итого: {_nutrition(meal['totals'])}"]
+    if meal['missing']:
+        lines += ["", f"⚠️ Не найдены: {', '.join(meal['missing'])}"]
+    return "\n".join(lines)
+
+def progress_text(totals, weight_history):
+    """Прогресс за сегодня"""
+    lines = ["📊 Ваш прогресс за сегодня:\n",
+             f"🍽 Калории: {totals['calories']}",
+             f"💧 Вода: {totals['water_ml']}мл"]
+    if weight_history:
+        lines.append(f"⚖️ Текущий вес: {weight_history[0][0]}кг")
+    lines.append("\n💡 Используйте /menu для полного управления")
+    return "\n".join(lines)
+
+def workout_added_text(workout_type, exercises, duration, stats):
+    """Подтверждение тренировки с итогами недели из get_workout_stats"""
+    lines = [f"✅ Добавлена тренировка: {workout_type}, {duration} мин"]
+    if exercises:
+        lines.append("Упражнения: " + ", ".join(exercises))
+    workouts = sum(count for _, count, _ in stats['types'])
+    minutes = sum(total for _, _, total in stats['types'])
+    lines.append(f"\n📊 За 7 дней: тренировок {workouts}, {minutes} мин")
+    return "\n".join(lines)
+
+def workout_stats_text(stats):
+    """Тренировки за неделю: минуты по типам и частые упражнения"""
+    if not stats['types']:
+        return "📊 За последние 7 дней тренировок нет"
+    lines = [f"📊 Тренировки за 7 дней (дней с тренировками: {stats['active_days']}):\n"]
+    lines += [f"• {workout_type}: тренировок {count}, {minutes} мин"
+              for workout_type, count, minutes in stats['types']]
+    if stats['exercises']:
+        lines.append("\n🔁 Частые упражнения:")
+        lines += [f"• {exercise} ×{count}" for exercise, count in stats['exercises'][:5]]
+    return "\n".join(lines)
+
+def weight_history_text(history):
+    """История веса"""
+    if not history:
+        return "📈 История веса пуста"
+    return "📈 История веса за последние 7 дней:\n\n" + "\n".join(
+        f"{weight_date}: {weight}кг" for weight, weight_date in history)
+
+def _report_line(row, bucket_size):
+    bucket, days, calories, protein, carbs, fat, water_ml, workouts_min, weight, weight_avg = row
+    start = date.fromisoformat(str(bucket))
+    if bucket_size == 'day':
+        label = start.strftime('%d.%m')
+    else:
+        label = f"{start:%d.%m}–{start + timedelta(days=6):%d.%m}"
+    parts = []
+    if days:
+        average = "" if bucket_size == 'day' else "ср. "
+        parts.append(f"{average}{calories:.0f} ккал (Б {protein:.0f} Ж {fat:.0f} У {carbs:.0f})")
+        if water_ml:
+            parts.append(f"💧 {water_ml:.0f}мл")
+        if workouts_min:
+            parts.append(f"🏋️ {workouts_min} мин")
+    if weight is not None:
+        parts.append(f"⚖️ {weight:.1f}кг")
+    if weight_avg is not None:
+        parts.append(f"тренд {weight_avg:.1f}кг")
+    return f"📅 {label}: " + ", ".join(parts)
+
+def report_text(period, bucket_size, rows, page):
+    """Страница отчета за период из строк get_report"""
+    if not rows:
+        return f"📊 За {REPORT_TITLES[period]} нет записей"
+    header = f"📊 Отчет за {REPORT_TITLES[period]}"
+    if page:
+        header += f" (стр. {page + 1})"
+    return "\n".join([header + ":\n", *(_report_line(row, bucket_size) for row in rows)])
+
+def report_keyboard(period, page, has_more):
+    """Листание страниц и выбор периода отчета"""
+    pages = []
+    if page:
+        pages.append(InlineKeyboardButton("⬅️ Новее", callback_data=encode(REPORT_PREFIX, period, page - 1)))
+    if has_more:
+        pages.append(InlineKeyboardButton("Раньше ➡️", callback_data=encode(REPORT_PREFIX, period, page + 1)))
+    periods = [InlineKeyboardButton(("• " if name == period else "") + title.capitalize(),
+                                    callback_data=encode(REPORT_PREFIX, name, 0))
+               for name, title in REPORT_TITLES.items()]
+    return InlineKeyboardMarkup([row for row in (pages, periods) if row])
+
+def chart_caption(period, rows):
+    """Подпись к графику по строкам get_report (новые первыми)"""
+    lines = [f"📉 Вес и калории за {REPORT_TITLES[period]}"]
+    trend = [row[9] for row in rows if row[9] is not None]
+    if trend:
+        lines.append(f"⚖️ Тренд веса: {trend[-1]:.1f} → {trend[0]:.1f}кг")
+    days = sum(row[1] or 0 for row in rows)
+    if days:
+        calories = sum(row[2] * row[1] for row in rows if row[1]) / days
+        lines.append(f"🍽 В среднем {calories:.0f} ккал в день")
+    return "\n".join(lines)
+
+def _clock(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def reminders_text(reminders):
+    """Настроенные напоминания из get_reminders и подсказка по команде"""
+    if not reminders:
+        return "🔕 Напоминания не настроены\n\n" + REMIND_USAGE_TEXT
+    lines = ["⏰ Ваши напоминания:"]
+    for kind, interval_min, start_min, end_min, next_due in reminders:
+        lines.append(f"{REMINDER_TITLES.get(kind, kind)}: каждые {interval_min} мин, "
+                     f"{_clock(start_min)}-{_clock(end_min)}, "
+                     f"следующее в {datetime.fromtimestamp(next_due, REMINDER_ZONE):%H:%M}")
+    return "\n".join(lines) + "\n\n" + REMIND_USAGE_TEXT
+
+def reminder_set_text(kind, interval_min, start_min, end_min, next_due):
+    return (f"✅ {REMINDER_TITLES[kind]}: напоминание каждые {interval_min} мин "
+            f"с {_clock(start_min)} до {_clock(end_min)}\n"
+            f"Следующее: {datetime.fromtimestamp(next_due, REMINDER_ZONE):%d.%m %H:%M}")
+
+def import_done_text(counts, replace):
+    """Итог загрузки дневника: число записей по типам"""
+    lines = ["✅ Дневник заменен" if replace else "✅ Дневник загружен"]
+    lines += [f"{DIARY_KIND_TITLES[kind]}: {count}" for kind, count in counts.items()]
+    if not counts:
+        lines.append("В файле нет записей")
+    return "\n".join(lines)
+
+def water_reminder_text(water_ml, water_goal):
+    """Напоминание о воде с остатком до дневной цели"""
+    return (f"💧 Время выпить воды! Сегодня {water_ml}мл из {water_goal}мл, "
+            f"осталось {water_goal - water_ml}мл")
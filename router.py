@@ -0,0 +1,81 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Bot API на callback_data
+MAX_CALLBACK_DATA = 64
+# Разделитель параметров после префикса: water_200, report_week:2
+ARGUMENT_SEPARATOR = ':'
+
+def encode(prefix, *args):
+    """callback_data для префикса с параметрами с проверкой длины"""
+    data = prefix + ARGUMENT_SEPARATOR.join(map(str, args))
+    if len(data.encode('utf-8')) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {data!r}")
+    return data
+
+class CallbackRouter:
+    """Таблица обработчиков нажатий кнопок.
+
+    Точные ключи (main_menu) ищутся в словаре, параметризованные
+    (water_<мл>) - по префиксному дереву за один проход по callback_data,
+    побеждает самый длинный зарегистрированный префикс. Параметры
+    приводятся к объявленным типам; данные неверного формата не доходят
+    до обработчиков.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._trie = {}
+
+    def exact(self, key, handler):
+        """Обработчик handler(update, context) для точного значения"""
+        encode(key)
+        self._exact[key] = handler
+
+    def prefix(self, prefix, handler, *types):
+        """Обработчик handler(update, context, *args) для префикса с параметрами types"""
+        encode(prefix)
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = (handler, types)
+
+    def resolve(self, data):
+        """(обработчик, параметры) для callback_data или (None, None)"""
+        if not data or len(data.encode('utf-8')) > MAX_CALLBACK_DATA:
+            return None, None
+
+        handler = self._exact.get(data)
+        if handler is not None:
+            return handler, ()
+
+        node, found, end = self._trie, None, 0
+        for position, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                found, end = node[None], position + 1
+        if found is None:
+            return None, None
+
+        handler, types = found
+        rest = data[end:]
+        values = rest.split(ARGUMENT_SEPARATOR) if rest else []
+        if len(values) != len(types):
+            return None, None
+        try:
+            return handler, tuple(kind(value) for kind, value in zip(types, values))
+        except ValueError:
+            return None, None
+
+    async def dispatch(self, update, context):
+        """Обработчик CallbackQueryHandler: ответ на нажатие и вызов обработчика"""
+        query = update.callback_query
+        await query.answer()
+        handler, args = self.resolve(query.data)
+        if handler is None:
+            logger.warning("Неизвестная кнопка: %r", query.data)
+            return
+        await handler(update, context, *args)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from telegram import Update
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+from config import CONCURRENT_UPDATES, UPDATE_QUEUE_LIMIT
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед новым запросом getUpdates после ошибки сети, секунд
+POLL_RETRY_DELAY = 5
+
+def is_update(data):
+    """Похоже ли тело webhook на обновление Bot API: объект с числовым update_id"""
+    return isinstance(data, dict) and isinstance(data.get('update_id'), int)
+
+async def get_updates(bot, offset, limit=100):
+    """Обновления через getUpdates для режима polling.
+
+    Ошибка сети или RetryAfter не прерывают получение: после паузы
+    возвращается пустой список, и вызывающий просто запрашивает снова.
+    """
+    try:
+        return await bot.get_updates(offset=offset, limit=limit, timeout=30,
+                                     allowed_updates=Update.ALL_TYPES)
+    except RetryAfter as error:
+        retry_after = error.retry_after
+        if isinstance(retry_after, timedelta):
+            retry_after = retry_after.total_seconds()
+        await asyncio.sleep(retry_after)
+    except TelegramError as error:
+        logger.warning("Ошибка получения обновлений: %s", error)
+        await asyncio.sleep(POLL_RETRY_DELAY)
+    return []
+
+def update_key(update):
+    """Ключ упорядочивания: id пользователя, иначе id чата, иначе None"""
+    user = getattr(update, 'effective_user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    return None
+
+class UserOrderedProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+    Обновления разных пользователей выполняются одновременно, но не более
+    max_workers сразу; обновления одного пользователя - строго по очереди
+    в порядке поступления. Пока обновление ждет своей очереди у пользователя,
+    оно не занимает воркер, поэтому медленный пользователь задерживает
+    только себя.
+
+    Всего в обработке и ожидании держится не больше max_pending обновлений;
+    при переполнении admit() возвращает False и webhook просит Telegram
+    повторить доставку позже, а в режиме polling wait_room() приостанавливает
+    получение обновлений, пока очередь не разгрузится.
+    """
+
+    def __init__(self, max_workers=CONCURRENT_UPDATES, max_pending=UPDATE_QUEUE_LIMIT):
+        super().__init__(max_pending)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._workers = asyncio.Semaphore(max_workers)
+        # user_id -> [блокировка, сколько обновлений пользователя в очереди]
+        self._users = {}
+        # Установлено, пока в очереди есть место
+        self._room = asyncio.Event()
+        self._room.set()
+        self.pending = 0
+        self.active = 0
+        self.processed = 0
+        self.rejected = 0
+
+    def admit(self):
+        """Можно ли принять еще одно обновление"""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        return True
+
+    async def wait_room(self):
+        """Ожидание места в очереди; возвращает, сколько обновлений можно принять"""
+        await self._room.wait()
+        return max(1, self.max_pending - self.pending)
+
+    async def process_update(self, update, coroutine):
+        # Учет до семафора базового класса: admit() и wait_room() видят
+        # и обновления, которые ждут места в обработке
+        self.pending += 1
+        if self.pending >= self.max_pending:
+            self._room.clear()
+        try:
+            await super().process_update(update, coroutine)
+        finally:
+            self.pending -= 1
+            if self.pending < self.max_pending:
+                self._room.set()
+
+    async def do_process_update(self, update, coroutine):
+        key = update_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        # Блокировка берется в порядке поступления (asyncio.Lock - FIFO)
+        entry = self._users.get(key)
+        if entry is None:
+            entry = self._users[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._users[key]
+
+    async def _run(self, coroutine):
+        """Выполнение обработчика на одном из воркеров"""
+        async with self._workers:
+            self.active += 1
+            try:
+                await coroutine
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        """Состояние очереди обработки"""
+        return {
+            'pending': self.pending,
+            'active': self.active,
+            'users': len(self._users),
+            'processed': self.processed,
+            'rejected': self.rejected,
+        }
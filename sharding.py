@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Шардированный запуск: прием обновлений в одном процессе и обработка
+в SHARDS процессах-воркерах, у каждого своя база данных
+
+Запуск:
+    SHARDS=4 python sharding.py
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sqlite3
+import threading
+import urllib.request
+from contextlib import closing, contextmanager
+from http import HTTPStatus
+
+from telegram import Bot, Update
+
+from config import (BOT_TOKEN, DATABASE_PATH, SHARDS, RUN_MODE, WEBHOOK_URL, WEBHOOK_PATH,
+                    WEBHOOK_SECRET, PORT, UPDATE_QUEUE_LIMIT, SHARD_METRICS_PORT)
+from scheduler import get_updates, is_update
+from web_server import create_server
+
+logger = logging.getLogger(__name__)
+
+# Ожидание ответа воркера при сборе метрик фронтом, секунд
+METRICS_TIMEOUT = 2
+
+def jump_hash(key, buckets):
+    """Согласованное хэширование (jump consistent hash, Lamping & Veach).
+
+    При переходе от N к N+1 шардам переезжает только 1/(N+1) ключей,
+    остальные остаются на своих шардах.
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+def shard_for(user_id, shards=SHARDS):
+    """Номер шарда пользователя"""
+    return jump_hash(user_id, shards) if shards > 1 else 0
+
+def shard_path(shard, shards=SHARDS, base=DATABASE_PATH):
+    """Файл базы данных шарда: fitness_tracker.db -> fitness_tracker.2-of-4.db"""
+    if shards <= 1:
+        return base
+    root, extension = os.path.splitext(base)
+    return f"{root}.{shard}-of-{shards}{extension}"
+
+def metrics_port(shard):
+    """Порт HTTP-сервера метрик воркера шарда (только 127.0.0.1)"""
+    return SHARD_METRICS_PORT + shard
+
+def merge_prometheus(texts):
+    """Метрики воркеров одним ответом: метка shard у каждой серии.
+
+    texts - пары (шард, текст формата Prometheus). Серии одного семейства
+    собираются вместе под одним HELP и TYPE, как требует формат.
+    """
+    families = {}
+    for shard, text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# '):
+                _, kind, family, *_ = line.split(' ', 3)
+                headers, _ = families.setdefault(family, ({}, []))
+                headers.setdefault(kind, line)
+            elif line:
+                name, _, value = line.rpartition(' ')
+                if '{' in name:
+                    name = name.replace('{', f'{{shard="{shard}",', 1)
+                else:
+                    name += f'{{shard="{shard}"}}'
+                families.setdefault(family or name, ({}, []))[1].append(f'{name} {value}')
+    lines = []
+    for headers, samples in families.values():
+        lines += list(headers.values()) + samples
+    return "\n".join(lines) + "\n"
+
+def _get(url):
+    with urllib.request.urlopen(url, timeout=METRICS_TIMEOUT) as response:
+        return response.read().decode('utf-8')
+
+def update_user_id(data):
+    """Id пользователя (или чата) из обновления в виде словаря Bot API"""
+    for value in data.values():
+        if isinstance(value, dict):
+            for field in ('from', 'user', 'chat'):
+                owner = value.get(field)
+                if isinstance(owner, dict) and 'id' in owner:
+                    return owner['id']
+    return None
+
+@contextmanager
+def _environ(**values):
+    """Временная установка переменных окружения (наследуются дочерним процессом)"""
+    saved = {name: os.environ.get(name) for name in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+def run_worker(updates, port=None):
+    """Процесс шарда: обычный FitnessBot, получающий обновления из очереди"""
+    # Останавливается по сигналу от фронта (None в очереди), а не по Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    # База шарда задана через DATABASE_PATH в окружении процесса
+    from bot import FitnessBot
+    bot = FitnessBot(mode='shard')
+    asyncio.run(serve_worker(bot, updates, port))
+
+async def serve_worker(bot, updates, port=None):
+    """Передача обновлений из межпроцессной очереди в Application.
+
+    port - локальный HTTP-сервер с /metrics и /stats воркера, их собирает фронт.
+    """
+    application = bot.application
+    loop = asyncio.get_running_loop()
+    done = asyncio.Event()
+
+    def read():
+        while True:
+            # Пока очередь обработки полна, очередь шарда не разбирается: она
+            # заполняется, и фронт отвечает Telegram 503 (или ждет в polling)
+            asyncio.run_coroutine_threadsafe(bot.scheduler.wait_room(), loop).result()
+            data = updates.get()
+            if data is None:
+                loop.call_soon_threadsafe(done.set)
+                return
+            # Фронт проверяет только update_id: поток не должен падать на остальном
+            try:
+                update = Update.de_json(data, application.bot)
+            except (ValueError, TypeError, AttributeError, KeyError):
+                update = None
+            if not isinstance(update, Update):
+                logger.warning("Шард пропустил некорректное обновление %s", data.get('update_id'))
+                continue
+            loop.call_soon_threadsafe(application.update_queue.put_nowait, update)
+
+    server = None
+    if port is not None:
+        server = create_server(host='127.0.0.1', port=port)
+        server.route('GET', '/metrics', bot.metrics_endpoint)
+        server.route('GET', '/stats', bot.stats_endpoint)
+
+    async with application:
+        await bot.post_init(application)
+        await application.start()
+        if server is not None:
+            await server.start()
+        threading.Thread(target=read, name='shard-updates', daemon=True).start()
+        await done.wait()
+        if server is not None:
+            await server.stop()
+        await application.stop()
+    await bot.post_shutdown(application)
+
+class ShardFront:
+    """Прием обновлений и распределение по процессам шардов по user_id.
+
+    Каждый шард - отдельный процесс со своим файлом SQLite, поэтому
+    писатели разных шардов не конкурируют за блокировку базы. Обновления
+    передаются воркерам как словари Bot API; обработчики bot.py работают
+    в воркерах без изменений.
+    """
+
+    def __init__(self, shards=SHARDS, mode=RUN_MODE):
+        self.shards = shards
+        self.mode = mode
+        # spawn: воркер импортирует бот заново со своим DATABASE_PATH
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue(UPDATE_QUEUE_LIMIT) for _ in range(shards)]
+        self.workers = [None] * shards
+        self.rejected = 0
+
+    def _start_worker(self, shard):
+        # SHARDS - для доли общего лимита отправки напоминаний у воркера
+        with _environ(DATABASE_PATH=shard_path(shard, self.shards), SHARDS=str(self.shards)):
+            worker = self._context.Process(target=run_worker,
+                                           args=(self.queues[shard], metrics_port(shard)),
+                                           name=f'shard-{shard}')
+            worker.start()
+        self.workers[shard] = worker
+        logger.info("Шард %s запущен (pid %s)", shard, worker.pid)
+
+    def dispatch(self, data):
+        """Передача обновления шарду; False, если очередь шарда переполнена"""
+        user_id = update_user_id(data)
+        shard = shard_for(user_id, self.shards) if user_id is not None else 0
+        try:
+            self.queues[shard].put_nowait(data)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        return True
+
+    async def webhook(self, request):
+        """Прием обновления от Telegram"""
+        if WEBHOOK_SECRET and request.headers.get('x-telegram-bot-api-secret-token') != WEBHOOK_SECRET:
+            return HTTPStatus.FORBIDDEN, {"error": "forbidden"}
+        try:
+            data = request.json()
+        except ValueError:
+            data = None
+        if not is_update(data):
+            return HTTPStatus.BAD_REQUEST, {"error": "invalid update"}
+        if not self.dispatch(data):
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "overloaded"}
+        return HTTPStatus.OK, {}
+
+    async def poll(self, bot):
+        """Получение обновлений через getUpdates для режима polling"""
+        offset = None
+        while True:
+            for update in await get_updates(bot, offset):
+                while not self.dispatch(update.to_dict()):
+                    await asyncio.sleep(0.1)
+                offset = update.update_id + 1
+
+    async def _collect(self, path):
+        """Ответы воркеров на path: [(шард, текст)], недоступные пропускаются"""
+        async def fetch(shard):
+            try:
+                return shard, await asyncio.to_thread(
+                    _get, f'http://127.0.0.1:{metrics_port(shard)}{path}')
+            except OSError as error:
+                logger.warning("Метрики шарда %s недоступны: %s", shard, error)
+                return shard, None
+        results = await asyncio.gather(*(fetch(shard) for shard in range(self.shards)))
+        return [(shard, text) for shard, text in results if text is not None]
+
+    def _front_stats(self):
+        return {
+            'rejected': self.rejected,
+            'queued': sum(updates.qsize() for updates in self.queues),
+        }
+
+    async def metrics_endpoint(self, request):
+        """Метрики всех шардов с меткой shard и счетчики фронта"""
+        front = "".join(f"# TYPE fitness_front_{name} gauge\nfitness_front_{name} {value}\n"
+                        for name, value in self._front_stats().items())
+        return HTTPStatus.OK, merge_prometheus(await self._collect('/metrics')) + front
+
+    async def stats_endpoint(self, request):
+        """Сводка метрик в JSON по шардам"""
+        shards = {str(shard): json.loads(text) for shard, text in await self._collect('/stats')}
+        return HTTPStatus.OK, {'front': self._front_stats(), 'shards': shards}
+
+    async def watch(self):
+        """Перезапуск упавших воркеров"""
+        while True:
+            await asyncio.sleep(1)
+            for shard, worker in enumerate(self.workers):
+                if not worker.is_alive():
+                    logger.error("Шард %s завершился с кодом %s, перезапуск",
+                                 shard, worker.exitcode)
+                    self._start_worker(shard)
+
+    async def serve(self):
+        """Работа фронта до сигнала остановки"""
+        if self.mode == 'webhook' and not WEBHOOK_URL:
+            raise RuntimeError("Для режима webhook укажите WEBHOOK_URL")
+
+        for shard in range(self.shards):
+            self._start_worker(shard)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:
+                pass
+
+        server = create_server(port=PORT)
+        server.route('GET', '/metrics', self.metrics_endpoint)
+        server.route('GET', '/stats', self.stats_endpoint)
+        tasks = [asyncio.create_task(self.watch())]
+        async with Bot(BOT_TOKEN) as bot:
+            if self.mode == 'webhook':
+                server.route('POST', WEBHOOK_PATH, self.webhook)
+                await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                                      secret_token=WEBHOOK_SECRET,
+                                      allowed_updates=Update.ALL_TYPES)
+            else:
+                await bot.delete_webhook()
+                tasks.append(asyncio.create_task(self.poll(bot)))
+            await server.start()
+            print(f"🤖 Бот запущен: {self.shards} шардов")
+
+            try:
+                await stop.wait()
+            finally:
+                await server.stop()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Воркеры дорабатывают принятые обновления и закрывают базы
+        for updates in self.queues:
+            updates.put(None)
+        for worker in self.workers:
+            await loop.run_in_executor(None, worker.join)
+
+def _has_rows(path):
+    """Есть ли в базе path строки пользователей"""
+    if not os.path.exists(path):
+        return False
+    with closing(sqlite3.connect(path)) as connection:
+        tables = [row[0] for row in connection.execute('''
+            SELECT m.name FROM sqlite_master AS m
+            WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+              AND EXISTS (SELECT 1 FROM pragma_table_info(m.name) WHERE name = 'user_id')
+        ''')]
+        return any(connection.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone()
+                   for table in tables)
+
+def reshard(old_shards, new_shards, base=DATABASE_PATH, force=False):
+    """Перераспределение данных по новому числу шардов.
+
+    Новые файлы создаются рядом со старыми (в имени указано число шардов),
+    старые не изменяются. Бот на время переноса должен быть остановлен.
+    Новые файлы с данными (например, после прерванного запуска) не
+    дополняются: без force - ValueError, с force - файлы создаются заново.
+    Возвращает число пользователей в каждом новом шарде.
+    """
+    from database import Database
+
+    sources = [shard_path(shard, old_shards, base) for shard in range(old_shards)]
+    sources = [path for path in sources if os.path.exists(path)]
+    targets = [shard_path(shard, new_shards, base) for shard in range(new_shards)]
+    for path in targets:
+        if path in sources:
+            raise ValueError(f"Файл {path} совпадает с исходным шардом")
+    filled = [path for path in targets if _has_rows(path)]
+    if filled and not force:
+        raise ValueError(f"В новых шардах уже есть данные: {', '.join(filled)}")
+
+    for path in sources:
+        # Исходные базы приводятся к текущей версии схемы
+        Database(path, write_behind=False).close()
+
+    moved = []
+    for shard, path in enumerate(targets):
+        for leftover in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        Database(path, write_behind=False).close()
+
+        connection = sqlite3.connect(path)
+        connection.create_function('shard_for', 2, shard_for, deterministic=True)
+        users = 0
+        for source in sources:
+            connection.execute('ATTACH DATABASE ? AS source', (source,))
+            tables = [row[0] for row in connection.execute('''
+                SELECT m.name FROM source.sqlite_master AS m
+                WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%'
+                  AND EXISTS (SELECT 1 FROM pragma_table_info(m.name, 'source')
+                              WHERE name = 'user_id')
+            ''')]
+            with connection:
+                for table in tables:
+                    # Суррогатные id разных шардов пересекаются, новые назначает SQLite
+                    columns = ', '.join(row[1] for row in connection.execute(
+                        f'PRAGMA source.table_info({table})') if row[1] != 'id')
+                    cursor = connection.execute(
+                        f'INSERT INTO main.{table} ({columns}) SELECT {columns} '
+                        f'FROM source.{table} WHERE shard_for(user_id, ?) = ?',
+                        (new_shards, shard))
+                    if table == 'users':
+                        users += cursor.rowcount
+            connection.execute('DETACH DATABASE source')
+        connection.close()
+        moved.append(users)
+    return moved
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    asyncio.run(ShardFront().serve())
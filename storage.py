@@ -0,0 +1,204 @@
+import uuid
+from abc import ABC, abstractmethod
+
+from config import DATABASE_URL
+
+# Переносимые между хранилищами таблицы и их колонки (без суррогатных id)
+TABLES = {
+    'users': ('user_id', 'username', 'first_name', 'calories_goal', 'water_goal',
+              'protein_goal', 'carbs_goal', 'fat_goal', 'created_at'),
+    'meals': ('user_id', 'meal_type', 'food_name', 'calories', 'protein', 'carbs', 'fat',
+              'meal_date', 'created_at'),
+    'water': ('user_id', 'amount', 'drink_date', 'created_at'),
+    'workouts': ('user_id', 'workout_type', 'exercises', 'duration', 'workout_date', 'created_at',
+                 'workout_key'),
+    'workout_exercises': ('user_id', 'workout_date', 'workout_type', 'exercise', 'created_at',
+                          'workout_key'),
+    'weight': ('user_id', 'weight', 'weight_date', 'created_at'),
+    'reminders': ('user_id', 'kind', 'interval_min', 'start_min', 'end_min', 'next_due'),
+}
+
+# Запись дневника для экспорта и импорта: тип (meal, water, weight, workout),
+# дата, время записи (UTC), вид (прием пищи, тип тренировки), название (блюдо,
+# упражнения через запятую), количество (мл воды, кг веса, минуты тренировки), КБЖУ
+DIARY_FIELDS = ('type', 'date', 'created_at', 'kind', 'name', 'amount',
+                'calories', 'protein', 'carbs', 'fat')
+# Таблицы дневника пользователя
+DIARY_TABLES = ('meals', 'water', 'weight', 'workouts', 'workout_exercises')
+
+# Отчеты: период -> (дней, размер корзины)
+REPORT_PERIODS = {
+    'week': (7, 'day'),
+    'month': (30, 'day'),
+    'year': (365, 'week'),
+}
+
+# Окно скользящего среднего веса в днях для размера корзины
+REPORT_WEIGHT_WINDOW = {'day': 7, 'week': 28}
+
+class Storage(ABC):
+    """Хранилище данных, от которого зависит бот.
+
+    Все методы - корутины. Строки возвращаются в том же порядке колонок,
+    что и в таблицах SQLite: пользователь - кортеж users, прием пищи -
+    кортеж meals, история веса - пары (вес, дата).
+    """
+
+    async def connect(self):
+        """Подготовка соединений перед обработкой обновлений"""
+
+    @abstractmethod
+    async def close(self):
+        """Завершение работы и закрытие соединений"""
+
+    @abstractmethod
+    async def add_user(self, user_id, username, first_name):
+        """Добавление пользователя (повторное добавление ничего не меняет)"""
+
+    @abstractmethod
+    async def get_user(self, user_id):
+        """Данные пользователя или None"""
+
+    async def add_meal(self, user_id, meal_type, food_name, calories, protein, carbs, fat):
+        """Добавление приема пищи"""
+        await self.add_meals(user_id, meal_type, [(food_name, calories, protein, carbs, fat)])
+
+    @abstractmethod
+    async def add_meals(self, user_id, meal_type, meals):
+        """Добавление нескольких продуктов одного приема пищи"""
+
+    @abstractmethod
+    async def get_daily_meals(self, user_id, meal_date=None):
+        """Приемы пищи за день"""
+
+    @abstractmethod
+    async def add_water(self, user_id, amount):
+        """Добавление выпитой воды"""
+
+    @abstractmethod
+    async def get_daily_water(self, user_id, drink_date=None):
+        """Выпито воды за день, мл"""
+
+    @abstractmethod
+    async def get_daily_totals(self, user_id, day=None):
+        """Итоги за день: calories, protein, carbs, fat, water_ml, workouts_min"""
+
+    async def rebuild_daily_totals(self, user_id=None):
+        """Пересчет материализованных итогов, если хранилище их ведет"""
+
+    @abstractmethod
+    async def add_workout(self, user_id, workout_type, exercises, duration):
+        """Добавление тренировки со списком упражнений"""
+
+    @abstractmethod
+    async def get_workout_stats(self, user_id, days=7):
+        """Тренировки за days дней: types [(тип, тренировок, минут)],
+        exercises [(упражнение, раз)], active_days"""
+
+    @abstractmethod
+    async def add_weight(self, user_id, weight):
+        """Добавление веса"""
+
+    @abstractmethod
+    async def get_weight_history(self, user_id, days=7):
+        """Последние записи веса: [(вес, дата)]"""
+
+    @abstractmethod
+    async def get_report(self, user_id, period, page=0, page_size=10):
+        """Страница отчета за период (новые корзины первыми) и признак следующей страницы.
+
+        Строка: (корзина, дней с записями, калории, белки, углеводы, жиры, вода,
+        минуты тренировок, вес, скользящее среднее веса); питание и вода -
+        средние за день, тренировки - сумма.
+        """
+
+    @abstractmethod
+    async def set_reminder(self, user_id, kind, interval_min, start_min, end_min, next_due):
+        """Создание или замена напоминания вида kind (water, meal)"""
+
+    @abstractmethod
+    async def delete_reminders(self, user_id, kind=None):
+        """Удаление напоминаний пользователя (всех или одного вида)"""
+
+    @abstractmethod
+    async def get_reminders(self, user_id):
+        """Напоминания пользователя: [(kind, interval_min, start_min, end_min, next_due)]"""
+
+    @abstractmethod
+    async def get_due_reminders(self, until, limit=1000):
+        """Напоминания со сроком не позже until (unix time), ближайшие первыми:
+        [(user_id, kind, interval_min, start_min, end_min, next_due)]"""
+
+    @abstractmethod
+    async def reschedule_reminders(self, rows):
+        """Новые сроки напоминаний пачкой: [(next_due, user_id, kind, прежний next_due)].
+
+        Строка, срок которой изменился с момента выборки, не обновляется.
+        """
+
+    @abstractmethod
+    async def get_water_progress(self, user_ids, day=None):
+        """Вода за день и цель для нескольких пользователей: {user_id: (water_ml, water_goal)}"""
+
+    @abstractmethod
+    async def import_rows(self, table, rows):
+        """Массовая загрузка строк с колонками TABLES[table]"""
+
+    @abstractmethod
+    def iter_diary(self, user_id, batch=1000):
+        """Дневник пользователя: асинхронный генератор пачек записей DIARY_FIELDS"""
+
+    @abstractmethod
+    async def import_diary(self, user_id, records, replace=False, batch=5000):
+        """Загрузка записей DIARY_FIELDS из итератора одной транзакцией.
+
+        replace - удалить прежний дневник пользователя в той же транзакции.
+        Возвращает число загруженных записей по типам.
+        """
+
+    def cache_stats(self):
+        """Счетчики кэша чтений, если он есть"""
+        return {}
+
+def workout_key():
+    """Ключ новой тренировки, по которому к ней привязаны упражнения"""
+    return uuid.uuid4().hex
+
+def diary_rows(user_id, records, counts, batch=5000):
+    """Записи дневника -> пачки строк {таблица: [строки с колонками TABLES[таблица]]}
+
+    Итератор записей читается по мере загрузки; counts (Counter) считает записи по типам.
+    """
+    rows = {table: [] for table in DIARY_TABLES}
+    size = 0
+    for kind, day, created_at, name_kind, name, amount, calories, protein, carbs, fat in records:
+        if kind == 'meal':
+            rows['meals'].append((user_id, name_kind, name, calories, protein, carbs, fat,
+                                  day, created_at))
+        elif kind == 'water':
+            rows['water'].append((user_id, amount, day, created_at))
+        elif kind == 'weight':
+            rows['weight'].append((user_id, amount, day, created_at))
+        else:
+            key = workout_key()
+            rows['workouts'].append((user_id, name_kind, None, amount, day, created_at, key))
+            exercises = [exercise.strip() for exercise in (name or '').split(',')]
+            rows['workout_exercises'] += [(user_id, day, name_kind, exercise, created_at, key)
+                                          for exercise in exercises if exercise]
+        counts[kind] += 1
+        size += 1
+        if size >= batch:
+            yield rows
+            rows = {table: [] for table in DIARY_TABLES}
+            size = 0
+    if size:
+        yield rows
+
+def create_storage(url=DATABASE_URL):
+    """Хранилище по адресу: postgres://... - PostgreSQL, иначе локальный SQLite"""
+    if url and url.startswith(('postgres://', 'postgresql://')):
+        from postgres_storage import PostgresStorage
+        return PostgresStorage(url)
+
+    from database import AsyncDatabase, Database
+    return AsyncDatabase(Database())
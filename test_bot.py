@@ -3,8 +3,10 @@
 Тестовый скрипт для проверки работы бота
 """
 
+from cache import UserCache
 from database import Database
-from food_database import get_food_info, calculate_meal_nutrition, get_food_recommendations
+from food_database import (get_food_info, calculate_meal_nutrition, get_food_recommendations,
+                           search_foods, calculate_meals_nutrition)
 
 def test_database():
     """Тестирование базы данных"""
@@ -46,6 +48,995 @@ def test_database():
     
     print("🎉 Все тесты базы данных пройдены!")
 
+def test_connection_pool():
+    """Тестирование пула соединений при параллельной работе"""
+    print("\n🔌 Тестирование пула соединений...")
+    
+    import os
+    import tempfile
+    import threading
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'pool.db'))
+        
+        def worker(user_id):
+            for _ in range(20):
+                db.add_water(user_id, 100)
+                db.get_daily_water(user_id)
+        
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert all(db.get_daily_water(i) == 2000 for i in range(8))
+        db.close()
+    print("✅ Параллельная запись и чтение через пул")
+
+def test_async_database():
+    """Тестирование асинхронного фасада базы данных"""
+    print("\n⚡ Тестирование асинхронной базы данных...")
+    
+    import asyncio
+    import os
+    import tempfile
+    from database import AsyncDatabase
+    
+    async def scenario(db):
+        await asyncio.gather(*(db.add_water(1, 250) for _ in range(8)))
+        return await db.get_daily_water(1)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(Database(os.path.join(tmp, 'async.db')))
+        total = asyncio.run(scenario(db))
+        asyncio.run(db.close())
+    assert total == 2000
+    print(f"✅ Выпито воды (async): {total}мл")
+
+def test_diary_export_concurrency():
+    """Незавершенные выгрузки дневника не блокируют чтения обработчиков"""
+    print("\n💾 Тестирование параллельных выгрузок...")
+    
+    import asyncio
+    import os
+    import tempfile
+    from config import DB_READERS
+    from database import AsyncDatabase
+    
+    async def scenario(db):
+        await db.import_rows('weight', [(1, 70 + day / 10, f'2024-03-{day:02}', None)
+                                        for day in range(1, 11)])
+        # Выгрузок больше, чем читателей и потоков пула базы; каждая остановлена после первой пачки
+        exports = [db.iter_diary(1, batch=1) for _ in range(DB_READERS + 2)]
+        for export in exports:
+            assert len(await export.__anext__()) == 1
+        histories = await asyncio.wait_for(
+            asyncio.gather(*(db.get_weight_history(1, 3) for _ in range(DB_READERS + 1))), 5)
+        counts = []
+        for export in exports:
+            counts.append(1 + sum([len(rows) async for rows in export]))
+        return histories, counts
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(Database(os.path.join(tmp, 'exports.db')))
+        histories, counts = asyncio.run(scenario(db))
+        asyncio.run(db.close())
+    assert all(len(history) == 3 for history in histories)
+    assert counts == [10] * len(counts)
+    print(f"✅ {len(counts)} выгрузок и {len(histories)} чтений одновременно")
+
+def test_daily_totals():
+    """Тестирование итогов за день"""
+    print("\n📊 Тестирование итогов за день...")
+    
+    import os
+    import tempfile
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'totals.db'))
+        db.add_meal(1, "завтрак", "овсянка", 389, 17, 66, 6.9)
+        db.add_meal(1, "обед", "гречка", 343, 13, 72, 3.4)
+        db.add_water(1, 300)
+        db.add_workout(1, "кардио", ["бег"], 30)
+        
+        totals = db.get_daily_totals(1)
+        assert totals['calories'] == 732 and totals['water_ml'] == 300
+        assert totals['workouts_min'] == 30
+        
+        db.rebuild_daily_totals()
+        assert db.get_daily_totals(1) == totals
+        db.close()
+    print(f"✅ Итоги за день: {totals}")
+
+def test_workouts():
+    """Тестирование тренировок и недельной статистики"""
+    print("\n🏋️ Тестирование тренировок...")
+    
+    import os
+    import sqlite3
+    import tempfile
+    from datetime import date, timedelta
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'workouts.db')
+        db = Database(path)
+        db.close()
+        
+        # База версии 3 с упражнениями в JSON переносится миграцией
+        connection = sqlite3.connect(path)
+        connection.execute('DROP TABLE workout_exercises')
+        connection.execute('''
+            INSERT INTO workouts (user_id, workout_type, exercises, duration, workout_date)
+            VALUES (1, 'силовые', '["приседания", "жим лежа"]', 40, date('now', 'localtime'))
+        ''')
+        connection.execute('PRAGMA user_version=3')
+        connection.commit()
+        connection.close()
+        
+        db = Database(path)
+        db.add_workout(1, "кардио", ["бег"], 30)
+        db.add_workout(1, "кардио", ["бег", "ходьба"], 20)
+        stats = db.get_workout_stats(1)
+        assert stats['types'] == [("кардио", 2, 50), ("силовые", 1, 40)]
+        assert stats['exercises'][0] == ("бег", 2) and len(stats['exercises']) == 4
+        assert stats['active_days'] == 1
+        assert db.get_workout_stats(2) == {'types': [], 'exercises': [], 'active_days': 0}
+        
+        # После полуночи недельное окно сдвигается, кэш прошлого дня не используется
+        import database
+        
+        class NextWeek(date):
+            @classmethod
+            def today(cls):
+                return date.today() + timedelta(days=7)
+        
+        database.date = NextWeek
+        try:
+            assert db.get_workout_stats(1)['active_days'] == 0
+        finally:
+            database.date = date
+        
+        with db._read() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM workouts WHERE exercises IS NOT NULL')
+            assert cursor.fetchone()[0] == 0
+            cursor.execute('SELECT COUNT(*) FROM workout_exercises WHERE workout_key IS NULL')
+            assert cursor.fetchone()[0] == 0
+        
+        # Тренировки, записанные в одну секунду, не делят упражнения
+        with db._write() as cursor:
+            cursor.execute("UPDATE workouts SET created_at = '2024-03-01 10:00:00'")
+            cursor.execute("UPDATE workout_exercises SET created_at = '2024-03-01 10:00:00'")
+        exercises = sorted(record[4] for rows in db.iter_diary(1) for record in rows)
+        assert exercises == ['бег', 'бег, ходьба', 'приседания, жим лежа']
+        db.close()
+    print(f"✅ Тренировки за неделю: {stats['types']}")
+
+def test_diary_io():
+    """Тестирование выгрузки и загрузки дневника"""
+    print("\n💾 Тестирование выгрузки и загрузки дневника...")
+    
+    import asyncio
+    import json
+    import os
+    import tempfile
+    from database import AsyncDatabase
+    from diary_io import DiaryWriter, format_of, read_records
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.jsonl')
+        with open(source, 'w', encoding='utf-8') as file:
+            file.write('{"type": "meal", "date": "2024-03-01", "kind": "обед", "name": "гречка", '
+                       '"calories": 343, "protein": 12.6, "carbs": 68, "fat": 3.3}\n\n')
+            file.write('{"type": "water", "date": "2024-03-01", "amount": 250}\n')
+            file.write('{"type": "weight", "date": "2024-03-02", "amount": 75.4}\n')
+            for exercises in ('"присед"', '"жим"'):
+                file.write('{"type": "workout", "date": "2024-03-03", "created_at": '
+                           '"2024-03-03 09:00:00", "kind": "силовые", "name": %s, "amount": 20}\n'
+                           % exercises)
+            for _ in range(2):
+                file.write('{"type": "workout", "date": "2024-03-02", "kind": "кардио", '
+                           '"name": ["бег", "ходьба"], "amount": 30}\n')
+        
+        db = Database(os.path.join(tmp, 'diary.db'))
+        db.add_user(1, None, None)
+        db.add_water(1, 500)
+        counts = db.import_diary(1, read_records(source))
+        assert counts == {'meal': 1, 'water': 1, 'weight': 1, 'workout': 4}
+        assert db.get_daily_totals(1, '2024-03-01')['water_ml'] == 250
+        with db._read() as cursor:
+            # Тренировки не делят упражнения, даже записанные в одну секунду
+            cursor.execute('SELECT COUNT(DISTINCT workout_key), COUNT(*) FROM workout_exercises')
+            assert cursor.fetchone() == (4, 6)
+        
+        # Выгрузка пачками через асинхронный фасад и обратная загрузка с заменой
+        async def export(path):
+            storage = AsyncDatabase(db)
+            with open(path, 'w', newline='', encoding='utf-8') as file:
+                writer = DiaryWriter(file, format_of(path))
+                async for records in storage.iter_diary(1, batch=2):
+                    writer.write(records)
+            return writer.count
+        
+        exported = os.path.join(tmp, 'diary.csv')
+        assert asyncio.run(export(exported)) == 8
+        records = list(read_records(exported))
+        assert sorted(record[0] for record in records) == ['meal', 'water', 'water', 'weight',
+                                                           'workout', 'workout', 'workout',
+                                                           'workout']
+        assert sorted(record[4] for record in records if record[3] == 'силовые') == ['жим', 'присед']
+        assert ('workout', '2024-03-02', '2024-03-02 12:00:01', 'кардио', 'бег, ходьба', 30,
+                None, None, None, None) in records
+        db.import_diary(1, iter(records), replace=True)
+        assert sorted(record for rows in db.iter_diary(1) for record in rows) == sorted(records)
+        with db._read() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM workout_exercises')
+            assert cursor.fetchone()[0] == 6
+        
+        # Ошибка в середине файла - ничего не загружено
+        broken = os.path.join(tmp, 'broken.csv')
+        with open(broken, 'w', encoding='utf-8') as file:
+            file.write('type,date,amount\nwater,2024-03-03,300\nwater,2024-03-03,-1\n')
+        try:
+            db.import_diary(1, read_records(broken))
+            assert False, "ожидалась ошибка"
+        except ValueError as error:
+            assert str(error).startswith('строка 3:')
+        assert sum(len(rows) for rows in db.iter_diary(1)) == 8
+        
+        exported_json = os.path.join(tmp, 'diary.jsonl')
+        with open(exported_json, 'w', encoding='utf-8') as file:
+            writer = DiaryWriter(file, 'jsonl')
+            for rows in db.iter_diary(1):
+                writer.write(rows)
+        with open(exported_json, encoding='utf-8') as file:
+            assert 'amount' not in json.loads(file.readline())
+        db.close()
+    print(f"✅ Дневник: загружено {sum(counts.values())}, выгружено и загружено обратно {len(records)}")
+
+def test_report():
+    """Тестирование отчетов за период"""
+    print("\n📈 Тестирование отчетов...")
+    
+    import os
+    import tempfile
+    from datetime import date, timedelta
+    import render
+    
+    today = date.today()
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'report.db'))
+        # Два года истории: прием пищи каждый день, вес через день
+        db.import_rows('meals', [(1, "обед", "гречка", 1000 + i, 10, 20, 5, today - timedelta(days=i), None)
+                                 for i in range(730)])
+        db.import_rows('weight', [(1, 80 - i / 10, today - timedelta(days=i), None)
+                                  for i in range(0, 730, 2)])
+        db.add_water(1, 500)
+        
+        rows, has_more = db.get_report(1, 'week')
+        assert len(rows) == 7 and not has_more
+        bucket, days, calories, _, _, _, water_ml, _, weight, weight_avg = rows[0]
+        assert bucket == str(today) and (days, calories, water_ml, weight) == (1, 1000, 500, 80)
+        # Скользящее среднее за 7 дней: сегодня, 2, 4 и 6 дней назад
+        assert abs(weight_avg - (80 + 79.8 + 79.6 + 79.4) / 4) < 1e-9
+        # Вчера веса нет, тренд - по 2, 4 и 6 дням назад
+        assert rows[1][8] is None and abs(rows[1][9] - (79.8 + 79.6 + 79.4) / 3) < 1e-9
+        
+        # Год по неделям листается страницами
+        pages, page = [], 0
+        while True:
+            rows, has_more = db.get_report(1, 'year', page, render.REPORT_PAGE_SIZE)
+            pages.append(rows)
+            if not has_more:
+                break
+            page += 1
+        buckets = [row[0] for rows in pages for row in rows]
+        assert len(pages) == 6 and buckets == sorted(set(buckets), reverse=True)
+        assert sum(row[1] for rows in pages for row in rows) >= 365
+        assert "тренд" in render.report_text('year', 'week', pages[0], 0)
+        assert db.get_report(2, 'month') == ([], False)
+        db.close()
+    print(f"✅ Недель в отчете за год: {len(buckets)}")
+
+def test_chart():
+    """Тестирование графиков и их кэша"""
+    print("\n📉 Тестирование графиков...")
+    
+    import asyncio
+    from chart import ChartRenderer, render_chart
+    
+    rows = [("2024-05-20", 1, 1800.0, 120.0, 150.0, 60.0, 2000.0, 30, 75.2, 75.4),
+            ("2024-05-19", None, None, None, None, None, None, None, 75.6, 75.6),
+            ("2024-05-18", 1, 2100.0, 100.0, 200.0, 70.0, 1500.0, 0, None, None)]
+    png = render_chart(rows[::-1])
+    assert png.startswith(b'\x89PNG\r\n\x1a\n') and png.endswith(b'IEND\xaeB`\x82')
+    
+    async def scenario():
+        charts = ChartRenderer(workers=1)
+        try:
+            digest, image = await charts.render(1, 'week', rows)
+            assert image == png
+            # Повтор без новых данных - из кэша, после отправки - по file_id
+            assert await charts.render(1, 'week', rows) == (digest, png)
+            charts.remember(1, 'week', digest, "file-1")
+            assert await charts.render(1, 'week', rows) == (digest, "file-1")
+            assert charts.rendered == 1
+            # Новые данные - новая версия и новая отрисовка
+            changed = [("2024-05-21", 1, 1500.0, 90.0, 120.0, 50.0, 0.0, 0, 75.0, 75.3)] + rows
+            assert (await charts.render(1, 'week', changed))[0] != digest
+            assert charts.rendered == 2
+        finally:
+            charts.close()
+    
+    asyncio.run(scenario())
+    print(f"✅ График: {len(png)} байт PNG, повторные запросы из кэша")
+
+def test_reminders():
+    """Тестирование планировщика напоминаний"""
+    print("\n⏰ Тестирование напоминаний...")
+    
+    import asyncio
+    import os
+    import tempfile
+    from datetime import datetime
+    from telegram.error import Forbidden
+    from database import AsyncDatabase
+    from reminders import REMINDER_ZONE, ReminderScheduler, next_due
+    
+    noon = datetime.now(REMINDER_ZONE).replace(hour=12, minute=0, second=0, microsecond=0)
+    now = int(noon.timestamp())
+    # Активные часы 9-21: в пределах дня - через интервал, иначе - завтра в 9:00
+    assert next_due(now, 90, 9 * 60, 21 * 60) == now + 90 * 60
+    tomorrow = datetime.fromtimestamp(next_due(now, 600, 9 * 60, 21 * 60), REMINDER_ZONE)
+    assert (tomorrow.date() - noon.date()).days == 1 and (tomorrow.hour, tomorrow.minute) == (9, 0)
+    early = int(noon.replace(hour=6).timestamp())
+    assert datetime.fromtimestamp(next_due(early, 60, 9 * 60, 21 * 60), REMINDER_ZONE).hour == 9
+    
+    sent = []
+    
+    async def send(user_id, kind, progress):
+        if user_id == 3:
+            raise Forbidden("bot was blocked by the user")
+        sent.append((user_id, kind, progress))
+    
+    async def scenario(db):
+        for user_id in (1, 2, 3, 4):
+            await db.add_user(user_id, None, None)
+        await db.add_water(1, 2000)
+        await db.add_water(2, 300)
+        hours = (9 * 60, 21 * 60)
+        await db.set_reminder(1, 'water', 60, *hours, now - 60)       # цель выполнена
+        await db.set_reminder(2, 'water', 60, *hours, now - 60)       # отправка
+        await db.set_reminder(3, 'meal', 240, *hours, now - 60)       # бот заблокирован
+        await db.set_reminder(4, 'water', 60, *hours, now - 7200)     # пропущено при простое
+        await db.set_reminder(5, 'meal', 240, *hours, now + 86400)    # вне окна загрузки
+        
+        scheduler = ReminderScheduler(db, send, clock=lambda: now)
+        scheduler.start()
+        await asyncio.sleep(0.3)
+        stats = scheduler.stats()
+        # Срок переносится от прежнего (ритм сохраняется), пропущенный - от текущего времени;
+        # перенесенные за пределы окна сроки не держатся в памяти
+        due = await db.get_due_reminders(now + 3600 * 2)
+        await scheduler.stop()
+        
+        # Изменившийся срок не перезаписывается устаревшим переносом
+        await scheduler.schedule(2, 'water', 30, *hours)
+        await db.reschedule_reminders([(now + 999, 2, 'water', now - 60)])
+        reminder = await db.get_reminders(2)
+        
+        # Неизвестный вид не сохраняется: иначе ломается список напоминаний
+        try:
+            await scheduler.schedule(4, 'foo', 60, *hours)
+            assert False, "ожидалась ошибка"
+        except ValueError:
+            pass
+        assert [row[0] for row in await db.get_reminders(4)] == ['water']
+        return stats, due, reminder, await db.get_reminders(3)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(Database(os.path.join(tmp, 'reminders.db')))
+        stats, due, reminder, blocked = asyncio.run(scenario(db))
+        asyncio.run(db.close())
+    
+    assert sent == [(2, 'water', (300, 2000))]
+    assert stats == {'queued': 0, 'sent': 1, 'skipped': 1, 'missed': 1, 'failed': 0}
+    assert sorted((row[0], row[5]) for row in due) == [(1, now + 3540), (2, now + 3540), (4, now + 3600)]
+    assert reminder == [('water', 30, 540, 1260, now + 1800)]
+    assert blocked == []
+    # Строки неизвестного вида из прежних версий показываются, а не роняют /remind
+    import render
+    assert 'foo: каждые 60 мин' in render.reminders_text([('foo', 60, 540, 1260, now)])
+    print(f"✅ Напоминания: {stats}")
+
+def test_write_behind():
+    """Тестирование отложенной записи"""
+    print("\n📝 Тестирование отложенной записи...")
+    
+    import os
+    import tempfile
+    from datetime import date
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'write_behind.db')
+        db = Database(path, write_behind=True)
+        for _ in range(5):
+            db.add_water(1, 200)
+        db.add_meal(1, "обед", "гречка", 343, 13, 72, 3.4)
+        
+        # Свои записи видны сразу, даже до сброса на диск
+        assert db.get_daily_water(1) == 1000
+        assert len(db.get_daily_meals(1)) == 1
+        assert db.get_daily_totals(1)['calories'] == 343
+        
+        # Число, которое SQLite не сохранит, отклоняется сразу, а не в очереди
+        try:
+            db.add_meal(1, "обед", "курица", 10 ** 23, 0, 0, 0)
+            assert False, "ожидалась ошибка"
+        except ValueError:
+            pass
+        # Если плохая строка все же попала в пачку, отбрасывается только она
+        db.flush()
+        db._enqueue('water', [(2, 10 ** 23, date.today(), None), (2, 300, date.today(), None)])
+        assert db.flush() == 1
+        assert db.get_daily_water(2) == 300
+        db.close()
+        
+        db = Database(path)
+        assert db.get_daily_water(1) == 1000
+        assert db.get_daily_water(2) == 300
+        assert len(db.get_daily_meals(1)) == 1
+        db.close()
+    print("✅ Записи сохранены при закрытии")
+
+def test_backup():
+    """Тестирование онлайн-копирования и восстановления базы"""
+    print("\n💾 Тестирование резервных копий...")
+    
+    import asyncio
+    import os
+    import sqlite3
+    import tempfile
+    import threading
+    from datetime import datetime
+    from backup import BackupScheduler, backup_name, list_backups, restore, snapshot
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'live.db')
+        backups = os.path.join(tmp, 'backups')
+        db = Database(path, write_behind=False)
+        db.import_rows('water', [(user_id, 250, '2024-03-01', None) for user_id in range(5000)])
+        
+        # Прежние копии: после новой остается keep последних
+        os.makedirs(backups)
+        for day in (1, 2):
+            with open(os.path.join(backups, backup_name(path, datetime(2024, 3, day))), 'wb'):
+                pass
+        
+        # Запись во время копирования по одной странице не перезапускает копирование
+        stop = threading.Event()
+        
+        def writer():
+            while not stop.is_set():
+                db.add_water(1, 100)
+        
+        thread = threading.Thread(target=writer)
+        thread.start()
+        try:
+            target, size, steps = snapshot(path, backups, keep=2, pages=1, pause=0.001)
+        finally:
+            stop.set()
+            thread.join()
+        assert list_backups(path, backups) == [os.path.join(backups, backup_name(path, datetime(2024, 3, 2))),
+                                               target]
+        
+        db.add_water(2, 500)
+        db.close()
+        restore(target, path)
+        connection = sqlite3.connect(path)
+        pages = connection.execute('PRAGMA page_count').fetchone()[0]
+        assert steps == pages, (steps, pages)
+        assert connection.execute('SELECT COUNT(*) FROM water WHERE user_id = 2').fetchone()[0] == 1
+        connection.close()
+        
+        db = Database(path)
+        assert db.get_daily_water(2) == 0
+        
+        async def scheduled():
+            backups_task = BackupScheduler(path, interval=0, directory=backups, keep=0)
+            backups_task.start()
+            assert backups_task._task is None
+            await backups_task.backup_now()
+            return backups_task.stats()
+        
+        stats = asyncio.run(scheduled())
+        assert stats['count'] == 1 and stats['failed'] == 0 and stats['age_seconds'] >= 0
+        db.close()
+    print(f"✅ Копия {size} байт за {steps} шагов без перезапусков, восстановление")
+
+def test_metrics():
+    """Тестирование метрик обработчиков и базы"""
+    print("\n📟 Тестирование метрик...")
+    
+    import asyncio
+    import os
+    import tempfile
+    from http import HTTPStatus
+    from database import AsyncDatabase
+    from metrics import Metrics
+    from web_server import create_server
+    
+    metrics = Metrics(enabled=True)
+    
+    async def scenario(db):
+        metrics.instrument_storage(db)
+        metrics.collect('cache', db.database.cache.stats)
+        
+        async def handler(user_id):
+            await db.add_water(user_id, 250)
+            return await db.get_weight_history(user_id, 7)
+        
+        async def failing():
+            raise ValueError("ошибка обработчика")
+        
+        tracked, broken = metrics.track(handler), metrics.track(failing)
+        await db.add_weight(1, 75.5)
+        for _ in range(3):
+            assert len(await tracked(1)) == 1
+        try:
+            await broken()
+        except ValueError:
+            pass
+        
+        async def endpoint(request):
+            return HTTPStatus.OK, metrics.prometheus()
+        
+        server = create_server('127.0.0.1', 0)
+        server.route('GET', '/metrics', endpoint)
+        await server.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nConnection: close\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        await server.stop()
+        return response.decode()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AsyncDatabase(Database(os.path.join(tmp, 'metrics.db')))
+        response = asyncio.run(scenario(db))
+        asyncio.run(db.close())
+    
+    assert "Content-Type: text/plain; version=0.0.4" in response
+    assert 'fitness_handler_seconds_count{handler="handler"} 3' in response
+    assert 'fitness_handler_errors_total{handler="failing"} 1' in response
+    assert 'fitness_storage_seconds_count{method="add_water"} 3' in response
+    assert 'fitness_db_rows_total{method="get_weight_history"} 3' in response
+    assert 'fitness_db_seconds_bucket{method="add_water",le="+Inf"} 3' in response
+    assert "fitness_cache_hits" in response and 'method="get_report"' not in response
+    stats = metrics.stats()
+    assert stats['handler']['handler']['count'] == 3 and stats['handler']['failing']['errors'] == 1
+    assert stats['db']['get_weight_history']['p99_ms'] <= stats['db']['get_weight_history']['max_ms']
+    print(f"✅ Метрики: {len(response.splitlines())} строк, методов базы {len(stats['db'])}")
+
+def test_profiling():
+    """Тестирование журнала медленных запросов и профилировщика"""
+    print("\n🐢 Тестирование профилирования...")
+    
+    import logging
+    import os
+    import tempfile
+    import time
+    from profiling import SamplingProfiler, SlowQueryCursor
+    
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger('slow_queries')
+    logger.addHandler(handler)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'slow.db'))
+        db.add_meal(1, "обед", "гречка", 343, 13, 72, 3.4)
+        try:
+            # Порог 0: в журнал попадает каждый запрос вместе с планом
+            SlowQueryCursor.threshold = 0.0
+            db.cache.clear()
+            db.get_daily_meals(1)
+            SlowQueryCursor.threshold = None
+            db.cache.clear()
+            db.get_daily_meals(1)
+        finally:
+            SlowQueryCursor.threshold = None
+            logger.removeHandler(handler)
+            db.close()
+        
+        messages = [record.getMessage() for record in records]
+        assert len(messages) == 1 and "FROM meals" in messages[0]
+        assert "USING INDEX idx_meals_user_date" in messages[0]
+        
+        def busy_loop(seconds):
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                pass
+        
+        profiler = SamplingProfiler(interval=0.002, directory=os.path.join(tmp, 'profiles'))
+        path = profiler.start(10)
+        busy_loop(0.3)
+        profiler.stop()
+        with open(path, encoding='utf-8') as file:
+            lines = file.read().splitlines()
+    
+    stacks = {line.rsplit(' ', 1)[0]: int(line.rsplit(' ', 1)[1]) for line in lines}
+    busy = sum(count for stack, count in stacks.items()
+               if stack.startswith('MainThread;') and 'busy_loop' in stack)
+    assert busy >= 0.5 * sum(count for stack, count in stacks.items() if stack.startswith('MainThread;'))
+    print(f"✅ Медленный запрос с планом в журнале, профиль: {sum(stacks.values())} снимков")
+
+def test_cache():
+    """Тестирование кэша чтений"""
+    print("\n🗃 Тестирование кэша чтений...")
+    
+    import os
+    import tempfile
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'cache.db'))
+        db.add_user(1, "test", "Test")
+        db.add_water(1, 300)
+        
+        assert db.get_daily_water(1) == 300
+        assert db.get_user(1)[0] == 1
+        assert db.get_daily_water(1) == 300
+        assert db.get_user(1)[0] == 1
+        assert db.cache.stats()['hits'] == 2
+        
+        # Записи обновляют закэшированные значения без чтения с диска
+        db.get_daily_totals(1)
+        db.add_water(1, 200)
+        db.add_meal(1, "обед", "гречка", 343, 13, 72, 3.4)
+        assert db.get_daily_water(1) == 500
+        assert db.get_daily_totals(1)['calories'] == 343
+        assert db.get_daily_totals(1)['water_ml'] == 500
+        assert len(db.get_daily_meals(1)) == 1
+        cached = db.get_daily_totals(1)
+        db.close()
+        
+        # Закэшированные итоги совпадают с прочитанными с диска
+        db = Database(os.path.join(tmp, 'cache.db'))
+        assert db.get_daily_totals(1) == cached
+        db.close()
+    
+    cache = UserCache(max_users=2)
+    for user_id in (1, 2, 3):
+        cache.get_or_load(user_id, ('user',), lambda: user_id)
+    assert cache.stats()['evictions'] == 1
+    assert cache.get_or_load(1, ('user',), lambda: 'новое') == 'новое'
+    print(f"✅ Кэш: {cache.stats()}")
+
+def test_web_server():
+    """Тестирование HTTP-сервера"""
+    print("\n🌐 Тестирование HTTP-сервера...")
+    
+    import asyncio
+    import json
+    from http import HTTPStatus
+    from web_server import create_server
+    
+    received = []
+    
+    async def webhook(request):
+        received.append(request.json())
+        return HTTPStatus.OK, {}
+    
+    async def scenario():
+        server = create_server('127.0.0.1', 0)
+        server.route('POST', '/webhook', webhook)
+        await server.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        
+        responses = []
+        body = json.dumps({"update_id": 1}).encode()
+        requests = [
+            b"GET /health HTTP/1.1\r\nHost: x\r\n\r\n",
+            b"POST /webhook HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body),
+            b"GET /missing HTTP/1.1\r\nConnection: close\r\n\r\n",
+        ]
+        # Все запросы идут по одному keep-alive соединению
+        for raw in requests:
+            writer.write(raw)
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(head.split(b"Content-Length: ")[1].split(b"\r\n")[0])
+            responses.append((int(head.split()[1]), json.loads(await reader.readexactly(length))))
+        writer.close()
+        
+        # Некорректная длина тела - 400 и закрытие соединения
+        for length in (b"abc", b"-1", b"+1"):
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            writer.write(b"POST /webhook HTTP/1.1\r\nContent-Length: %s\r\n\r\n" % length)
+            head = await reader.readuntil(b"\r\n\r\n")
+            responses.append((int(head.split()[1]), None))
+            writer.close()
+        await server.stop()
+        return responses
+    
+    responses = asyncio.run(scenario())
+    assert responses[0] == (200, {"status": "ok"})
+    assert responses[1][0] == 200 and received == [{"update_id": 1}]
+    assert responses[2][0] == 404
+    assert [status for status, _ in responses[3:]] == [400, 400, 400]
+    
+    # Тело webhook, которое не является обновлением, получает 400, а не 200 или 500
+    from scheduler import is_update
+    assert is_update({"update_id": 1, "message": {}})
+    assert not any(map(is_update, ([], {}, "x", {"message": 5}, {"update_id": "1"})))
+    print(f"✅ Ответы сервера: {[status for status, _ in responses]}")
+
+def test_scheduler():
+    """Тестирование параллельной обработки обновлений"""
+    print("\n🚦 Тестирование очереди обновлений...")
+    
+    import asyncio
+    import random
+    from types import SimpleNamespace
+    from scheduler import UserOrderedProcessor
+    
+    handled = {}
+    running = []
+    
+    async def handler(user_id, number):
+        running.append(user_id)
+        await asyncio.sleep(random.random() / 100)
+        handled.setdefault(user_id, []).append(number)
+        running.remove(user_id)
+        # Один пользователь никогда не обрабатывается параллельно сам с собой
+        assert user_id not in running
+    
+    async def scenario():
+        processor = UserOrderedProcessor(max_workers=4, max_pending=100)
+        tasks = []
+        for number in range(10):
+            for user_id in range(5):
+                update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+                tasks.append(asyncio.create_task(
+                    processor.process_update(update, handler(user_id, number))))
+        await asyncio.sleep(0)
+        peak = processor.stats()
+        await asyncio.gather(*tasks)
+        return processor, peak
+    
+    processor, peak = asyncio.run(scenario())
+    assert all(numbers == list(range(10)) for numbers in handled.values())
+    assert peak['active'] == 4 and peak['pending'] == 50
+    assert processor.stats()['processed'] == 50
+    
+    # Переполненная очередь не принимает новые обновления
+    processor.pending = processor.max_pending
+    assert not processor.admit() and processor.stats()['rejected'] == 1
+    
+    # polling ждет места в очереди, а не набирает обновления без ограничения
+    async def backpressure():
+        processor = UserOrderedProcessor(max_workers=1, max_pending=2)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(processor.process_update(
+            SimpleNamespace(effective_user=SimpleNamespace(id=user_id)), release.wait()))
+            for user_id in (1, 2)]
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(processor.wait_room())
+        await asyncio.sleep(0.01)
+        assert processor.pending == 2 and not waiter.done()
+        release.set()
+        room = await asyncio.wait_for(waiter, 1)
+        await asyncio.gather(*tasks)
+        return room
+    
+    assert asyncio.run(backpressure()) >= 1
+    
+    # Ошибка сети при getUpdates не останавливает получение обновлений
+    import scheduler
+    from telegram.error import NetworkError
+    
+    class FailingBot:
+        async def get_updates(self, **kwargs):
+            raise NetworkError("connection reset")
+    
+    delay, scheduler.POLL_RETRY_DELAY = scheduler.POLL_RETRY_DELAY, 0
+    try:
+        assert asyncio.run(scheduler.get_updates(FailingBot(), None)) == []
+    finally:
+        scheduler.POLL_RETRY_DELAY = delay
+    print(f"✅ Порядок сохранен для {len(handled)} пользователей")
+
+def test_sharding():
+    """Тестирование шардирования по пользователям"""
+    print("\n🔀 Тестирование шардирования...")
+    
+    import os
+    import tempfile
+    from collections import Counter
+    from sharding import jump_hash, merge_prometheus, reshard, shard_path, update_user_id
+    
+    # Равномерное распределение и перенос только 1/N пользователей при добавлении шарда
+    users = range(1, 20001)
+    counts = Counter(jump_hash(user_id, 4) for user_id in users)
+    assert all(4000 < count < 6000 for count in counts.values())
+    moved = sum(jump_hash(user_id, 4) != jump_hash(user_id, 5) for user_id in users)
+    assert 0.15 < moved / len(users) < 0.25
+    
+    assert update_user_id({"update_id": 1, "message": {"from": {"id": 7}, "chat": {"id": 8}}}) == 7
+    assert update_user_id({"update_id": 1, "callback_query": {"from": {"id": 9}}}) == 9
+    
+    # Метрики воркеров сводятся фронтом: метка shard, HELP и TYPE семейства - по разу
+    worker = ('# HELP fitness_db_seconds Время\n# TYPE fitness_db_seconds histogram\n'
+              'fitness_db_seconds_count{method="add_water"} %d\n'
+              '# TYPE fitness_cache_hits gauge\nfitness_cache_hits %d\n')
+    merged = merge_prometheus([(0, worker % (3, 5)), (1, worker % (4, 6))]).splitlines()
+    assert merged == ['# HELP fitness_db_seconds Время', '# TYPE fitness_db_seconds histogram',
+                      'fitness_db_seconds_count{shard="0",method="add_water"} 3',
+                      'fitness_db_seconds_count{shard="1",method="add_water"} 4',
+                      '# TYPE fitness_cache_hits gauge',
+                      'fitness_cache_hits{shard="0"} 5', 'fitness_cache_hits{shard="1"} 6']
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        base = os.path.join(tmp, 'shards.db')
+        db = Database(base)
+        for user_id in range(1, 41):
+            db.add_user(user_id, None, f"U{user_id}")
+            db.add_water(user_id, user_id)
+            db.add_meal(user_id, "обед", "гречка", 343, 13, 72, 3.4)
+        db.close()
+        
+        assert sum(reshard(1, 3, base)) == 40
+        # Повторный запуск не дописывает строки в заполненные шарды
+        try:
+            reshard(1, 3, base)
+            assert False, "ожидалась ошибка"
+        except ValueError:
+            pass
+        assert sum(reshard(1, 3, base, force=True)) == 40
+        # Из трех шардов обратно в два: id строк разных шардов не конфликтуют
+        assert sum(reshard(3, 2, base)) == 40
+        for shard in range(2):
+            db = Database(shard_path(shard, 2, base))
+            for user_id in range(1, 41):
+                if jump_hash(user_id, 2) == shard:
+                    assert db.get_daily_water(user_id) == user_id
+                    assert len(db.get_daily_meals(user_id)) == 1
+            db.close()
+    print(f"✅ Шарды: {dict(sorted(counts.items()))}, при 4 -> 5 перенесено {moved / len(users):.0%}")
+
+def test_load_test():
+    """Тестирование нагрузочного теста на небольшой нагрузке"""
+    print("\n⏱ Тестирование нагрузочного теста...")
+    
+    import json
+    import os
+    import subprocess
+    import sys
+    import tempfile
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'load.json')
+        # Отдельный процесс: база бота выбирается до импорта config
+        subprocess.run([sys.executable, 'load_test.py', '--users', '50', '--updates', '300',
+                        '--warmup', '50', '--mix', 'meal=1,water=1,menu=1,progress=1,report=1',
+                        '--output', output],
+                       cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+                       capture_output=True, timeout=120)
+        with open(output, encoding='utf-8') as file:
+            results = json.load(file)['results']
+    
+    latency = results['latency_ms']
+    assert results['updates'] == 300 and results['errors'] == {}
+    assert latency['p50'] <= latency['p95'] <= latency['p99'] <= latency['max']
+    assert 0 < results['db_time_share'] <= 1 and results['peak_rss_mb'] > 0
+    assert sum(results['api_calls'].values()) >= 300
+    assert {'add_meals', 'add_water', 'get_report'} <= set(results['db_calls'])
+    print(f"✅ Нагрузочный тест: {results['updates_per_sec']:.0f} обновлений/с, p99 {latency['p99']:.1f}мс")
+
+def test_storage():
+    """Тестирование переносимости хранилища"""
+    print("\n🗄 Тестирование хранилища...")
+    
+    import asyncio
+    import os
+    import tempfile
+    from database import AsyncDatabase
+    from storage import Storage, TABLES, create_storage
+    
+    async def scenario(storage):
+        await storage.connect()
+        await storage.add_user(1, "test", "Test")
+        await storage.add_meals(1, "обед", [("гречка", 343, 13, 72, 3.4), ("курица", 165, 31, 0, 3.6)])
+        await storage.add_water(1, 250)
+        await storage.add_weight(1, 75.5)
+        result = (
+            (await storage.get_user(1))[4],
+            len(await storage.get_daily_meals(1)),
+            await storage.get_daily_water(1),
+            await storage.get_daily_totals(1),
+            [weight for weight, _ in await storage.get_weight_history(1)],
+        )
+        await storage.close()
+        return result
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Database(os.path.join(tmp, 'source.db'))
+        storage = AsyncDatabase(source)
+        assert isinstance(storage, Storage)
+        expected = asyncio.run(scenario(storage))
+        assert expected[:3] == (2000, 2, 250) and expected[3]['calories'] == 508
+        
+        # Перенос всех таблиц пачками в другое хранилище
+        source = Database(os.path.join(tmp, 'source.db'))
+        target = Database(os.path.join(tmp, 'target.db'))
+        for table in TABLES:
+            for rows in source.iter_rows(table, batch=1):
+                target.import_rows(table, rows)
+        source.close()
+        assert target.get_daily_totals(1) == expected[3]
+        target.close()
+    
+    # PostgreSQL проверяется, если задан адрес тестовой базы и установлен asyncpg
+    url = os.getenv('TEST_DATABASE_URL')
+    if url:
+        assert asyncio.run(scenario(create_storage(url)))[:4] == expected[:4]
+        print("✅ PostgreSQL совпадает с SQLite")
+    print(f"✅ Итоги за день: {expected[3]}")
+
+def test_render():
+    """Тестирование готовых экранов"""
+    print("\n🖼 Тестирование экранов...")
+    
+    import render
+    
+    assert "█████░░░░░ 50.0%" in render.water_text(1000, 2000)
+    # Перевыполнение цели не удлиняет полосу
+    assert "██████████ 150.0%" in render.water_text(3000, 2000)
+    assert "0мл / 0мл" in render.water_text(0, 0)
+    
+    meals = [(1, 1, "обед", "гречка", 343, 13.0, 72.0, 3.4, "2024-01-01", None)]
+    totals = {'calories': 343, 'protein': 13.0, 'carbs': 72.0, 'fat': 3.4}
+    text = render.daily_food_text(meals, totals)
+    assert "🍽 Обед: гречка" in text and "Калории: 343" in text
+    assert render.weight_history_text([]) == "📈 История веса пуста"
+    
+    buttons = [row[0].callback_data for row in render.MAIN_MENU.inline_keyboard]
+    assert buttons[0] == "food_menu"
+    print(f"✅ Главное меню: {buttons}")
+
+def test_router():
+    """Тестирование таблицы обработчиков кнопок"""
+    print("\n🧭 Тестирование маршрутизации кнопок...")
+    
+    from router import CallbackRouter, encode
+    
+    async def menu(update, context):
+        pass
+    
+    async def water(update, context, amount):
+        pass
+    
+    async def report(update, context, period, page):
+        pass
+    
+    router = CallbackRouter()
+    router.exact("water_menu", menu)
+    router.prefix("water_", water, int)
+    router.prefix("report_", report, str, int)
+    
+    assert router.resolve("water_menu") == (menu, ())
+    assert router.resolve(encode("water_", 300)) == (water, (300,))
+    assert router.resolve(encode("report_", "week", 2)) == (report, ("week", 2))
+    # Неверные параметры, лишние данные и неизвестные кнопки отбрасываются
+    for data in ("water_abc", "water_", "report_week", "unknown", "", "water_1" * 20):
+        assert router.resolve(data) == (None, None)
+    try:
+        encode("x" * 65)
+        assert False, "длинные данные должны отклоняться"
+    except ValueError:
+        pass
+    print("✅ Кнопки разбираются по таблице")
+
 def test_food_database():
     """Тестирование базы продуктов"""
     print("\n🍎 Тестирование базы продуктов...")
@@ -64,6 +1055,102 @@ def test_food_database():
     
     print("🎉 Все тесты базы продуктов пройдены!")
 
+def test_food_search():
+    """Тестирование поиска продуктов по индексу"""
+    print("\n🔎 Тестирование поиска продуктов...")
+    
+    assert search_foods("курица")[0] == "курица грудка"
+    assert search_foods("греч")[0] == "гречка"
+    assert search_foods("броколи")[0] == "брокколи"
+    assert search_foods("курицу с гречкой")[:2] == ["курица грудка", "гречка"]
+    assert search_foods("пицца") == []
+    # Для записи еды нужны все слова запроса; частичные совпадения - только подсказки
+    assert get_food_info("хлеб белый") is None and "рис белый" in search_foods("хлеб белый")
+    assert get_food_info("куриный суп") is None
+    assert get_food_info("броколи") == get_food_info("брокколи")
+    print("✅ Поиск по слову, префиксу и с опечаткой")
+
+def test_meal_batch():
+    """Тестирование подсчета нескольких продуктов в одном сообщении"""
+    print("\n🍱 Тестирование приема пищи из нескольких продуктов...")
+    
+    from text_parser import parse
+    
+    # Продукты приходят из того же разбора, что и в process_meal_input
+    intent = parse("обед курица грудка 150 гречка 100г огурцы")
+    items = intent.items
+    assert items == [("курица грудка", 150), ("гречка", 100)]
+    assert intent.leftover == "огурцы"
+    
+    meal = calculate_meals_nutrition(items + [("пицца", 100)])
+    assert meal['missing'] == ["пицца"]
+    assert meal['items'][0] == {'name': "курица грудка", 'grams': 150,
+                                **calculate_meal_nutrition("курица грудка", 150)}
+    assert meal['totals']['calories'] == 247 + 343
+    print(f"✅ Итого за прием пищи: {meal['totals']}")
+
+def test_text_parser():
+    """Тестирование разбора текстовых сообщений"""
+    print("\n💬 Тестирование разбора сообщений...")
+    
+    from text_parser import parse
+    
+    meal = parse("Обед курица грудка 150 гречка 0.1кг огурцы")
+    assert (meal.kind, meal.subtype) == ("meal", "обед")
+    assert meal.items == [("курица грудка", 150), ("гречка", 100.0)]
+    assert meal.leftover == "огурцы"
+    assert parse("ужин творог 5% 200").items == [("творог 5%", 200)]
+    
+    assert parse("вода 300").amount == 300
+    assert parse("выпил 0,5 л").amount == 500
+    assert parse("2 стакана воды").amount == 500
+    assert parse("стакан воды").amount == 250
+    assert parse("вода").amount is None
+    # Раньше любое «мл» считалось водой
+    assert parse("молоко 200мл").kind == "unknown"
+    assert parse("завтрак молоко 200 мл").items == [("молоко", 200)]
+    
+    assert parse("вес 76,4").amount == 76.4
+    # Голое число без подсказки не угадывается, единица без числа - не количество
+    assert parse("75.5").kind == "unknown" and parse("300").kind == "unknown"
+    assert parse("300", expect="water").amount == 300
+    assert parse("мл").kind == "unknown" and parse("выпил стакан").kind == "unknown"
+    assert parse("200 мл").amount == 200
+    assert parse("75", expect="weight") == parse("вес 75 кг")
+    
+    workout = parse("силовые приседания жим_лежа 1 ч")
+    assert (workout.kind, workout.subtype) == ("workout", "силовые")
+    assert workout.items == ["приседания", "жим лежа"] and workout.amount == 60
+    assert parse("что съесть на ужин?").kind == "unknown"
+    assert parse("обед курица 100000000000000000000000").kind == "unknown"
+    print("✅ Прием пищи, вода, вес и тренировка с единицами измерения")
+
+def test_food_catalog():
+    """Тестирование загрузки каталога продуктов из файлов"""
+    print("\n📦 Тестирование каталога продуктов...")
+    
+    import os
+    import tempfile
+    from food_catalog import FoodCatalog
+    from food_database import FOOD_DATABASE
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'products.csv')
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write("name,calories,protein,fat,carbs\n")
+            for name, values in FOOD_DATABASE.items():
+                file.write(f"{name},{','.join(map(str, values))}\n")
+        
+        bin_path = os.path.join(tmp, 'products.bin')
+        FoodCatalog.load(csv_path).save(bin_path)
+        catalog = FoodCatalog.load(bin_path)
+        assert len(catalog) == len(FOOD_DATABASE)
+        for food_id, (name, values) in enumerate(FOOD_DATABASE.items()):
+            assert catalog.name(food_id) == name
+            assert catalog.nutrition(food_id) == values
+        catalog.close()
+    print(f"✅ Каталог из CSV через бинарный файл: {len(FOOD_DATABASE)} продуктов")
+
 def test_config():
     """Тестирование конфигурации"""
     print("\n⚙️ Тестирование конфигурации...")
@@ -83,7 +1170,32 @@ if __name__ == "__main__":
     try:
         test_config()
         test_database()
+        test_connection_pool()
+        test_async_database()
+        test_diary_export_concurrency()
+        test_daily_totals()
+        test_workouts()
+        test_diary_io()
+        test_report()
+        test_chart()
+        test_reminders()
+        test_write_behind()
+        test_backup()
+        test_cache()
+        test_metrics()
+        test_profiling()
+        test_web_server()
+        test_scheduler()
+        test_sharding()
+        test_load_test()
+        test_storage()
+        test_render()
+        test_router()
         test_food_database()
+        test_food_search()
+        test_meal_batch()
+        test_text_parser()
+        test_food_catalog()
         
         print("\n🎉 Все тесты пройдены успешно!")
         print("🤖 Бот готов к запуску!")
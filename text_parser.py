@@ -0,0 +1,166 @@
+import re
+from collections import namedtuple
+
+from config import EXERCISES
+
+# Разбор сообщений пользователя в свободной форме: «обед курица 150 гречка 100г»,
+# «вода 0.5л», «стакан воды», «вес 76,4», «кардио бег 30 мин»
+
+# kind: meal, water, weight, workout или unknown
+# subtype: тип приема пищи или тренировки
+# items: [(продукт, граммы)] для meal, [упражнение] для workout
+# amount: мл воды, кг веса или минуты тренировки (None, если не указано)
+# leftover: слова после последнего количества (продукт без граммов)
+Intent = namedtuple('Intent', 'kind subtype items amount leftover')
+
+MEAL_TYPES = frozenset({'завтрак', 'обед', 'ужин', 'перекус'})
+WORKOUT_TYPES = frozenset({'кардио', 'силовые', 'растяжка'})
+WATER_WORDS = frozenset({'вода', 'воды', 'воду', 'водой', 'водички'})
+WATER_VERBS = frozenset({'выпил', 'выпила', 'попил', 'попила', 'пью'})
+WEIGHT_WORDS = frozenset({'вес', 'вешу', 'взвесился', 'взвесилась'})
+# Упражнения из нескольких слов собираются в одно: «жим лежа»
+KNOWN_EXERCISES = frozenset(name for names in EXERCISES.values() for name in names)
+
+# Единица -> (величина, множитель к базовой единице: г, мл, мин)
+UNITS = {
+    'г': ('mass', 1), 'гр': ('mass', 1), 'грамм': ('mass', 1), 'грамма': ('mass', 1),
+    'граммов': ('mass', 1),
+    'кг': ('mass', 1000),
+    'мл': ('volume', 1),
+    'л': ('volume', 1000), 'литр': ('volume', 1000), 'литра': ('volume', 1000),
+    'литров': ('volume', 1000),
+    'стакан': ('volume', 250), 'стакана': ('volume', 250), 'стаканов': ('volume', 250),
+    'мин': ('time', 1), 'минут': ('time', 1), 'минуты': ('time', 1), 'минута': ('time', 1),
+    'ч': ('time', 60), 'час': ('time', 60), 'часа': ('time', 60), 'часов': ('time', 60),
+}
+
+# Один проход по тексту: слово (в том числе «5%» из названия «творог 5%»)
+# или число с необязательной единицей через пробел или слитно. Длинные
+# единицы перечислены раньше коротких, чтобы «грамм» не разбиралось как «г»
+_UNITS_RE = '|'.join(sorted(UNITS, key=len, reverse=True))
+_TOKEN_RE = re.compile(r'(\d+(?:[.,]\d+)?%|[^\W\d]+)'
+                       r'|(\d+(?:[.,]\d+)?)(?:\s*(' + _UNITS_RE + r')(?![^\W\d]))?')
+
+UNKNOWN = Intent('unknown', None, (), None, '')
+# Самое большое число в сообщении; больше - опечатка, а не количество
+MAX_NUMBER = 100000
+
+def tokenize(text):
+    """Токены сообщения: (слово, None, None) или (None, число, единица)"""
+    for word, number, unit in _TOKEN_RE.findall(text.lower()):
+        if word:
+            yield word.replace('_', ' '), None, None
+        else:
+            value = float(number.replace(',', '.'))
+            yield None, int(value) if value.is_integer() else value, unit or None
+
+def _convert(value, unit, dimension):
+    """Значение в базовой единице величины или None для чужой единицы"""
+    if unit is None:
+        return value
+    unit_dimension, factor = UNITS[unit]
+    if unit_dimension != dimension:
+        return None
+    return value * factor
+
+def _kilograms(value, unit):
+    """Вес в килограммах: без единицы число уже в кг"""
+    if unit is None or unit == 'кг':
+        return value
+    grams = _convert(value, unit, 'mass')
+    return grams / 1000 if grams is not None else None
+
+def parse_items(tokens):
+    """Пары (продукт, граммы) из токенов «продукт граммы продукт граммы ...»
+
+    Название может состоять из нескольких слов; количество без названия
+    перед ним пропускается. Возвращает пары и слова в конце без количества.
+    """
+    items, words = [], []
+    for word, value, unit in tokens:
+        if word is not None:
+            words.append(word)
+        elif words:
+            grams = _convert(value, unit, 'mass')
+            if grams is None:
+                # Объем жидкостей в граммах считается с плотностью воды
+                grams = _convert(value, unit, 'volume')
+            if grams is not None:
+                items.append((' '.join(words), grams))
+            words = []
+    return items, ' '.join(words)
+
+def _workout(workout_type, tokens):
+    exercises, duration = [], None
+    for word, value, unit in tokens:
+        if word is not None:
+            if exercises and f"{exercises[-1]} {word}" in KNOWN_EXERCISES:
+                exercises[-1] += ' ' + word
+            else:
+                exercises.append(word)
+        elif duration is None:
+            duration = _convert(value, unit, 'time')
+    if duration is not None:
+        duration = round(duration)
+    return Intent('workout', workout_type, exercises, duration, '')
+
+def parse(text, expect=None):
+    """Намерение из сообщения.
+
+    expect - ожидаемый вид ответа после подсказки (/add_water, /add_weight):
+    только с ним голое число «300» или «75.5» записывается как вода или вес.
+    Без подсказки такое число не угадывается - это unknown.
+    """
+    tokens = list(tokenize(text))
+    if not tokens or any(value is not None and value > MAX_NUMBER for _, value, _ in tokens):
+        return UNKNOWN
+
+    first = tokens[0][0]
+    if first in MEAL_TYPES:
+        items, leftover = parse_items(tokens[1:])
+        return Intent('meal', first, items, None, leftover)
+    if first in WORKOUT_TYPES:
+        return _workout(first, tokens[1:])
+
+    words = set()
+    numbers = []
+    unit_words = []
+    for word, value, unit in tokens:
+        if word is None:
+            numbers.append((value, unit))
+        elif word in UNITS and UNITS[word][0] == 'volume':
+            unit_words.append((1, word))
+        else:
+            words.add(word)
+    if not numbers and words & WATER_WORDS:
+        # «стакан воды» - один стакан; единица без числа и без воды («мл») - не количество
+        numbers = unit_words
+
+    if words & WEIGHT_WORDS:
+        weights = [_kilograms(value, unit) for value, unit in numbers]
+        weights = [weight for weight in weights if weight is not None]
+        return Intent('weight', None, (), weights[0] if weights else None, '')
+
+    volumes = [_convert(value, unit, 'volume') for value, unit in numbers]
+    volumes = [volume for volume in volumes if volume is not None]
+    has_volume = any(unit is not None and UNITS[unit][0] == 'volume' for _, unit in numbers)
+    if words & WATER_WORDS or (has_volume and words <= WATER_VERBS):
+        return Intent('water', None, (), int(volumes[0]) if volumes else None, '')
+
+    if not words and len(numbers) == 1:
+        value, unit = numbers[0]
+        if unit is None:
+            kind = expect
+        elif unit == 'кг':
+            kind = 'weight'
+        else:
+            kind = expect
+        if kind == 'weight':
+            weight = _kilograms(value, unit)
+            if weight is not None:
+                return Intent('weight', None, (), weight, '')
+        if kind == 'water':
+            volume = _convert(value, unit, 'volume')
+            if volume is not None:
+                return Intent('water', None, (), int(volume), '')
+    return UNKNOWN
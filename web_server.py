@@ -1,20 +1,164 @@
-from flask import Flask
+import asyncio
+import json
+import logging
 import os
+from http import HTTPStatus
 
-app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
-@app.route('/')
-def health_check():
-    return {
+# Ограничения на запрос: заголовки читаются в буфер StreamReader
+MAX_BODY_SIZE = 1024 * 1024
+KEEPALIVE_TIMEOUT = 75  # секунд простоя соединения
+
+class Request:
+    """Разобранный HTTP-запрос"""
+
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+class WebServer:
+    """Минимальный HTTP/1.1 сервер на asyncio.
+
+    Работает в том же цикле событий, что и бот: принимает webhook от
+    Telegram и отвечает на проверки здоровья. Соединения keep-alive
+    переиспользуются, обработчики - корутины handler(request),
+    возвращающие (статус, словарь для JSON-ответа или строка текста).
+    """
+
+    def __init__(self, host='0.0.0.0', port=5000):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self._server = None
+
+    def route(self, method, path, handler):
+        """Регистрация обработчика для метода и пути"""
+        self.routes[method, path] = handler
+
+    async def start(self):
+        """Запуск приема соединений"""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # При port=0 система выбирает свободный порт
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info("HTTP-сервер слушает %s:%s", self.host, self.port)
+
+    async def stop(self):
+        """Остановка сервера"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        """Запуск сервера до отмены"""
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle_connection(self, reader, writer):
+        """Обработка запросов одного соединения по очереди"""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, {}, False)
+                    break
+
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, version = request_line.split(' ', 2)
+                except ValueError:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {}, False)
+                    break
+
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(':')
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+
+                length = headers.get('content-length') or '0'
+                # Только десятичные цифры: int() принял бы и «-1», и «+1», и «1_0»
+                if not (length.isascii() and length.isdigit()):
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {}, False)
+                    break
+                length = int(length)
+                if length > MAX_BODY_SIZE:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                request = Request(method, target.split('?', 1)[0], headers, body)
+                status, payload = await self._dispatch(request)
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, request):
+        """Вызов обработчика маршрута"""
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self.routes):
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "method not allowed"}
+            return HTTPStatus.NOT_FOUND, {"error": "not found"}
+        try:
+            return await handler(request)
+        except Exception:
+            logger.exception("Ошибка обработки %s %s", request.method, request.path)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal error"}
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        """Отправка ответа: JSON для словаря, текст (формат Prometheus) для строки"""
+        status = HTTPStatus(status)
+        if isinstance(payload, str):
+            body = payload.encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            f"\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+
+async def health_check(request):
+    return HTTPStatus.OK, {
         "status": "healthy",
         "service": "fitness-bot",
         "message": "Bot is running"
     }
 
-@app.route('/health')
-def health():
-    return {"status": "ok"}
+async def health(request):
+    return HTTPStatus.OK, {"status": "ok"}
+
+def create_server(host='0.0.0.0', port=5000):
+    """Сервер с маршрутами проверки здоровья"""
+    server = WebServer(host, port)
+    server.route('GET', '/', health_check)
+    server.route('GET', '/health', health)
+    return server
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    asyncio.run(create_server(port=port).serve_forever())